@@ -1,9 +1,9 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.db.models import Q
 from leads.models import Company
 from leads.forms import CompanyForm
-from leads.enrichment import enrich_company
+from leads.enrichment_jobs import enqueue_enrichment
+from leads.enrichment_plan import companies_to_enrich
 import os
 
 
@@ -80,7 +80,7 @@ def company_delete(request, pk):
 
 
 def company_enrich(request):
-    """Enrich companies using AI with optional re-enrichment."""
+    """Queue AI enrichment of companies, with optional re-enrichment."""
     enable_enrichment = os.getenv("GENAI_API_KEY") and os.getenv("OPENAI_API_KEY")
     if not enable_enrichment:
         messages.error(request, 'AI enrichment is disabled. Add GENAI_API_KEY and OPENAI_API_KEY to keys.env to enable.')
@@ -89,72 +89,22 @@ def company_enrich(request):
     mode = request.GET.get('mode', 'empty')
     overwrite = mode == 'all'
 
-    companies = Company.objects.all()
-    if not overwrite:
-        companies = companies.filter(
-            Q(work_website__isnull=True) | Q(work_website='') |
-            Q(linkedin__isnull=True) | Q(linkedin='') |
-            Q(company_name__isnull=True) | Q(company_name='') |
-            Q(industry__isnull=True) | Q(industry='') |
-            Q(company_size__isnull=True) |
-            Q(hq_country__isnull=True) | Q(hq_country='') |
-            Q(org_type__isnull=True) | Q(org_type='') |
-            Q(tech_stack__isnull=True) | Q(tech_stack='') |
-            Q(street__isnull=True) | Q(street='') |
-            Q(city__isnull=True) | Q(city='') |
-            Q(state__isnull=True) | Q(state='') |
-            Q(postal_code__isnull=True) | Q(postal_code='') |
-            Q(country__isnull=True) | Q(country='') |
-            Q(work_phone__isnull=True) | Q(work_phone='') |
-            Q(facebook__isnull=True) | Q(facebook='')
-        )
-
-    total = companies.count()
-    if total == 0:
+    # Only companies with empty or stale fields that are not cooling down
+    # after repeated failures (see leads/enrichment_plan.py)
+    domains, _ = companies_to_enrich(Company.objects.all(), overwrite)
+    if not domains:
         messages.info(request, 'No companies need enrichment.')
         return redirect('companies:company_list')
 
-    enriched = 0
-    skipped = 0
-    errors = 0
-
-    fields = [
-        'work_website', 'linkedin', 'company_name', 'industry', 'company_size',
-        'hq_country', 'org_type', 'tech_stack', 'street', 'city', 'state',
-        'postal_code', 'country', 'work_phone', 'facebook'
-    ]
-
-    for company in companies:
-        try:
-            enriched_data = enrich_company(company.domain, verbose=False)
-            if not enriched_data:
-                errors += 1
-                continue
-
-            updated = False
-            for field in fields:
-                value = enriched_data.get(field)
-                if value is None or value == '':
-                    continue
-                current = getattr(company, field)
-                if overwrite or not current:
-                    setattr(company, field, value)
-                    updated = True
-
-            if updated:
-                company.save()
-                enriched += 1
-            else:
-                skipped += 1
-        except Exception:
-            errors += 1
-            continue
-
-    msg = f'Company enrichment completed. Enriched {enriched} company(s).'
-    if skipped:
-        msg += f' Skipped {skipped}.'
-    if errors:
-        msg += f' {errors} error(s) occurred.'
-    messages.success(request, msg)
+    # Enrichment runs in the run_enrichment_workers process
+    job = enqueue_enrichment('company', domains, overwrite, source='companies')
+    if job.total:
+        messages.success(
+            request,
+            f'Queued {job.total} company(s) for enrichment (job #{job.pk}). '
+            'Results are saved as the enrichment workers process them.'
+        )
+    else:
+        messages.info(request, 'These companies are already queued for enrichment.')
 
     return redirect('companies:company_list')
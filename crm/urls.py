@@ -10,5 +10,8 @@ urlpatterns = [
     path('ai-enrichment/', views.ai_enrichment, name='ai_enrichment'),
     path('ai-enrichment/stream/', views.ai_enrichment_stream, name='ai_enrichment_stream'),
     path('enrichment-progress/', views.enrichment_progress, name='enrichment_progress'),
+    path('enrichment-providers/', views.enrichment_providers, name='enrichment_providers'),
+    path('enrichment-metrics/', views.enrichment_metrics, name='enrichment_metrics'),
+    path('enrichment-jobs/<int:job_id>/', views.enrichment_job_status, name='enrichment_job_status'),
     path('changelog/', changelog, name='changelog'),
 ]
@@ -1,16 +1,25 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.http import StreamingHttpResponse
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
 from leads.models import Lead, Company
-from leads.enrichment import enrich_company, enrich_lead
+from leads.circuit_breaker import breaker_states
+from leads.enrichment_cache import cache_stats
+from leads.enrichment_jobs import active_jobs, enqueue_enrichment, job_status
+from leads.enrichment_schedule import (
+    budget_form_values, default_budget, describe_budget, parse_budget, prioritized_leads,
+)
+from leads.metrics import metrics_snapshot, recorded_metrics
+from leads.rate_limit import limiter_states
+from leads.singleflight import enrichment_flights
 import csv
 import io
 import os
 import json
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
 
 
 def home(request):
@@ -39,81 +48,51 @@ def ai_enrichment(request):
     leads_to_enrich = leads_to_enrich_q.distinct()
     leads_count = leads_to_enrich.count()
 
-    # Handle POST actions synchronously (keeps view simple and sync)
+    # POST actions only queue the work; run_enrichment_workers processes it
     if request.method == 'POST':
-        if 'enrich_companies' in request.POST:
+        if 'enrich_companies' in request.POST or 'enrich_leads' in request.POST:
             if not enrichment_enabled:
                 messages.error(request, 'AI enrichment is disabled. Add GENAI_API_KEY and OPENAI_API_KEY to keys.env to enable.')
                 return redirect('crm:ai_enrichment')
 
-            enriched = 0
-            errors = 0
-
-            # Enrich companies in parallel (5 workers)
-            def _enrich_one(company):
-                try:
-                    enriched_data = enrich_company(company.domain, verbose=False)
-                    if enriched_data:
-                        if enriched_data.get('work_website'):
-                            company.work_website = enriched_data['work_website']
-                        if enriched_data.get('company_name'):
-                            company.company_name = enriched_data['company_name']
-                        if enriched_data.get('linkedin'):
-                            company.linkedin = enriched_data['linkedin']
-                        company.save()
-                        return {'success': True, 'company': company}
-                    return {'success': False, 'company': company}
-                except Exception as e:
-                    return {'success': False, 'company': company, 'error': str(e)}
-
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                future_to_company = {executor.submit(_enrich_one, c): c for c in companies_needing_enrichment}
-                for future in as_completed(future_to_company):
-                    try:
-                        result = future.result()
-                        if result.get('success'):
-                            enriched += 1
-                        else:
-                            # treat missing data as not-enriched
-                            if result.get('error'):
-                                errors += 1
-                    except Exception:
-                        errors += 1
-
-            messages.success(request, f'AI-enriched {enriched} companies. {errors} errors.')
-            return redirect('crm:ai_enrichment')
-
-        if 'enrich_leads' in request.POST:
-            if not enrichment_enabled:
-                messages.error(request, 'AI enrichment is disabled. Add GENAI_API_KEY and OPENAI_API_KEY to keys.env to enable.')
-                return redirect('crm:ai_enrichment')
-
-            enriched = 0
-            errors = 0
-            for lead in leads_to_enrich:
+            if 'enrich_companies' in request.POST:
+                job = enqueue_enrichment(
+                    'company', companies_needing_enrichment.values_list('domain', flat=True), source='ai_enrichment'
+                )
+                label = 'companies'
+            else:
                 try:
-                    result = enrich_lead(lead, verbose=False, overwrite=True)
-                    if result and not result.get('skipped'):
-                        enriched += 1
-                    elif result is None:
-                        errors += 1
-                except Exception:
-                    errors += 1
-
-            messages.success(request, f'AI-enriched {enriched} leads. {errors} errors.')
+                    budget = parse_budget(request.POST)
+                except ValueError:
+                    messages.error(request, 'The enrichment budget must be a number.')
+                    return redirect('crm:ai_enrichment')
+                # Highest expected value first; a budget defers the rest of the leads
+                ranked = prioritized_leads(leads_to_enrich)
+                job = enqueue_enrichment(
+                    'lead', [email for email, _ in ranked], overwrite=True, source='ai_enrichment',
+                    priorities=dict(ranked), budget=budget,
+                )
+                label = 'leads'
+
+            if job.total:
+                messages.success(
+                    request,
+                    f'Queued {job.total} {label} for AI enrichment (job #{job.pk}, budget: {describe_budget(job.budget)}).'
+                )
+            else:
+                messages.info(request, f'These {label} are already queued for AI enrichment.')
             return redirect('crm:ai_enrichment')
 
     return render(request, 'crm/ai_enrichment.html', {
         'enrichment_enabled': enrichment_enabled,
         'companies_count': companies_count,
         'leads_count': leads_count,
+        'lead_budget': budget_form_values(default_budget()),
     })
 
 
 def enrichment_progress(request):
     """API endpoint to get enrichment progress"""
-    from django.http import JsonResponse
-    
     progress = request.session.get('enrichment_progress', {
         'total': 0,
         'current': 0,
@@ -128,85 +107,103 @@ def enrichment_progress(request):
     if len(progress.get('logs', [])) > 20:
         progress['logs'] = progress['logs'][-20:]
     
+    # Enrichment cache hit/miss counters of this server process
+    progress['cache'] = cache_stats()
+    # Enrichments that waited for a concurrent run of the same domain/email
+    progress['coalesced'] = enrichment_flights.stats()
+    # Queued enrichment jobs (see run_enrichment_workers)
+    progress['jobs'] = [job_status(job.pk) for job in active_jobs()]
+    progress['providers'] = breaker_states()
+    
     return JsonResponse(progress)
 
 
-def ai_enrichment_stream(request):
-    """Streaming endpoint that runs company enrichment in parallel and streams progress as HTML/JS.
-    Opens in a new browser window/tab so the main UI remains responsive.
-    """
-    enrichment_enabled = bool(os.getenv("GENAI_API_KEY") and os.getenv("OPENAI_API_KEY"))
-    if not enrichment_enabled:
-        return StreamingHttpResponse("<html><body><h3>AI enrichment is disabled.</h3></body></html>", content_type='text/html')
-
-    companies = list(Company.objects.filter(
-        work_website__isnull=True
-    ).exclude(domain__in=['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com']))
-
-    total = len(companies)
-
-    def stream():
-        yield "<!doctype html><html><head><meta charset='utf-8'><title>AI Enrichment Progress</title>"
-        yield "<style>body{font-family:Segoe UI,Arial;margin:16px} .progress{width:100%;height:22px;background:#eee;border-radius:4px;overflow:hidden} .bar{height:100%;background:#4caf50;width:0%}</style>"
-        yield "</head><body>"
-        yield f"<h2>AI Enrichment — {total} companies</h2>"
-        yield "<div class='progress'><div id='bar' class='bar'></div></div>"
-        yield "<div id='log' style='margin-top:12px;font-family:monospace;white-space:pre-wrap'></div>"
-
-        if total == 0:
-            yield "<script>document.getElementById('log').textContent = 'No companies to enrich.';</script>"
-            yield "</body></html>"
-            return
+def enrichment_providers(request):
+    """JSON health of the enrichment providers in this server process: circuit breakers and rate limiters."""
+    return JsonResponse({
+        'circuit_breakers': breaker_states(),
+        'rate_limits': limiter_states(),
+    })
 
-        enriched = 0
-        errors = 0
 
-        def _enrich_one(company):
-            try:
-                enriched_data = enrich_company(company.domain, verbose=False)
-                if enriched_data:
-                    if enriched_data.get('work_website'):
-                        company.work_website = enriched_data['work_website']
-                    if enriched_data.get('company_name'):
-                        company.company_name = enriched_data['company_name']
-                    if enriched_data.get('linkedin'):
-                        company.linkedin = enriched_data['linkedin']
-                    company.save()
-                    return {'success': True, 'domain': company.domain, 'name': company.company_name}
-                return {'success': False, 'domain': company.domain}
-            except Exception as e:
-                return {'success': False, 'domain': company.domain, 'error': str(e)}
+def enrichment_metrics(request):
+    """
+    JSON provider call metrics: latency, tokens, cost, outcomes and retries.
+    'process' covers this server process since its last flush; 'recorded'
+    sums what every process flushed in the last ?minutes= (default 60).
+    """
+    try:
+        minutes = max(1, int(request.GET.get('minutes', 60)))
+    except ValueError:
+        return JsonResponse({'error': 'minutes must be an integer'}, status=400)
+    since = timezone.now() - timedelta(minutes=minutes)
+    return JsonResponse({
+        'process': metrics_snapshot(),
+        'recorded': recorded_metrics(since),
+        'recorded_since': since.isoformat(),
+    })
 
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_company = {executor.submit(_enrich_one, c): c for c in companies}
-            completed = 0
-            for future in as_completed(future_to_company):
-                completed += 1
-                try:
-                    res = future.result()
-                    if res.get('success'):
-                        enriched += 1
-                        msg = f"✅ Enriched {res.get('name') or res.get('domain')}"
-                    else:
-                        if res.get('error'):
-                            errors += 1
-                            msg = f"❌ Error {res.get('domain')}: {res.get('error')}"
-                        else:
-                            msg = f"⚠️ Skipped {res.get('domain')} (no data)"
-                except Exception as e:
-                    errors += 1
-                    msg = f"❌ Exception: {str(e)}"
 
-                percent = int((completed / total) * 100)
-                # send progress update and log line (use json.dumps to safely escape content)
-                safe_msg = json.dumps(msg + "\n")
-                yield f"<script>document.getElementById('bar').style.width='{percent}%'; document.getElementById('log').textContent += {safe_msg};</script>"
+def enrichment_job_status(request, job_id):
+    """JSON status of a queued enrichment job."""
+    status = job_status(job_id)
+    if status is None:
+        return JsonResponse({'error': f'Unknown enrichment job {job_id}'}, status=404)
+    return JsonResponse(status)
 
-        # final summary
-        yield f"<script>document.getElementById('log').textContent += '---\nCompleted: {enriched}/{total} enriched, {errors} errors.\n';</script>"
-        yield "</body></html>"
 
-    return StreamingHttpResponse(stream(), content_type='text/html; charset=utf-8')
+def ai_enrichment_stream(request):
+    """Progress page that queues company enrichment and polls the job's status endpoint.
+    Opens in a new browser window/tab so the main UI remains responsive. Pass ?job=<id> to follow
+    an existing job; closing the window does not stop the enrichment.
+    """
+    enrichment_enabled = bool(os.getenv("GENAI_API_KEY") and os.getenv("OPENAI_API_KEY"))
+    if not enrichment_enabled:
+        return HttpResponse("<html><body><h3>AI enrichment is disabled.</h3></body></html>", content_type='text/html')
+
+    job_id = request.GET.get('job')
+    if job_id and job_id.isdigit():
+        job_id = int(job_id)
+    else:
+        domains = Company.objects.filter(
+            work_website__isnull=True
+        ).exclude(
+            domain__in=['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com']
+        ).values_list('domain', flat=True)
+        job_id = enqueue_enrichment('company', domains, source='ai_enrichment_stream').pk
+
+    status = job_status(job_id)
+    if status is None:
+        return HttpResponse(f"<html><body><h3>Unknown enrichment job {job_id}.</h3></body></html>",
+                            content_type='text/html', status=404)
+
+    # The page polls the job's status endpoint; no worker thread is held while the job runs
+    status_url = json.dumps(reverse('crm:enrichment_job_status', args=[job_id]))
+    html = (
+        "<!doctype html><html><head><meta charset='utf-8'><title>AI Enrichment Progress</title>"
+        "<style>body{font-family:Segoe UI,Arial;margin:16px} .progress{width:100%;height:22px;background:#eee;border-radius:4px;overflow:hidden} .bar{height:100%;background:#4caf50;width:0%}</style>"
+        "</head><body>"
+        f"<h2>AI Enrichment — job #{job_id}, {status['total']} {status['kind']} task(s)</h2>"
+        "<div class='progress'><div id='bar' class='bar'></div></div>"
+        "<div id='log' style='margin-top:12px;font-family:monospace;white-space:pre-wrap'></div>"
+        "<script>"
+        "const log = document.getElementById('log');"
+        "let last = null;"
+        "function poll() {"
+        f"  fetch({status_url}).then(r => r.json()).then(status => {{"
+        "    if (status.total === 0) { log.textContent = 'Nothing new to enrich (already queued or up to date).\\n'; return; }"
+        "    const t = status.tasks;"
+        "    const line = `${status.processed}/${status.total}: ${t.done} enriched, ${t.skipped} unchanged, ${t.failed} failed, ${t.running} running`;"
+        "    if (line !== last) { last = line; document.getElementById('bar').style.width = status.percent + '%'; log.textContent += line + '\\n'; }"
+        "    if (status.status === 'queued') { setTimeout(poll, 2000); return; }"
+        "    log.textContent += `---\\nJob ${status.status}: ${t.done}/${status.total} enriched, ${t.failed} failed.\\n`;"
+        "  }).catch(() => setTimeout(poll, 5000));"
+        "}"
+        "poll();"
+        "</script>"
+        "</body></html>"
+    )
+    return HttpResponse(html, content_type='text/html; charset=utf-8')
 
 
 def import_csv(request):
@@ -242,9 +239,8 @@ def import_csv(request):
             print("="*60 + "\n")
             
             created_companies = 0
-            enriched_companies = 0
             created_leads = 0
-            enriched_leads = 0
+            created_emails = []
             skipped_leads = 0
             errors = []
             
@@ -299,15 +295,8 @@ def import_csv(request):
                     lead_name = f"{lead.pdl_first_name or ''} {lead.pdl_last_name or ''}".strip() or email
                     print(f"  [{row_num}/{total_rows}] ✅ Created lead: {lead_name}")
 
-                    if enable_enrichment:
-                        print(f"  [{row_num}/{total_rows}] 🤖 Enriching lead with AI...")
-                        enriched_data = enrich_lead(lead, verbose=True)
-                        if enriched_data:
-                            enriched_leads += 1
-                            print(f"  [{row_num}/{total_rows}] ✅ Lead enriched")
-                        else:
-                            print(f"  [{row_num}/{total_rows}] ⚠️  Lead enrichment skipped or failed")
-                    
+                    created_emails.append(email)
+
                 except Exception as e:
                     errors.append(f"Row {row_num}: {str(e)}")
                     print(f"  [{row_num}/{total_rows}] ❌ Error: {str(e)}")
@@ -319,79 +308,25 @@ def import_csv(request):
             print(f"  Skipped: {skipped_leads} duplicates")
             print("="*60 + "\n")
             
-            # Enrich companies with AI if enabled
+            # Queue AI enrichment; run_enrichment_workers does it outside the request
+            company_job = lead_job = None
             if enable_enrichment and domains_to_enrich:
-                # Filter out free email domains
+                # Filter out free email domains and companies that are already enriched
                 business_domains = [d for d in domains_to_enrich if d not in ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com']]
-                total_to_enrich = len(business_domains)
-                
-                print("\n" + "="*60)
-                print(f"🤖 STARTING AI ENRICHMENT: {total_to_enrich} companies")
-                print("="*60 + "\n")
-                
-                for idx, domain in enumerate(business_domains, start=1):
-                    try:
-                        company = Company.objects.get(domain=domain)
-                        
-                        # Skip if already enriched
-                        if company.work_website and company.company_name:
-                            print(f"  [{idx}/{total_to_enrich}] ⏭️  Already enriched: {domain}")
-                            continue
-                        
-                        # Enrich with AI
-                        print(f"\n  [{idx}/{total_to_enrich}] 🔍 Enriching: {domain}")
-                        enriched_data = enrich_company(domain, verbose=True)
-                        
-                        # Update company with enriched data
-                        if enriched_data.get('work_website'):
-                            company.work_website = enriched_data['work_website']
-                        if enriched_data.get('linkedin'):
-                            company.linkedin = enriched_data['linkedin']
-                        if enriched_data.get('company_name'):
-                            company.company_name = enriched_data['company_name']
-                        if enriched_data.get('industry'):
-                            company.industry = enriched_data['industry']
-                        if enriched_data.get('company_size'):
-                            company.company_size = enriched_data['company_size']
-                        if enriched_data.get('hq_country'):
-                            company.hq_country = enriched_data['hq_country']
-                        if enriched_data.get('org_type'):
-                            company.org_type = enriched_data['org_type']
-                        if enriched_data.get('tech_stack'):
-                            company.tech_stack = enriched_data['tech_stack']
-                        if enriched_data.get('street'):
-                            company.street = enriched_data['street']
-                        if enriched_data.get('city'):
-                            company.city = enriched_data['city']
-                        if enriched_data.get('state'):
-                            company.state = enriched_data['state']
-                        if enriched_data.get('postal_code'):
-                            company.postal_code = enriched_data['postal_code']
-                        if enriched_data.get('country'):
-                            company.country = enriched_data['country']
-                        if enriched_data.get('work_phone'):
-                            company.work_phone = enriched_data['work_phone']
-                        if enriched_data.get('facebook'):
-                            company.facebook = enriched_data['facebook']
-                        
-                        company.save()
-                        enriched_companies += 1
-                        print(f"  ✅ [{idx}/{total_to_enrich}] Saved: {company.company_name or domain}\n")
-                        
-                    except Exception as e:
-                        print(f"  ❌ [{idx}/{total_to_enrich}] Error enriching {domain}: {e}\n")
-                        continue
-                
-                print("="*60)
-                print(f"🎉 AI ENRICHMENT COMPLETED: {enriched_companies}/{total_to_enrich} companies enriched")
-                print("="*60 + "\n")
-            
+                pending_domains = Company.objects.filter(domain__in=business_domains).filter(
+                    Q(work_website__isnull=True) | Q(work_website='') | Q(company_name__isnull=True) | Q(company_name='')
+                ).values_list('domain', flat=True)
+                # Companies first: lead enrichment reuses the company context
+                company_job = enqueue_enrichment('company', pending_domains, source='import_csv')
+            if enable_enrichment and created_emails:
+                lead_job = enqueue_enrichment('lead', created_emails, source='import_csv')
+
             # Show results
             success_msg = f'Import completed! Created {created_leads} leads and {created_companies} companies.'
-            if enable_enrichment and enriched_companies > 0:
-                success_msg += f' AI-enriched {enriched_companies} companies.'
-            if enable_enrichment and enriched_leads > 0:
-                success_msg += f' AI-enriched {enriched_leads} leads.'
+            if company_job and company_job.total:
+                success_msg += f' Queued {company_job.total} companies for AI enrichment (job #{company_job.pk}).'
+            if lead_job and lead_job.total:
+                success_msg += f' Queued {lead_job.total} leads for AI enrichment (job #{lead_job.pk}).'
             success_msg += f' Skipped {skipped_leads} duplicates.'
             
             messages.success(request, success_msg)
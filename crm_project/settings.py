@@ -92,10 +92,101 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Wait for the write lock instead of failing when several processes
+        # write at once (e.g. recalculate_scores --workers). IMMEDIATE
+        # transactions take the lock up front, so concurrent read-then-write
+        # transactions (e.g. parallel enrichment cache writes) wait too
+        # instead of failing with "database is locked".
+        'OPTIONS': {
+            'timeout': 30,
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
 
+# AI enrichment result cache (leads/enrichment_cache.py)
+# Entries expire after ENRICHMENT_CACHE_TTL seconds (0 disables the cache);
+# the least recently used entries are evicted beyond ENRICHMENT_CACHE_MAX_ENTRIES.
+
+ENRICHMENT_CACHE_TTL = int(os.environ.get("ENRICHMENT_CACHE_TTL", 30 * 24 * 3600))
+ENRICHMENT_CACHE_MAX_ENTRIES = int(os.environ.get("ENRICHMENT_CACHE_MAX_ENTRIES", 50000))
+# DuckDuckGo results go stale sooner than extracted company data
+ENRICHMENT_SEARCH_CACHE_TTL = int(os.environ.get("ENRICHMENT_SEARCH_CACHE_TTL", 7 * 24 * 3600))
+
+# Process-wide request rate per enrichment provider (leads/rate_limit.py):
+# rate = sustained requests per second, burst = requests allowed at once.
+# A 429 halves the rate temporarily and pauses the provider with backoff.
+ENRICHMENT_RATE_LIMITS = {
+    'ddgs': {'rate': float(os.environ.get("ENRICHMENT_DDGS_RATE", 1)), 'burst': 2},
+    'openai': {'rate': float(os.environ.get("ENRICHMENT_OPENAI_RATE", 8)), 'burst': 8},
+    'gemini': {'rate': float(os.environ.get("ENRICHMENT_GEMINI_RATE", 4)), 'burst': 4},
+}
+
+# Backend of each enrichment provider role (leads/providers.py).
+# ENRICHMENT_PROVIDER_BACKEND=stub swaps all of them for offline stubs that
+# answer with fixture data after ENRICHMENT_STUB latency/jitter/error rate.
+_ENRICHMENT_BACKEND = os.environ.get("ENRICHMENT_PROVIDER_BACKEND", "")
+ENRICHMENT_PROVIDERS = {
+    'gpt': _ENRICHMENT_BACKEND or 'openai',
+    'gemini': _ENRICHMENT_BACKEND or 'gemini',
+    'search': _ENRICHMENT_BACKEND or 'ddg',
+}
+ENRICHMENT_STUB = {
+    'latency': float(os.environ.get("ENRICHMENT_STUB_LATENCY", 0.5)),
+    'jitter': float(os.environ.get("ENRICHMENT_STUB_JITTER", 0.2)),
+    'error_rate': float(os.environ.get("ENRICHMENT_STUB_ERROR_RATE", 0)),
+    'rate_limit_rate': float(os.environ.get("ENRICHMENT_STUB_RATE_LIMIT_RATE", 0)),
+    'seed': int(os.environ.get("ENRICHMENT_STUB_SEED", 0)),
+}
+
+# Per-provider circuit breakers (leads/circuit_breaker.py): a provider is
+# skipped after failure_threshold consecutive failed calls and tried again
+# after reset_timeout seconds. State: GET /enrichment-providers/
+ENRICHMENT_CIRCUIT_BREAKER = {
+    'failure_threshold': int(os.environ.get("ENRICHMENT_BREAKER_FAILURES", 5)),
+    'reset_timeout': float(os.environ.get("ENRICHMENT_BREAKER_RESET", 60)),
+}
+
+# Enrichment job queue (leads/enrichment_jobs.py): seconds a worker may hold
+# a claimed task before another worker takes it over
+ENRICHMENT_TASK_LEASE = int(os.environ.get("ENRICHMENT_TASK_LEASE", 600))
+
+# ENRICHMENT_ASYNC_LEADS=1 makes the workers enrich each claimed batch of lead
+# tasks concurrently on the asyncio pipeline (leads/enrichment_async.py), with
+# at most ENRICHMENT_ASYNC_CONCURRENCY calls in flight per provider.
+ENRICHMENT_ASYNC_LEADS = os.environ.get("ENRICHMENT_ASYNC_LEADS", "0") == "1"
+ENRICHMENT_ASYNC_CONCURRENCY = {
+    'ddgs': int(os.environ.get("ENRICHMENT_ASYNC_DDGS", 4)),
+    'openai': int(os.environ.get("ENRICHMENT_ASYNC_OPENAI", 16)),
+    'gemini': int(os.environ.get("ENRICHMENT_ASYNC_GEMINI", 16)),
+}
+
+# Provider call metrics (leads/metrics.py, GET /enrichment-metrics/):
+# run_enrichment_workers writes them to the ProviderMetric table every
+# ENRICHMENT_METRICS_FLUSH_INTERVAL seconds (0 = keep them in memory only).
+# ENRICHMENT_MODEL_PRICES overrides USD per million (input, output) tokens.
+ENRICHMENT_METRICS_FLUSH_INTERVAL = int(os.environ.get("ENRICHMENT_METRICS_FLUSH_INTERVAL", 60))
+ENRICHMENT_MODEL_PRICES = {}
+
+# Default budget of lead enrichment jobs (leads/enrichment_schedule.py); 0 = no limit.
+# The enrichment views accept max_calls / max_cost / max_minutes to override it.
+ENRICHMENT_JOB_BUDGET = {
+    'calls': int(os.environ.get("ENRICHMENT_JOB_MAX_CALLS", 0)),
+    'cost_usd': float(os.environ.get("ENRICHMENT_JOB_MAX_COST", 0)),
+    'seconds': int(os.environ.get("ENRICHMENT_JOB_MAX_SECONDS", 0)),
+}
+
+# Field-level re-enrichment (leads/enrichment_plan.py): filled fields are
+# refreshed after max_age_days; a field providers failed to fill max_failures
+# times in a row is not retried until cooldown_days after the last attempt
+ENRICHMENT_FIELD_STALENESS = {
+    'max_age_days': int(os.environ.get("ENRICHMENT_FIELD_MAX_AGE_DAYS", 180)),
+    'max_failures': int(os.environ.get("ENRICHMENT_FIELD_MAX_FAILURES", 3)),
+    'cooldown_days': int(os.environ.get("ENRICHMENT_FIELD_COOLDOWN_DAYS", 30)),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -149,11 +240,19 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': BASE_DIR / 'django_error.log',
         },
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'django': {
             'handlers': ['file'],
             'level': 'ERROR',
         },
+        # Enrichment provider errors, timeouts, rate limit backoff and open circuit breakers
+        'leads': {
+            'handlers': ['console', 'file'],
+            'level': 'WARNING',
+        },
     },
 }
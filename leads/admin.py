@@ -1,15 +1,15 @@
 from django.contrib import admin
 from django.shortcuts import render
 from django.utils.html import format_html
-from .models import Lead, Company
+from .models import Lead, Company, EnrichmentCache, EnrichmentJob, EnrichmentTask, ProviderMetric
 
 
 @admin.register(Company)
 class CompanyAdmin(admin.ModelAdmin):
-    list_display = ['domain', 'company_name', 'industry', 'company_size', 'hq_country', 'created_at']
+    list_display = ['domain', 'company_name', 'industry', 'company_size', 'hq_country', 'enterprise_user_count', 'created_at']
     list_filter = ['industry', 'org_type', 'hq_country']
     search_fields = ['domain', 'company_name', 'industry']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['enterprise_user_count', 'enrichment_state', 'created_at', 'updated_at']
     actions = ['view_details']
     
     @admin.action(description='Ver detalles completos')
@@ -31,6 +31,7 @@ class CompanyAdmin(admin.ModelAdmin):
                         ('Tipo de Organización', company.org_type or '-'),
                         ('Tech Stack', company.tech_stack or '-'),
                         ('Confianza del Dominio', company.domain_confidence_score or '-'),
+                        ('Usuarios Enterprise', company.enterprise_user_count),
                     ]),
                     ('Dirección', [
                         ('Calle', company.street or '-'),
@@ -132,3 +133,33 @@ class LeadAdmin(admin.ModelAdmin):
         else:
             self.message_user(request, 'Por favor selecciona solo un elemento para ver sus detalles.', level='warning')
             return None
+
+
+@admin.register(EnrichmentCache)
+class EnrichmentCacheAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'subject', 'provider', 'prompt_version', 'hits', 'last_used_at', 'expires_at']
+    list_filter = ['kind', 'provider', 'prompt_version']
+    search_fields = ['subject']
+    readonly_fields = ['created_at', 'last_used_at', 'hits']
+
+
+@admin.register(EnrichmentJob)
+class EnrichmentJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'overwrite', 'source', 'status', 'total', 'spent_calls', 'spent_cost_usd', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'source']
+    readonly_fields = ['created_at', 'finished_at']
+
+
+@admin.register(EnrichmentTask)
+class EnrichmentTaskAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'job', 'priority', 'status', 'attempts', 'worker', 'available_at', 'updated_at']
+    list_filter = ['status', 'job__kind']
+    search_fields = ['subject']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(ProviderMetric)
+class ProviderMetricAdmin(admin.ModelAdmin):
+    list_display = ['provider', 'process', 'started_at', 'ended_at', 'calls', 'errors', 'retries', 'latency_p50_ms', 'latency_p95_ms', 'cost_usd']
+    list_filter = ['provider']
+    readonly_fields = ['started_at', 'ended_at']
@@ -0,0 +1,157 @@
+"""
+Per-provider circuit breakers for enrichment.
+
+Every provider call goes through rate_limit.call_with_rate_limit(), which asks
+the provider's breaker first:
+- closed: calls go through; FAILURE_THRESHOLD consecutive failures open it
+- open: calls fail at once with ProviderUnavailable instead of waiting for
+  a timeout; after RESET_TIMEOUT seconds the breaker half-opens
+- half-open: one trial call goes through; success closes the breaker,
+  failure opens it again
+
+Configured by settings.ENRICHMENT_CIRCUIT_BREAKER. enrichment.py routes work
+to providers whose breaker is not open (see route_providers()).
+"""
+
+import logging
+import threading
+import time
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60.0
+
+
+class ProviderUnavailable(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+    def __init__(self, provider, retry_in):
+        super().__init__(f'{provider} circuit is open (retry in {retry_in:.0f}s)')
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Thread-safe closed / open / half-open breaker of one provider."""
+
+    def __init__(self, provider: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.provider = provider
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.status = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.opened_count = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _retry_in(self, now) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - now)
+
+    def is_available(self) -> bool:
+        """True unless the breaker is open (or half-open with its trial call running)."""
+        with self.lock:
+            if self.status == 'closed':
+                return True
+            if self.status == 'open':
+                return self._retry_in(time.monotonic()) == 0
+            return not self.trial_running
+
+    def before_call(self) -> None:
+        """
+        Let a call through or reject it.
+
+        Raises:
+            ProviderUnavailable: If the circuit is open, or half-open with the
+                                 trial call already running
+        """
+        with self.lock:
+            if self.status == 'closed':
+                return
+            now = time.monotonic()
+            if self.status == 'open':
+                if self._retry_in(now) > 0:
+                    self.rejected += 1
+                    raise ProviderUnavailable(self.provider, self._retry_in(now))
+                self.status = 'half_open'
+                self.trial_running = False
+            if self.trial_running:
+                self.rejected += 1
+                raise ProviderUnavailable(self.provider, 0)
+            self.trial_running = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.status = 'closed'
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.status == 'half_open' or self.failures >= self.failure_threshold:
+                if self.status != 'open':
+                    self.opened_count += 1
+                    logger.warning('%s circuit opened after %d consecutive failure(s)', self.provider, self.failures)
+                self.status = 'open'
+                self.opened_at = time.monotonic()
+
+    def abandon(self) -> None:
+        """A call was cancelled before it finished: free the half-open trial slot."""
+        with self.lock:
+            self.trial_running = False
+
+    def state(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            status = self.status
+            if status == 'open' and self._retry_in(now) == 0:
+                status = 'half_open'
+            return {
+                'state': status,
+                'consecutive_failures': self.failures,
+                'retry_in': round(self._retry_in(now), 1) if self.status == 'open' else 0.0,
+                'opened_count': self.opened_count,
+                'rejected_calls': self.rejected,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """The process-wide breaker of a provider (created from settings on first use)."""
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            config = getattr(settings, 'ENRICHMENT_CIRCUIT_BREAKER', {})
+            breaker = _breakers[provider] = CircuitBreaker(
+                provider,
+                config.get('failure_threshold', DEFAULT_FAILURE_THRESHOLD),
+                config.get('reset_timeout', DEFAULT_RESET_TIMEOUT),
+            )
+        return breaker
+
+
+def is_available(provider: str) -> bool:
+    return get_breaker(provider).is_available()
+
+
+def reset_breakers() -> None:
+    """Close every circuit and forget its counters."""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def breaker_states() -> dict:
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {provider: breaker.state() for provider, breaker in breakers.items()}
@@ -1,86 +1,148 @@
 """
 Company enrichment utilities using DuckDuckGo, Gemini, and ChatGPT.
 Adapted from enrich_and_import_companies.py
+
+Provider answers are cached per domain/email in the database
+(see enrichment_cache.py); bump PROMPT_VERSIONS when a prompt changes.
+Requests are paced by the per-provider rate limiters in rate_limit.py;
+while a provider's circuit breaker is open, work is routed to the other one
+(see route_providers()).
+Concurrent enrichments of the same domain/email share one run
+(see singleflight.py). The models and the search behind each step come from
+providers.py.
+Lead enrichment reuses what is known about the lead's company (name, website,
+LinkedIn page, see company_context()) to narrow its searches and prompts.
 """
 
+import contextvars
 import time
 import json
+import logging
 import re
 import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from django.utils import timezone
-from duckduckgo_search import DDGS
-from google import genai
-from openai import OpenAI
-from dotenv import load_dotenv
-
-load_dotenv("keys.env")
-
-# Configure AI clients
-GENAI_API_KEY = os.getenv("GENAI_API_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+from .circuit_breaker import is_available
+from .enrichment_cache import MISS, cached_call, get_cached, set_cached
+from .models import Company
+from .providers import PROVIDER_CALL_TIMEOUT, get_provider
+from .rate_limit import call_with_rate_limit
+from .scoring import FREE_EMAIL_DOMAINS
+from .singleflight import enrichment_flights
+from .web_search import search_tiers
+
+logger = logging.getLogger(__name__)
+
+# Independent provider calls of one enrichment run in parallel on this shared pool;
+# a call that takes longer than PROVIDER_CALL_TIMEOUT seconds counts as failed
+provider_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ENRICHMENT_CALL_WORKERS", "16")),
+    thread_name_prefix="enrichment-call",
+)
+
+# Callables(stage, seconds) notified after each pipeline stage that ran:
+# search, select, extract, merge (used by the benchmark_enrichment command)
+stage_listeners = []
+
+# Fields of the dict returned by enrich_company()
+COMPANY_DATA_FIELDS = (
+    'work_website',
+    'linkedin',
+    'company_name',
+    'industry',
+    'company_size',
+    'hq_country',
+    'org_type',
+    'tech_stack',
+    'street',
+    'city',
+    'state',
+    'postal_code',
+    'country',
+    'work_phone',
+    'facebook',
+)
+
+# Lead extraction with GPT uses a system prompt
+LEAD_GPT_SYSTEM_PROMPT = "You are an expert data extraction assistant. Always respond with JSON only."
+
+# Cache keys include these; bump one when its prompt changes so cached answers are not reused
+PROMPT_VERSIONS = {
+    'url_selection': 'v1',
+    'company': 'v1',
+    'lead': 'v2',
+}
+
+COMPANY_INFO_FIELDS = """{
+    "company_name": "Official company name",
+    "industry": "Industry/sector",
+    "company_size": estimated_employee_count_as_integer_or_null,
+    "hq_country": "Country code like US, UK, CA",
+    "org_type": "one of: private, public, gov, edu, nonprofit",
+    "tech_stack": "Brief technologies description",
+    "street": "Street address if available",
+    "city": "City name",
+    "state": "State/Province",
+    "postal_code": "Postal/ZIP code",
+    "country": "Full country name",
+    "work_phone": "Phone number with country code",
+    "facebook": "Facebook page URL if known"
+}"""
+
+COMPANY_INFO_KEYS = (
+    'company_name',
+    'industry',
+    'company_size',
+    'hq_country',
+    'org_type',
+    'tech_stack',
+    'street',
+    'city',
+    'state',
+    'postal_code',
+    'country',
+    'work_phone',
+    'facebook',
+)
+
+# Batch prompts repeat the schema once, with the domain to key each answer
+COMPANY_BATCH_ITEM_FIELDS = '{\n    "domain": "The domain exactly as given",\n' + COMPANY_INFO_FIELDS[2:]
+
+# Companies per batched extraction request
+COMPANY_BATCH_SIZE = int(os.getenv("ENRICHMENT_BATCH_SIZE", "10"))
+
+LEAD_INFO_FIELDS = """{
+    "first_name": "extracted first name or null",
+    "last_name": "extracted last name or null",
+    "job_title": "current job title or null",
+    "linkedin_url": "LinkedIn profile URL or null (must be linkedin.com/in/...)"
+}"""
 
-# Initialize clients only if keys are available
-gemini_client = genai.Client(api_key=GENAI_API_KEY) if GENAI_API_KEY else None
-gpt_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+LEAD_GPT_INSTRUCTIONS = """Instructions:
+- Extract all available data from titles/snippets/URLs
+- If a LinkedIn URL is present, prefer it
+- If names are in LinkedIn URL (john-smith), infer proper case
+- Return ONLY valid JSON
+"""
 
+LEAD_GEMINI_INSTRUCTIONS = """Return ONLY the JSON, no additional text.
+"""
 
-def collect_candidates(domain: str, search_type="website", max_results: int = 6):
-    """Search for URLs using DuckDuckGo."""
-    company_name = domain.split('.')[0].replace('-', ' ').title()
-    
-    if search_type == "website":
-        queries = [
-            f"{company_name} official site",
-            f"{company_name} company website",
-            f"{company_name} homepage"
-        ]
-    elif search_type == "linkedin":
-        queries = [
-            f"{company_name} official LinkedIn page",
-            f"{company_name} LinkedIn company profile",
-            f"{company_name} site:linkedin.com"
-        ]
-    else:
-        raise ValueError("Unknown search type")
+# Lead prompt of each provider: (instructions, system prompt, temperature)
+LEAD_PROMPTS = {
+    "gpt": (LEAD_GPT_INSTRUCTIONS, LEAD_GPT_SYSTEM_PROMPT, 0.3),
+    "gemini": (LEAD_GEMINI_INSTRUCTIONS, None, None),
+}
 
-    urls = []
-    try:
-        with DDGS() as ddgs:
-            for q in queries:
-                try:
-                    for r in ddgs.text(q, max_results=max_results):
-                        href = r.get("href") or r.get("link")
-                        title = r.get("title", "")
-                        if not href:
-                            continue
-                        urls.append({"title": title, "url": href, "query": q})
-                    time.sleep(0.2)
-                except Exception as e:
-                    print(f"Search error: {e}")
-                    continue
-    except Exception as e:
-        print(f"DDGS error: {e}")
-        return []
-
-    # Remove duplicates
-    seen = set()
-    dedup = []
-    for item in urls:
-        u = item["url"]
-        if u not in seen:
-            seen.add(u)
-            dedup.append(item)
-    return dedup
-
-
-def select_best_with_gemini(domain: str, candidates: list, kind="website"):
-    """Gemini selects the best URL from candidates."""
-    if not candidates or not gemini_client:
-        return None
 
+def build_url_selection_prompt(domain: str, candidates: list, kind="website"):
+    """Prompt asking a model to pick the official URL among search candidates."""
     company_name = domain.split('.')[0].title()
     urls_text = "\n".join([f"- {c['title']} ({c['url']})" for c in candidates])
-    prompt = f"""You are selecting the best URL for a company.
+    return f"""You are selecting the best URL for a company.
 Company: {company_name} (domain: {domain})
 Type: {kind}
 
@@ -91,128 +153,329 @@ Choose the most likely official URL from the list above.
 Respond with ONLY the URL, nothing else. No explanations, no additional text.
 If none match, respond with the first URL from the list.
 """
-    try:
-        response = gemini_client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-        text = response.text.strip()
-        
-        # Extract only the URL from the response
-        for line in text.split('\n'):
-            line = line.strip()
-            if line.startswith('http://') or line.startswith('https://'):
-                return line
-        
-        # Try to extract from the text using regex
-        urls = re.findall(r'https?://[^\s<>"{}|\\^`\[\]]+', text)
-        if urls:
-            return urls[0]
-        
-        return text
-    except Exception as e:
-        print(f"Gemini error: {e}")
-        return None
 
 
-def get_company_info_with_gpt(domain: str, website: str, linkedin: str):
-    """Use ChatGPT to extract company information."""
-    if not gpt_client:
-        return None
-        
-    company_name = domain.split('.')[0].replace('-', ' ').title()
-    
-    prompt = f"""Based on the domain "{domain}", extract comprehensive company information.
+def build_company_prompt(domain: str, website: str, linkedin: str):
+    """Prompt asking a model for company information as JSON."""
+    return f"""Based on the domain "{domain}", extract comprehensive company information.
 
 Website: {website or 'Unknown'}
 LinkedIn: {linkedin or 'Unknown'}
 
 Return ONLY a JSON object with this exact structure (use null for unknown fields):
-{{
-    "company_name": "Official company name",
-    "industry": "Industry/sector",
-    "company_size": estimated_employee_count_as_integer_or_null,
-    "hq_country": "Country code like US, UK, CA",
-    "org_type": "one of: private, public, gov, edu, nonprofit",
-    "tech_stack": "Brief technologies description",
-    "street": "Street address if available",
-    "city": "City name",
-    "state": "State/Province",
-    "postal_code": "Postal/ZIP code",
-    "country": "Full country name",
-    "work_phone": "Phone number with country code",
-    "facebook": "Facebook page URL if known"
-}}
+{COMPANY_INFO_FIELDS}
 
 Return ONLY the JSON, no additional text."""
 
+
+def build_company_batch_prompt(items: list):
+    """Prompt asking a model for the information of several companies as a JSON array."""
+    companies = "\n".join(
+        f"- {domain} (Website: {website or 'Unknown'}, LinkedIn: {linkedin or 'Unknown'})"
+        for domain, website, linkedin in items
+    )
+    return f"""Extract comprehensive company information for each of these domains.
+
+{companies}
+
+Return ONLY a JSON array with one object per domain, each with this exact structure (use null for unknown fields):
+{COMPANY_BATCH_ITEM_FIELDS}
+
+Return ONLY the JSON array, no additional text."""
+
+
+def build_lead_prompt(email: str, search_results: list, linkedin_url: str = None,
+                      instructions: str = LEAD_GEMINI_INSTRUCTIONS, company: dict = None):
+    """
+    Prompt asking a model for a person's details found in search results, as JSON.
+    `company` is the company_context() of the email's domain, if known.
+    """
+    context = ""
+    for i, result in enumerate(search_results[:10], 1):
+        context += f"\n{i}. Title: {result.get('title', '')}\n"
+        context += f"   URL: {result.get('url', '')}\n"
+        context += f"   Snippet: {result.get('snippet', '')}\n"
+
+    company_text = ""
+    if company:
+        company_text = f"""
+Company: {company['company_name']} (domain: {company['domain']})
+Company website: {company.get('website') or 'Unknown'}
+Company LinkedIn: {company.get('linkedin') or 'Unknown'}
+Prefer results about this person at this company.
+"""
+
+    return f"""Analyze the following search results about a professional with email: {email}
+{company_text}
+LinkedIn URL (if found): {linkedin_url or 'Unknown'}
+
+Search Results:
+{context}
+
+Extract and return ONLY a JSON object with this exact structure:
+{LEAD_INFO_FIELDS}
+
+{instructions}"""
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Time a block (or, as a decorator, a function) as a pipeline stage for stage_listeners."""
+    if not stage_listeners:
+        yield
+        return
+    start = time.perf_counter()
     try:
-        response = gpt_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        response_text = response.choices[0].message.content.strip()
-        
-        # Remove markdown if present
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            response_text = "\n".join(lines[1:-1]) if len(lines) > 2 else response_text
-            if response_text.startswith("json"):
-                response_text = response_text[4:].strip()
-        
-        data = json.loads(response_text)
-        return data
-    except Exception as e:
-        print(f"GPT error: {e}")
-        return None
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for listener in list(stage_listeners):
+            listener(stage, elapsed)
 
 
-def get_company_info_with_gemini(domain: str, website: str, linkedin: str):
-    """Use Gemini to extract company information."""
-    if not gemini_client:
-        return None
-        
+def run_parallel(*calls, timeout: float = None):
+    """
+    Run independent provider calls concurrently and wait for all of them.
+    A call that raises or is still running `timeout` seconds after it started
+    yields None (time spent queued for a pool thread does not count).
+    Returns the results in the order of the calls.
+    """
+    timeout = PROVIDER_CALL_TIMEOUT if timeout is None else timeout
+    started = {}
+
+    def timed(index, call):
+        started[index] = time.monotonic()
+        return call()
+
+    # Calls run in the caller's context, so their spend is charged to its budget (see metrics.py)
+    futures = [
+        provider_executor.submit(contextvars.copy_context().run, timed, index, call)
+        for index, call in enumerate(calls)
+    ]
+    results = []
+    for index, future in enumerate(futures):
+        while True:
+            start = started.get(index)
+            wait = min(timeout, 0.5) if start is None else max(0, start + timeout - time.monotonic())
+            try:
+                results.append(future.result(timeout=wait))
+            except FutureTimeoutError:
+                if start is None:
+                    continue
+                logger.warning('Provider call timed out after %ss', timeout)
+                results.append(None)
+            except Exception:
+                logger.exception('Provider call error')
+                results.append(None)
+            break
+    return results
+
+
+def route_providers(preferred, fallback=("gemini", "gpt")):
+    """
+    Extraction providers to call: those of `preferred` that are configured and
+    whose circuit is not open, or else the first healthy one of `fallback`.
+    Returns an empty list if every provider is down.
+    """
+    def healthy(provider):
+        model = get_provider(provider)
+        return model.configured and is_available(model.service)
+
+    routed = [provider for provider in preferred if healthy(provider)]
+    if routed:
+        return routed
+    return [provider for provider in fallback if healthy(provider)][:1]
+
+
+def parse_url_response(text: str):
+    """Extract the URL a model answered with."""
+    text = text.strip()
+    
+    # Extract only the URL from the response
+    for line in text.split('\n'):
+        line = line.strip()
+        if line.startswith('http://') or line.startswith('https://'):
+            return line
+    
+    # Try to extract from the text using regex
+    urls = re.findall(r'https?://[^\s<>"{}|\\^`\[\]]+', text)
+    if urls:
+        return urls[0]
+    
+    return text
+
+
+def parse_json_response(response_text: str):
+    """Parse a model's JSON answer, removing markdown fences if present."""
+    response_text = response_text.strip()
+    if response_text.startswith("```"):
+        lines = response_text.split("\n")
+        response_text = "\n".join(lines[1:-1]) if len(lines) > 2 else response_text
+        if response_text.startswith("json"):
+            response_text = response_text[4:].strip()
+    return json.loads(response_text)
+
+
+def company_search_queries(domain: str, search_type="website"):
+    """DuckDuckGo queries for a company's website or LinkedIn page (one per search type)."""
     company_name = domain.split('.')[0].replace('-', ' ').title()
     
-    prompt = f"""Based on the domain "{domain}", extract comprehensive company information.
+    if search_type == "website":
+        return [f"{company_name} official site"]
+    elif search_type == "linkedin":
+        return [f"{company_name} site:linkedin.com/company"]
+    raise ValueError("Unknown search type")
 
-Website: {website or 'Unknown'}
-LinkedIn: {linkedin or 'Unknown'}
 
-Return ONLY a JSON object with this exact structure (use null for unknown fields):
-{{
-    "company_name": "Official company name",
-    "industry": "Industry/sector",
-    "company_size": estimated_employee_count_as_integer_or_null,
-    "hq_country": "Country code like US, UK, CA",
-    "org_type": "one of: private, public, gov, edu, nonprofit",
-    "tech_stack": "Brief technologies description",
-    "street": "Street address if available",
-    "city": "City name",
-    "state": "State/Province",
-    "postal_code": "Postal/ZIP code",
-    "country": "Full country name",
-    "work_phone": "Phone number with country code",
-    "facebook": "Facebook page URL if known"
-}}
+def company_query_tiers(domain: str, search_type="website"):
+    """
+    company_search_queries(), then broader queries that only run if it found
+    no candidate (see has_company_candidate()).
+    """
+    company_name = domain.split('.')[0].replace('-', ' ').title()
+    fallback = {
+        "website": [f"{company_name} company website", f"{company_name} homepage"],
+        "linkedin": [f"{company_name} official LinkedIn page", f"{company_name} LinkedIn company profile"],
+    }
+    return [company_search_queries(domain, search_type), fallback[search_type]]
+
+
+def has_company_candidate(domain: str, results: list, search_type="website") -> bool:
+    """Whether the results contain a plausible website / LinkedIn company page of the domain."""
+    if search_type == "linkedin":
+        return any("linkedin.com/company/" in item["url"] for item in results)
+    name = domain.split('.')[0].lower()
+    return any(name in urlparse(item["url"]).netloc.lower() for item in results)
+
+
+def as_candidates(results: list):
+    return [{"title": item["title"], "url": item["url"], "query": item["query"]} for item in results]
+
+
+@timed_stage("search")
+def collect_candidates(domain: str, search_type="website", max_results: int = 12):
+    """
+    Search for URLs using DuckDuckGo.
+    Results are cached per query (see web_search.py).
+    """
+    return as_candidates(search_tiers(
+        company_query_tiers(domain, search_type),
+        lambda results: has_company_candidate(domain, results, search_type),
+        max_results,
+    ))
+
+
+def ask(provider: str, prompt: str, system: str = None, temperature: float = None):
+    """
+    Send a prompt to an extraction provider ("gpt" or "gemini") through its
+    rate limiter and circuit breaker.
+
+    Returns:
+        str: The answer text, or None if the provider is not configured
+    """
+    model = get_provider(provider)
+    if not model.configured:
+        return None
+    return call_with_rate_limit(model.service, lambda: model.complete(prompt, system, temperature))
+
+
+def cache_name(provider: str) -> str:
+    """Provider name used in enrichment cache keys."""
+    return get_provider(provider).cache_name
 
-Return ONLY the JSON, no additional text."""
+
+@timed_stage("select")
+def select_best_url(domain: str, candidates: list, kind="website", provider="gemini"):
+    """Gemini (or GPT while Gemini is down) selects the best URL from candidates."""
+    if not candidates:
+        return None
 
     try:
-        response = gemini_client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-        response_text = response.text.strip()
-        
-        # Remove markdown if present
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            response_text = "\n".join(lines[1:-1]) if len(lines) > 2 else response_text
-            if response_text.startswith("json"):
-                response_text = response_text[4:].strip()
-        
-        data = json.loads(response_text)
-        return data
-    except Exception as e:
-        print(f"Gemini error: {e}")
+        text = ask(provider, build_url_selection_prompt(domain, candidates, kind))
+        return parse_url_response(text) if text is not None else None
+    except Exception:
+        logger.exception('%s error', provider)
+        return None
+
+
+def url_selection_provider():
+    """Gemini selects URLs; GPT takes over while Gemini's circuit is open."""
+    return (route_providers(["gemini"]) or ["gemini"])[0]
+
+
+def find_company_url(domain: str, kind="website", provider="gemini"):
+    """Search DuckDuckGo for a company's website or LinkedIn page and let the provider pick the best one."""
+    candidates = collect_candidates(domain, kind)
+    return select_best_url(domain, candidates, kind, provider) if candidates else None
+
+
+@timed_stage("extract")
+def get_company_info(provider: str, domain: str, website: str, linkedin: str):
+    """Use ChatGPT or Gemini to extract company information."""
+    try:
+        text = ask(provider, build_company_prompt(domain, website, linkedin))
+        return parse_json_response(text) if text is not None else None
+    except Exception:
+        logger.exception('%s error', provider)
+        return None
+
+
+def validate_company_info(data):
+    """
+    Check one extracted company object and normalize its types.
+    Returns the company info dict, or None if it is unusable.
+    """
+    if not isinstance(data, dict):
+        return None
+    info = {key: data.get(key) for key in COMPANY_INFO_KEYS}
+    if all(value in (None, '') for value in info.values()):
         return None
 
+    for key, value in info.items():
+        if value is None or key == 'company_size':
+            continue
+        info[key] = value if isinstance(value, str) else str(value)
 
+    size = info['company_size']
+    if size is not None and not isinstance(size, int):
+        try:
+            info['company_size'] = int(str(size).replace(',', '').strip())
+        except ValueError:
+            info['company_size'] = None
+    return info
+
+
+@timed_stage("extract")
+def get_company_info_batch(provider: str, items: list):
+    """
+    Extract several companies with one request.
+
+    Args:
+        provider: "gpt" or "gemini"
+        items: [(domain, website, linkedin), ...]
+
+    Returns:
+        dict: {domain: validated company info, or None if missing/invalid}
+    """
+    results = {domain: None for domain, _, _ in items}
+    try:
+        text = ask(provider, build_company_batch_prompt(items))
+        if text is None:
+            return results
+        data = parse_json_response(text)
+    except Exception:
+        logger.exception('%s batch error', provider)
+        return results
+
+    by_domain = {domain.lower(): domain for domain in results}
+    for item in data if isinstance(data, list) else []:
+        domain = by_domain.get(str(item.get("domain") or "").strip().lower()) if isinstance(item, dict) else None
+        if domain and results[domain] is None:
+            results[domain] = validate_company_info(item)
+    return results
+
+
+@timed_stage("merge")
 def merge_and_verify_data(gpt_data: dict, gemini_data: dict, domain: str, website: str, linkedin: str):
     """
     Merge and verify data from both GPT and Gemini.
@@ -250,51 +513,45 @@ def merge_and_verify_data(gpt_data: dict, gemini_data: dict, domain: str, websit
     return merged
 
 
-def search_person_with_ddgs(email: str, max_results: int = 6):
-    """Search for person information using DuckDuckGo."""
+def person_search_queries(email: str, company: dict = None):
+    """
+    DuckDuckGo queries for a person: the exact email and their LinkedIn profile.
+    With a company_context() the LinkedIn query names the company and comes first.
+    """
     local_part = email.split('@')[0]
-
-    queries = [
-        f"{email}",
-        f"{email} LinkedIn",
-        f"{local_part} LinkedIn profile",
-        f'"{email}" professional profile',
+    if company:
+        name = re.sub(r'[._+\-\d]+', ' ', local_part).strip() or local_part
+        return [
+            f'{name} "{company["company_name"]}" site:linkedin.com/in',
+            f'"{email}"',
+        ]
+    return [
+        f'"{email}"',
+        f"{local_part} site:linkedin.com/in",
     ]
 
-    results = []
-    ddgs_delay = float(os.getenv("LEAD_ENRICH_DDGS_DELAY", "0.1"))
-    try:
-        with DDGS() as ddgs:
-            for query in queries:
-                try:
-                    for r in ddgs.text(query, max_results=max_results):
-                        href = r.get("href") or r.get("link")
-                        title = r.get("title", "")
-                        snippet = r.get("body", "")
-                        if href:
-                            results.append({
-                                "title": title,
-                                "url": href,
-                                "snippet": snippet,
-                                "query": query,
-                            })
-                    time.sleep(ddgs_delay)
-                except Exception as e:
-                    print(f"Search error for '{query}': {e}")
-                    continue
-    except Exception as e:
-        print(f"DDGS error: {e}")
-        return []
 
-    seen = set()
-    dedup = []
-    for item in results:
-        u = item["url"]
-        if u not in seen:
-            seen.add(u)
-            dedup.append(item)
+def person_query_tiers(email: str, company: dict = None):
+    """
+    person_search_queries() (with a company context: the narrowed LinkedIn
+    query, then the email query), then broader LinkedIn queries. A later tier
+    only runs if the earlier ones found no LinkedIn profile.
+    """
+    queries = person_search_queries(email, company)
+    local_part = email.split('@')[0]
+    fallback = [f"{email} LinkedIn", f"{local_part} LinkedIn profile"]
+    if company:
+        return [queries[:1], queries[1:], fallback]
+    return [queries, fallback]
 
-    return dedup
+
+@timed_stage("search")
+def search_person_with_ddgs(email: str, max_results: int = 10, company: dict = None):
+    """
+    Search for person information using DuckDuckGo.
+    Results are cached per query (see web_search.py); see person_query_tiers().
+    """
+    return search_tiers(person_query_tiers(email, company), extract_linkedin_url, max_results)
 
 
 def extract_linkedin_url(results: list) -> str:
@@ -308,110 +565,23 @@ def extract_linkedin_url(results: list) -> str:
     return None
 
 
-def get_lead_info_with_gpt(email: str, search_results: list, linkedin_url: str = None):
-    """Use ChatGPT to extract lead information from search results."""
-    if not gpt_client or not search_results:
+@timed_stage("extract")
+def get_lead_info(provider: str, email: str, search_results: list, linkedin_url: str = None, company: dict = None):
+    """Use ChatGPT or Gemini to extract lead information from search results."""
+    if not search_results:
         return None
 
-    context = ""
-    for i, result in enumerate(search_results[:10], 1):
-        context += f"\n{i}. Title: {result.get('title', '')}\n"
-        context += f"   URL: {result.get('url', '')}\n"
-        context += f"   Snippet: {result.get('snippet', '')}\n"
-
-    prompt = f"""Analyze the following search results about a professional with email: {email}
-
-LinkedIn URL (if found): {linkedin_url or 'Unknown'}
-
-Search Results:
-{context}
-
-Extract and return ONLY a JSON object with this exact structure:
-{{
-    "first_name": "extracted first name or null",
-    "last_name": "extracted last name or null",
-    "job_title": "current job title or null",
-    "linkedin_url": "LinkedIn profile URL or null (must be linkedin.com/in/...)"
-}}
-
-Instructions:
-- Extract all available data from titles/snippets/URLs
-- If a LinkedIn URL is present, prefer it
-- If names are in LinkedIn URL (john-smith), infer proper case
-- Return ONLY valid JSON
-"""
-
-    try:
-        response = gpt_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert data extraction assistant. Always respond with JSON only.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.3,
-        )
-        response_text = response.choices[0].message.content.strip()
-
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            response_text = "\n".join(lines[1:-1]) if len(lines) > 2 else response_text
-            if response_text.startswith("json"):
-                response_text = response_text[4:].strip()
-
-        return json.loads(response_text)
-    except Exception as e:
-        print(f"GPT error: {e}")
-        return None
-
-
-def get_lead_info_with_gemini(email: str, search_results: list, linkedin_url: str = None):
-    """Use Gemini to extract lead information from search results."""
-    if not gemini_client or not search_results:
-        return None
-
-    context = ""
-    for i, result in enumerate(search_results[:10], 1):
-        context += f"\n{i}. Title: {result.get('title', '')}\n"
-        context += f"   URL: {result.get('url', '')}\n"
-        context += f"   Snippet: {result.get('snippet', '')}\n"
-
-    prompt = f"""Analyze the following search results about a professional with email: {email}
-
-LinkedIn URL (if found): {linkedin_url or 'Unknown'}
-
-Search Results:
-{context}
-
-Extract and return ONLY a JSON object with this exact structure:
-{{
-    "first_name": "extracted first name or null",
-    "last_name": "extracted last name or null",
-    "job_title": "current job title or null",
-    "linkedin_url": "LinkedIn profile URL or null (must be linkedin.com/in/...)"
-}}
-
-Return ONLY the JSON, no additional text.
-"""
-
+    instructions, system, temperature = LEAD_PROMPTS[provider]
     try:
-        response = gemini_client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-        response_text = response.text.strip()
-
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            response_text = "\n".join(lines[1:-1]) if len(lines) > 2 else response_text
-            if response_text.startswith("json"):
-                response_text = response_text[4:].strip()
-
-        return json.loads(response_text)
-    except Exception as e:
-        print(f"Gemini error: {e}")
+        prompt = build_lead_prompt(email, search_results, linkedin_url, instructions, company)
+        text = ask(provider, prompt, system, temperature)
+        return parse_json_response(text) if text is not None else None
+    except Exception:
+        logger.exception('%s error', provider)
         return None
 
 
+@timed_stage("merge")
 def merge_lead_data(gpt_data: dict, gemini_data: dict, linkedin_url: str = None):
     """Merge lead data from GPT and Gemini, preferring agreed values."""
     if not gpt_data and not gemini_data:
@@ -441,70 +611,152 @@ def merge_lead_data(gpt_data: dict, gemini_data: dict, linkedin_url: str = None)
     return merged
 
 
-def enrich_lead(lead, verbose=False, overwrite=False):
-    """Enrich a Lead using DuckDuckGo + Gemini/OpenAI."""
+def company_context(company) -> dict:
+    """
+    What the leads of a domain share: name, website, LinkedIn page and
+    industry of their already enriched Company. Empty for free email
+    domains and companies without a name yet.
+    """
+    if company is None or company.domain in FREE_EMAIL_DOMAINS or not company.company_name:
+        return {}
+    return {
+        "domain": company.domain,
+        "company_name": company.company_name,
+        "website": company.work_website or None,
+        "linkedin": company.linkedin or None,
+        "industry": company.industry or None,
+    }
+
+
+def company_contexts(domains) -> dict:
+    """company_context() of each domain, loaded with one query."""
+    domains = {domain for domain in domains if domain}
+    contexts = {domain: {} for domain in domains}
+    companies = Company.objects.filter(domain__in=domains).only(
+        "domain", "company_name", "work_website", "linkedin", "industry",
+    )
+    contexts.update((company.domain, company_context(company)) for company in companies)
+    return contexts
+
+
+def lead_is_enriched(lead):
+    return all([
+        lead.pdl_first_name,
+        lead.pdl_last_name,
+        lead.pdl_job_title,
+        lead.pdl_linkedin_url,
+    ])
+
+
+def apply_lead_data(lead, ai_data: dict, overwrite=False):
+    """
+    Copy extracted person data onto the lead (without saving).
+    Returns True if any field changed.
+    """
+    updated = False
+
+    if ai_data.get("first_name") and (overwrite or not lead.pdl_first_name):
+        lead.pdl_first_name = ai_data["first_name"]
+        updated = True
+    if ai_data.get("last_name") and (overwrite or not lead.pdl_last_name):
+        lead.pdl_last_name = ai_data["last_name"]
+        updated = True
+    if ai_data.get("job_title") and (overwrite or not lead.pdl_job_title):
+        lead.pdl_job_title = ai_data["job_title"]
+        updated = True
+    if ai_data.get("linkedin_url") and (overwrite or not lead.pdl_linkedin_url):
+        lead.pdl_linkedin_url = ai_data["linkedin_url"]
+        updated = True
+
+    if updated:
+        lead.pdl_job_last_verified = timezone.now()
+    return updated
+
+
+def enrich_lead(lead, verbose=False, overwrite=False, use_cache=True, company: dict = None):
+    """
+    Enrich a Lead using DuckDuckGo + Gemini/OpenAI.
+    Cached provider answers are reused unless use_cache is False; the search
+    only runs if some answer is not cached.
+
+    `company` is the company_context() of the lead's domain; it is looked up
+    if not given (callers enriching many leads load it once per domain with
+    company_contexts()).
+
+    If the same email is already being enriched by another thread, waits for
+    that run and applies its result to this lead instead of calling the
+    providers again.
+    """
     email = lead.email
 
     if verbose:
         print(f"🔍 Enriching lead: {email}")
 
     if not overwrite:
-        has_all = all([
-            lead.pdl_first_name,
-            lead.pdl_last_name,
-            lead.pdl_job_title,
-            lead.pdl_linkedin_url,
-        ])
-        if has_all:
+        if lead_is_enriched(lead):
             if verbose:
                 print("  ⏭️  Skipped (already enriched)")
             return {"skipped": True}
 
-    try:
-        search_results = search_person_with_ddgs(email)
-        if not search_results:
-            return None
+    if company is None:
+        company = company_contexts([lead.company_id]).get(lead.company_id, {})
+    if verbose and company:
+        print(f"  🏢 Company context: {company['company_name']}")
+
+    ai_data, shared = enrichment_flights.do(
+        "lead", email.lower(), lambda: _enrich_lead(lead, verbose, overwrite, use_cache, company)
+    )
+    if shared:
+        if verbose:
+            print("  🔁 Reused the result of a concurrent enrichment")
+        # The other run saved its own instance; this one only needs saving
+        # if its overwrite setting lets it take more of the data
+        if ai_data and apply_lead_data(lead, ai_data, overwrite):
+            lead.save()
+    return ai_data
+
 
-        linkedin_url = extract_linkedin_url(search_results)
-        if verbose and linkedin_url:
-            print(f"  🔗 LinkedIn: {linkedin_url}")
+def _enrich_lead(lead, verbose, overwrite, use_cache, company):
+    email = lead.email
+    found = {}
+    search_lock = threading.Lock()
+
+    def search():
+        # GPT and Gemini run in parallel; whichever needs the search first runs it
+        with search_lock:
+            if not found:
+                found["results"] = search_person_with_ddgs(email, company=company)
+                found["linkedin_url"] = extract_linkedin_url(found["results"])
+                if verbose and found["linkedin_url"]:
+                    print(f"  🔗 LinkedIn: {found['linkedin_url']}")
+        return found["results"], found["linkedin_url"]
+
+    def lead_info(provider):
+        def call():
+            search_results, linkedin_url = search()
+            data = get_lead_info(provider, email, search_results, linkedin_url, company)
+            if data and linkedin_url and not data.get("linkedin_url"):
+                data["linkedin_url"] = linkedin_url
+            return data
+        return cached_call("lead", email, cache_name(provider), PROMPT_VERSIONS["lead"], call, use_cache)
 
+    try:
         fast_mode = os.getenv("LEAD_ENRICH_FAST", "0") == "1"
 
-        if fast_mode:
-            gemini_data = get_lead_info_with_gemini(email, search_results, linkedin_url)
-            ai_data = gemini_data or None
-            if ai_data and linkedin_url and not ai_data.get("linkedin_url"):
-                ai_data["linkedin_url"] = linkedin_url
-        else:
-            gpt_data = get_lead_info_with_gpt(email, search_results, linkedin_url)
-            gemini_data = get_lead_info_with_gemini(email, search_results, linkedin_url)
-            ai_data = merge_lead_data(gpt_data, gemini_data, linkedin_url)
+        # Fast mode asks Gemini only; either mode skips a provider whose circuit is open
+        providers = route_providers(["gemini"] if fast_mode else ["gpt", "gemini"])
+        answers = dict(zip(providers, run_parallel(*(
+            lambda provider=provider: lead_info(provider) for provider in providers
+        ))))
+        ai_data = merge_lead_data(answers.get("gpt"), answers.get("gemini"))
 
         if not ai_data:
             return None
 
-        updated = False
+        if apply_lead_data(lead, ai_data, overwrite):
+            with timed_stage("save"):
+                lead.save()
 
-        if ai_data.get("first_name") and (overwrite or not lead.pdl_first_name):
-            lead.pdl_first_name = ai_data["first_name"]
-            updated = True
-        if ai_data.get("last_name") and (overwrite or not lead.pdl_last_name):
-            lead.pdl_last_name = ai_data["last_name"]
-            updated = True
-        if ai_data.get("job_title") and (overwrite or not lead.pdl_job_title):
-            lead.pdl_job_title = ai_data["job_title"]
-            updated = True
-        if ai_data.get("linkedin_url") and (overwrite or not lead.pdl_linkedin_url):
-            lead.pdl_linkedin_url = ai_data["linkedin_url"]
-            updated = True
-
-        if updated:
-            lead.pdl_job_last_verified = timezone.now()
-            lead.save()
-
-        post_delay = float(os.getenv("LEAD_ENRICH_POST_DELAY", "0.2"))
-        time.sleep(post_delay)
         return ai_data
     except Exception as e:
         if verbose:
@@ -512,62 +764,177 @@ def enrich_lead(lead, verbose=False, overwrite=False):
         return None
 
 
-def enrich_company(domain: str, verbose=False):
+def apply_company_data(company, enriched_data: dict, overwrite=False, fields=None):
+    """
+    Copy enriched company data onto the company (without saving), limited
+    to `fields` if given.
+    Returns True if any field changed.
+    """
+    updated = False
+    for field in COMPANY_DATA_FIELDS:
+        value = enriched_data.get(field)
+        if value is None or value == '' or (fields is not None and field not in fields):
+            continue
+        if overwrite or not getattr(company, field):
+            setattr(company, field, value)
+            updated = True
+    return updated
+
+
+def enrich_companies(domains, verbose=False, use_cache=True, batch_size: int = None, plans: dict = None):
+    """
+    Enrich many company domains, batching the GPT/Gemini extraction.
+
+    Per batch of domains: website/LinkedIn lookups run in parallel, then each
+    provider gets one request for all uncached domains of the batch; domains
+    missing or invalid in a batch answer fall back to a single request.
+    With plans ({domain: CompanyPlan}, see enrichment_plan.py) a domain only
+    gets the lookups and the extraction its plan needs; skipped lookups use
+    the URLs the company already has.
+    Returns {domain: enriched data dict} (same dicts as enrich_company()).
+    """
+    batch_size = batch_size or COMPANY_BATCH_SIZE
+    domains = list(dict.fromkeys(domains))
+    results = {}
+
+    for start in range(0, len(domains), batch_size):
+        batch = domains[start:start + batch_size]
+        if verbose:
+            print(f"🔍 Enriching {len(batch)} companies ({start + len(batch)}/{len(domains)})...")
+
+        url_provider = url_selection_provider()
+        lookups = [
+            (domain, kind) for domain in batch for kind in ("website", "linkedin")
+            if plans is None or plans[domain].needs(kind)
+        ]
+        urls = dict(zip(lookups, run_parallel(*(
+            lambda domain=domain, kind=kind: cached_call(
+                kind, domain, cache_name(url_provider), PROMPT_VERSIONS["url_selection"],
+                lambda: find_company_url(domain, kind, url_provider), use_cache,
+            )
+            for domain, kind in lookups
+        ))))
+        items = [
+            (domain, *(
+                urls[(domain, kind)] if (domain, kind) in urls else plans[domain].known(kind)
+                for kind in ("website", "linkedin")
+            ))
+            for domain in batch
+        ]
+        to_extract = [item for item in items if plans is None or plans[item[0]].extract]
+
+        # Providers whose circuit is open are left out of this batch
+        ai_data = {provider: {} for provider in ("gpt", "gemini")}
+        missing = {provider: [] for provider in route_providers(["gpt", "gemini"])}
+        for provider in ai_data:
+            for item in to_extract:
+                cached = get_cached("company", item[0], cache_name(provider), PROMPT_VERSIONS["company"]) if use_cache else MISS
+                if cached is MISS:
+                    if provider in missing:
+                        missing[provider].append(item)
+                else:
+                    ai_data[provider][item[0]] = cached
+
+        providers = [provider for provider in missing if missing[provider]]
+        answers = run_parallel(*(
+            lambda provider=provider: get_company_info_batch(provider, missing[provider])
+            for provider in providers
+        ))
+
+        # Single requests for the domains the batch answers did not cover
+        fallback = []
+        for provider, answer in zip(providers, answers):
+            for domain, website, linkedin in missing[provider]:
+                info = (answer or {}).get(domain)
+                if info is None:
+                    fallback.append((provider, domain, website, linkedin))
+                else:
+                    ai_data[provider][domain] = info
+                    set_cached("company", domain, cache_name(provider), PROMPT_VERSIONS["company"], info)
+
+        infos = run_parallel(*(
+            lambda provider=provider, domain=domain, website=website, linkedin=linkedin: (
+                get_company_info(provider, domain, website, linkedin)
+            )
+            for provider, domain, website, linkedin in fallback
+        ))
+        for (provider, domain, _, _), info in zip(fallback, infos):
+            ai_data[provider][domain] = info
+            if info is not None:
+                set_cached("company", domain, cache_name(provider), PROMPT_VERSIONS["company"], info)
+
+        for domain, website, linkedin in items:
+            enriched_data = dict.fromkeys(COMPANY_DATA_FIELDS)
+            enriched_data['work_website'] = website
+            enriched_data['linkedin'] = linkedin
+            merged = merge_and_verify_data(
+                ai_data["gpt"].get(domain), ai_data["gemini"].get(domain), domain, website, linkedin
+            )
+            if merged:
+                enriched_data.update({k: v for k, v in merged.items() if v})
+            results[domain] = enriched_data
+
+    return results
+
+
+def enrich_company(domain: str, verbose=False, use_cache=True):
     """
     Enrich a company domain with website, LinkedIn, and AI-extracted data.
+    Cached provider answers are reused unless use_cache is False.
+    Concurrent calls for the same domain wait for and share one run.
     Returns a dict with enriched data.
     """
+    enriched_data, shared = enrichment_flights.do(
+        "company", domain.lower(), lambda: _enrich_company(domain, verbose, use_cache)
+    )
+    if shared and verbose:
+        print(f"🔁 {domain}: reused the result of a concurrent enrichment")
+    # Each caller gets its own copy to update
+    return dict(enriched_data)
+
+
+def _enrich_company(domain: str, verbose, use_cache):
     if verbose:
         print(f"🔍 Enriching: {domain}")
     
-    enriched_data = {
-        'work_website': None,
-        'linkedin': None,
-        'company_name': None,
-        'industry': None,
-        'company_size': None,
-        'hq_country': None,
-        'org_type': None,
-        'tech_stack': None,
-        'street': None,
-        'city': None,
-        'state': None,
-        'postal_code': None,
-        'country': None,
-        'work_phone': None,
-        'facebook': None,
-    }
+    enriched_data = dict.fromkeys(COMPANY_DATA_FIELDS)
     
     try:
-        # Search for website
+        # Search for website and LinkedIn in parallel
         if verbose:
-            print(f"  🔍 Searching website...")
-        web_candidates = collect_candidates(domain, "website")
-        best_website = select_best_with_gemini(domain, web_candidates, "website") if web_candidates else None
+            print(f"  🔍 Searching website and LinkedIn...")
+        url_provider = url_selection_provider()
+        best_website, best_linkedin = run_parallel(
+            lambda: cached_call(
+                "website", domain, cache_name(url_provider), PROMPT_VERSIONS["url_selection"],
+                lambda: find_company_url(domain, "website", url_provider), use_cache,
+            ),
+            lambda: cached_call(
+                "linkedin", domain, cache_name(url_provider), PROMPT_VERSIONS["url_selection"],
+                lambda: find_company_url(domain, "linkedin", url_provider), use_cache,
+            ),
+        )
         if best_website:
             enriched_data['work_website'] = best_website
             if verbose:
                 print(f"  🌐 Website: {best_website}")
-        
-        # Search for LinkedIn
-        if verbose:
-            print(f"  🔍 Searching LinkedIn...")
-        linkedin_candidates = collect_candidates(domain, "linkedin")
-        best_linkedin = select_best_with_gemini(domain, linkedin_candidates, "linkedin") if linkedin_candidates else None
         if best_linkedin:
             enriched_data['linkedin'] = best_linkedin
             if verbose:
                 print(f"  💼 LinkedIn: {best_linkedin}")
         
-        # Get company info with GPT
+        # Get company info with GPT and Gemini in parallel (skipping a provider whose circuit is open)
         if verbose:
-            print(f"  🤖 Enriching with ChatGPT...")
-        gpt_data = get_company_info_with_gpt(domain, best_website, best_linkedin)
-        
-        # Get company info with Gemini
-        if verbose:
-            print(f"  🤖 Enriching with Gemini...")
-        gemini_data = get_company_info_with_gemini(domain, best_website, best_linkedin)
+            print(f"  🤖 Enriching with ChatGPT and Gemini...")
+        providers = route_providers(["gpt", "gemini"])
+        answers = dict(zip(providers, run_parallel(*(
+            lambda provider=provider: cached_call(
+                "company", domain, cache_name(provider), PROMPT_VERSIONS["company"],
+                lambda: get_company_info(provider, domain, best_website, best_linkedin), use_cache,
+            )
+            for provider in providers
+        ))))
+        gpt_data, gemini_data = answers.get("gpt"), answers.get("gemini")
         
         # Merge and verify data from both sources
         if verbose:
@@ -578,9 +945,7 @@ def enrich_company(domain: str, verbose=False):
             enriched_data.update({k: v for k, v in ai_data.items() if v})
             if verbose and ai_data.get('company_name'):
                 print(f"  ✓ Enriched & Verified: {ai_data.get('company_name')}")
-        
-        # Add delay to avoid rate limiting
-        time.sleep(1)
+
         
         return enriched_data
         
@@ -0,0 +1,360 @@
+"""
+Async enrichment pipeline.
+
+Runs the same steps as enrich_company()/enrich_lead() for many entities at
+once on one event loop:
+- Gemini and OpenAI calls use the providers' async sessions (providers.py)
+- DuckDuckGo (sync only) runs in worker threads
+- Each provider has its own semaphore (settings.ENRICHMENT_ASYNC_CONCURRENCY)
+  and shares the process-wide rate limiter of rate_limit.py
+- Independent steps of one entity (website/LinkedIn lookup, GPT/Gemini
+  extraction) run concurrently, each bounded by PROVIDER_CALL_TIMEOUT
+- Providers whose circuit breaker is open are skipped, like in enrichment.py
+- Everything touching the database (enrichment cache, saves) runs on one
+  dedicated thread, so the ORM is never used from the event loop
+- A domain requested twice in one run is enriched once (counted as
+  coalesced in singleflight.enrichment_flights)
+
+Used by the enrichment workers for lead tasks when
+settings.ENRICHMENT_ASYNC_LEADS is on (enrichment_jobs.py), and by the
+benchmark_enrichment command.
+
+Usage:
+    run_company_enrichment(domains, on_result=save_company)
+    run_lead_enrichment(leads, overwrite=True)
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .enrichment import (
+    COMPANY_DATA_FIELDS,
+    LEAD_PROMPTS,
+    PROMPT_VERSIONS,
+    PROVIDER_CALL_TIMEOUT,
+    apply_lead_data,
+    as_candidates,
+    build_company_prompt,
+    build_lead_prompt,
+    build_url_selection_prompt,
+    cache_name,
+    company_contexts,
+    company_query_tiers,
+    extract_linkedin_url,
+    has_company_candidate,
+    lead_is_enriched,
+    merge_and_verify_data,
+    merge_lead_data,
+    parse_json_response,
+    parse_url_response,
+    person_query_tiers,
+    route_providers,
+    timed_stage,
+    url_selection_provider,
+)
+from .enrichment_cache import MISS, get_cached, set_cached
+from .providers import get_provider
+from .rate_limit import call_with_rate_limit_async
+from .singleflight import enrichment_flights
+from .web_search import dedup_results, live_search, normalize_query, search_cache_key, search_ttl
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CONCURRENCY = {
+    'ddgs': 4,
+    'openai': 16,
+    'gemini': 16,
+}
+
+
+class AsyncEnrichment:
+    """
+    State of one pipeline run: async clients, semaphores and the DB thread.
+    Create it inside the running event loop.
+    """
+
+    def __init__(self, concurrency: dict = None, use_cache: bool = True):
+        limits = {**DEFAULT_CONCURRENCY, **getattr(settings, 'ENRICHMENT_ASYNC_CONCURRENCY', {}), **(concurrency or {})}
+        self.semaphores = {provider: asyncio.Semaphore(limit) for provider, limit in limits.items()}
+        self.use_cache = use_cache
+        self.sessions = {
+            name: get_provider(name).async_session()
+            for name in ('gpt', 'gemini')
+            if get_provider(name).configured
+        }
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='enrichment-db')
+        self.in_flight = {}
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+        # The DB thread closes its connection before it goes away
+        await self.db(_close_connection)
+        self.db_executor.shutdown(wait=True)
+
+    async def db(self, fn, *args):
+        """Run a database call on the dedicated DB thread."""
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, fn, *args)
+
+    async def cached(self, kind, subject, provider, prompt_version, call, ttl=None):
+        """Async counterpart of enrichment_cache.cached_call(); call is a coroutine function."""
+        if self.use_cache:
+            value = await self.db(get_cached, kind, subject, provider, prompt_version)
+            if value is not MISS:
+                return value
+        value = await call()
+        if value is not None:
+            await self.db(set_cached, kind, subject, provider, prompt_version, value, ttl)
+        return value
+
+    # ---- Providers ----
+
+    async def search(self, queries: list, max_results: int) -> list:
+        async def one(query):
+            query = normalize_query(query)
+
+            async def live():
+                async with self.semaphores['ddgs']:
+                    try:
+                        return await asyncio.wait_for(
+                            asyncio.to_thread(live_search, query, max_results), PROVIDER_CALL_TIMEOUT
+                        )
+                    except asyncio.TimeoutError:
+                        logger.warning('Search timed out for %r', query)
+                        return None
+
+            results = await self.cached(*search_cache_key(query, max_results), live, ttl=search_ttl())
+            return [dict(result, query=query) for result in results or []]
+
+        with timed_stage('search'):
+            found = await asyncio.gather(*(one(query) for query in queries))
+        return dedup_results(item for results in found for item in results)
+
+    async def search_tiers(self, tiers: list, found, max_results: int) -> list:
+        """Async web_search.search_tiers()."""
+        results = []
+        for queries in tiers:
+            results = dedup_results(results + await self.search(queries, max_results))
+            if found(results):
+                break
+        return results
+
+    async def ask(self, provider: str, prompt: str, system: str = None, temperature: float = None):
+        """Async enrichment.ask()."""
+        session = self.sessions.get(provider)
+        if session is None:
+            return None
+        service = get_provider(provider).service
+        async with self.semaphores[service]:
+            return await call_with_rate_limit_async(service, lambda: asyncio.wait_for(
+                session.complete(prompt, system, temperature),
+                PROVIDER_CALL_TIMEOUT,
+            ))
+
+    # ---- Companies ----
+
+    async def find_company_url(self, domain: str, kind: str):
+        provider = url_selection_provider()
+
+        async def call():
+            candidates = as_candidates(await self.search_tiers(
+                company_query_tiers(domain, kind),
+                lambda results: has_company_candidate(domain, results, kind),
+                12,
+            ))
+            if not candidates:
+                return None
+            try:
+                with timed_stage('select'):
+                    text = await self.ask(provider, build_url_selection_prompt(domain, candidates, kind))
+                return parse_url_response(text) if text is not None else None
+            except Exception:
+                logger.exception('%s error', provider)
+                return None
+
+        return await self.cached(kind, domain, cache_name(provider), PROMPT_VERSIONS['url_selection'], call)
+
+    async def company_info(self, domain: str, provider: str, website: str, linkedin: str):
+        async def call():
+            try:
+                with timed_stage('extract'):
+                    text = await self.ask(provider, build_company_prompt(domain, website, linkedin))
+                return parse_json_response(text) if text is not None else None
+            except Exception:
+                logger.exception('%s error', provider)
+                return None
+
+        return await self.cached('company', domain, cache_name(provider), PROMPT_VERSIONS['company'], call)
+
+    async def enrich_company(self, domain: str) -> dict:
+        """Async enrich_company(): same result dict."""
+        key = ('company', domain.lower())
+        task = self.in_flight.get(key)
+        if task is None:
+            task = self.in_flight[key] = asyncio.ensure_future(self._enrich_company(domain))
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            enrichment_flights.record_coalesced('company')
+        return dict(await asyncio.shield(task))
+
+    async def _enrich_company(self, domain: str) -> dict:
+        enriched_data = dict.fromkeys(COMPANY_DATA_FIELDS)
+        try:
+            best_website, best_linkedin = await asyncio.gather(
+                self.find_company_url(domain, 'website'),
+                self.find_company_url(domain, 'linkedin'),
+            )
+            enriched_data['work_website'] = best_website
+            enriched_data['linkedin'] = best_linkedin
+
+            providers = route_providers(['gpt', 'gemini'])
+            answers = dict(zip(providers, await asyncio.gather(*(
+                self.company_info(domain, provider, best_website, best_linkedin) for provider in providers
+            ))))
+            gpt_data, gemini_data = answers.get('gpt'), answers.get('gemini')
+            ai_data = merge_and_verify_data(gpt_data, gemini_data, domain, best_website, best_linkedin)
+            if ai_data:
+                enriched_data.update({k: v for k, v in ai_data.items() if v})
+        except Exception:
+            logger.exception('Error enriching %s', domain)
+        return enriched_data
+
+    # ---- Leads ----
+
+    async def lead_info(self, email: str, provider: str, searched, company: dict = None):
+        async def call():
+            search_results, linkedin_url = await searched()
+            if not search_results:
+                return None
+            instructions, system, temperature = LEAD_PROMPTS[provider]
+            try:
+                prompt = build_lead_prompt(email, search_results, linkedin_url, instructions, company)
+                with timed_stage('extract'):
+                    text = await self.ask(provider, prompt, system, temperature)
+                data = parse_json_response(text) if text is not None else None
+            except Exception:
+                logger.exception('%s error', provider)
+                return None
+            if data and linkedin_url and not data.get("linkedin_url"):
+                data["linkedin_url"] = linkedin_url
+            return data
+
+        return await self.cached('lead', email, cache_name(provider), PROMPT_VERSIONS['lead'], call)
+
+    async def search_person(self, email: str, company: dict = None) -> list:
+        """Async search_person_with_ddgs()."""
+        return await self.search_tiers(person_query_tiers(email, company), extract_linkedin_url, 10)
+
+    async def enrich_lead(self, lead, overwrite=False, fast_mode=False, company: dict = None):
+        """
+        Async enrich_lead(): extracts, applies and saves (on the DB thread) the lead's data.
+        `company` is the company_context() of the lead's domain.
+        """
+        if not overwrite and lead_is_enriched(lead):
+            return {"skipped": True}
+
+        # The search runs once, and only if some provider answer is not cached
+        search_task = None
+
+        async def searched():
+            nonlocal search_task
+            if search_task is None:
+                search_task = asyncio.ensure_future(self.search_person(lead.email, company))
+            results = await search_task
+            return results, extract_linkedin_url(results)
+
+        try:
+            providers = route_providers(['gemini'] if fast_mode else ['gpt', 'gemini'])
+            answers = dict(zip(providers, await asyncio.gather(*(
+                self.lead_info(lead.email, provider, searched, company) for provider in providers
+            ))))
+            ai_data = merge_lead_data(answers.get('gpt'), answers.get('gemini'))
+            if not ai_data:
+                return None
+            if apply_lead_data(lead, ai_data, overwrite):
+                await self.db(lead.save)
+            return ai_data
+        except Exception:
+            logger.exception('Lead enrichment error for %s', lead.email)
+            return None
+
+
+def _close_connection():
+    from django.db import connection
+    connection.close()
+
+
+async def enrich_companies_async(domains, on_result=None, concurrency: dict = None, use_cache: bool = True) -> dict:
+    """
+    Enrich many company domains concurrently.
+
+    Args:
+        domains: Iterable of company domains
+        on_result: Optional sync callable(domain, enriched_data), run on the DB thread
+        concurrency: Per-provider concurrency overrides, e.g. {'openai': 8}
+
+    Returns:
+        dict: {domain: enriched_data}
+    """
+    pipeline = AsyncEnrichment(concurrency, use_cache)
+    results = {}
+
+    async def one(domain):
+        data = await pipeline.enrich_company(domain)
+        results[domain] = data
+        if on_result:
+            await pipeline.db(on_result, domain, data)
+
+    try:
+        await asyncio.gather(*(one(domain) for domain in domains))
+    finally:
+        await pipeline.close()
+    return results
+
+
+async def enrich_leads_async(leads, overwrite=False, fast_mode=None, on_result=None,
+                             concurrency: dict = None, use_cache: bool = True) -> dict:
+    """
+    Enrich many leads concurrently; updated leads are saved on the DB thread.
+
+    Args:
+        leads: Lead instances (loaded before the loop starts)
+        fast_mode: Gemini only (defaults to LEAD_ENRICH_FAST, like enrich_lead())
+        on_result: Optional sync callable(lead, ai_data), run on the DB thread
+
+    Returns:
+        dict: {email: ai_data or None}
+    """
+    if fast_mode is None:
+        fast_mode = os.getenv("LEAD_ENRICH_FAST", "0") == "1"
+    pipeline = AsyncEnrichment(concurrency, use_cache)
+    results = {}
+    contexts = {}
+
+    async def one(lead):
+        data = await pipeline.enrich_lead(lead, overwrite, fast_mode, contexts.get(lead.company_id, {}))
+        results[lead.email] = data
+        if on_result:
+            await pipeline.db(on_result, lead, data)
+
+    try:
+        # One company context per domain, shared by its leads
+        contexts.update(await pipeline.db(company_contexts, [lead.company_id for lead in leads]))
+        await asyncio.gather(*(one(lead) for lead in leads))
+    finally:
+        await pipeline.close()
+    return results
+
+
+def run_company_enrichment(domains, on_result=None, **kwargs) -> dict:
+    """Sync entry point for enrich_companies_async()."""
+    return asyncio.run(enrich_companies_async(list(domains), on_result, **kwargs))
+
+
+def run_lead_enrichment(leads, overwrite=False, **kwargs) -> dict:
+    """Sync entry point for enrich_leads_async()."""
+    return asyncio.run(enrich_leads_async(list(leads), overwrite, **kwargs))
@@ -0,0 +1,174 @@
+"""
+Persistent cache for enrichment provider calls.
+
+Every Gemini/OpenAI answer used by enrich_company() and enrich_lead() is
+stored in the EnrichmentCache table, keyed by
+(kind, subject, provider, prompt_version):
+- kind: what was enriched (company, lead, website, linkedin) or search
+- subject: the company domain, lead email or normalized search query
+- provider: gpt, gemini, ...
+- prompt_version: bumped whenever a prompt changes, so old answers are not reused
+
+Entries expire after settings.ENRICHMENT_CACHE_TTL seconds and the least
+recently used ones are evicted once the table grows beyond
+settings.ENRICHMENT_CACHE_MAX_ENTRIES. Failed calls (None) are not cached.
+
+Lookups stay reads: an entry's last_used_at (what eviction orders by) is
+only refreshed once it is older than TOUCH_FRACTION of the TTL, and hits
+are counted in memory (cache_stats()) and added to the entry's hits column
+with that same write.
+"""
+
+import threading
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import EnrichmentCache
+
+
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 50000
+
+# Check the size bound every this many writes rather than on every write
+EVICT_EVERY = 100
+
+# A hit refreshes last_used_at only once it is older than this share of the TTL
+TOUCH_FRACTION = 0.1
+
+# Returned by get_cached() when there is no usable entry
+MISS = object()
+
+_lock = threading.Lock()
+_stats = Counter()
+# Hits per entry pk not written to its hits column yet
+_pending_hits = Counter()
+_writes_since_evict = 0
+
+
+def cache_ttl() -> int:
+    return getattr(settings, 'ENRICHMENT_CACHE_TTL', DEFAULT_TTL)
+
+
+def cache_max_entries() -> int:
+    return getattr(settings, 'ENRICHMENT_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+
+def _count(outcome: str) -> None:
+    with _lock:
+        _stats[outcome] += 1
+
+
+def get_cached(kind: str, subject: str, provider: str, prompt_version: str):
+    """Cached value, or MISS if there is no fresh entry."""
+    if cache_ttl() <= 0:
+        _count('misses')
+        return MISS
+    now = timezone.now()
+    entry = EnrichmentCache.objects.filter(
+        kind=kind,
+        subject=subject.strip().lower(),
+        provider=provider,
+        prompt_version=prompt_version,
+        expires_at__gt=now,
+    ).only('pk', 'value', 'last_used_at').first()
+    if entry is None:
+        _count('misses')
+        return MISS
+    with _lock:
+        _stats['hits'] += 1
+        if len(_pending_hits) > cache_max_entries():
+            # Mostly entries evicted before their next write; the hits column is approximate
+            _pending_hits.clear()
+        _pending_hits[entry.pk] += 1
+        touch = now - entry.last_used_at > timedelta(seconds=cache_ttl() * TOUCH_FRACTION)
+        hits = _pending_hits.pop(entry.pk) if touch else 0
+    if touch:
+        EnrichmentCache.objects.filter(pk=entry.pk).update(hits=F('hits') + hits, last_used_at=now)
+    return entry.value
+
+
+def set_cached(kind: str, subject: str, provider: str, prompt_version: str, value, ttl: int = None) -> None:
+    """Store a provider answer, replacing any previous entry for the same key."""
+    global _writes_since_evict
+
+    if ttl is None:
+        ttl = cache_ttl()
+    if ttl <= 0:
+        return
+    now = timezone.now()
+    EnrichmentCache.objects.update_or_create(
+        kind=kind,
+        subject=subject.strip().lower(),
+        provider=provider,
+        prompt_version=prompt_version,
+        defaults={'value': value, 'last_used_at': now, 'expires_at': now + timedelta(seconds=ttl)},
+    )
+
+    with _lock:
+        _writes_since_evict += 1
+        due = _writes_since_evict >= EVICT_EVERY
+        if due:
+            _writes_since_evict = 0
+    if due:
+        evict()
+
+
+def cached_call(kind: str, subject: str, provider: str, prompt_version: str, fn, use_cache: bool = True,
+                ttl: int = None):
+    """
+    Return the cached answer for this key, or call fn() and cache its result.
+
+    Args:
+        fn: Zero-argument callable doing the provider call
+        use_cache: False skips the lookup (the fresh result is still stored)
+        ttl: Lifetime of a new entry in seconds (default: settings.ENRICHMENT_CACHE_TTL)
+    """
+    if use_cache:
+        value = get_cached(kind, subject, provider, prompt_version)
+        if value is not MISS:
+            return value
+    else:
+        _count('misses')
+
+    value = fn()
+    if value is not None:
+        set_cached(kind, subject, provider, prompt_version, value, ttl)
+    return value
+
+
+def evict(max_entries: int = None) -> int:
+    """
+    Delete expired entries and the least recently used ones beyond max_entries.
+
+    Returns:
+        int: Number of entries deleted
+    """
+    if max_entries is None:
+        max_entries = cache_max_entries()
+    deleted, _ = EnrichmentCache.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    cutoff = list(
+        EnrichmentCache.objects.order_by('-last_used_at', '-pk')
+        .values_list('last_used_at', 'pk')[max_entries:max_entries + 1]
+    )
+    if cutoff:
+        last_used_at, pk = cutoff[0]
+        overflow = EnrichmentCache.objects.filter(last_used_at__lt=last_used_at) | EnrichmentCache.objects.filter(
+            last_used_at=last_used_at, pk__lte=pk
+        )
+        deleted += overflow.delete()[0]
+    return deleted
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters of this process and the current size of the cache."""
+    with _lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+        'entries': EnrichmentCache.objects.count(),
+    }
@@ -0,0 +1,381 @@
+"""
+Durable enrichment job queue.
+
+Views only call enqueue_enrichment() and report job_status(); the enrichment
+itself is done by `python manage.py run_enrichment_workers`, which runs as its
+own process (next to the web service):
+- Each company domain / lead email of a job is one EnrichmentTask row
+- Workers claim tasks inside one write transaction, so a task is never
+  handed to two workers
+- A claimed task is leased for settings.ENRICHMENT_TASK_LEASE seconds; tasks
+  of a worker that died are claimed again once their lease expires, so an
+  interrupted run resumes where it stopped
+- Failed tasks are retried with exponential backoff up to MAX_ATTEMPTS times;
+  tasks for which the providers found nothing are failed without a retry
+- Setting a job's status to 'cancelled' (e.g. in the admin) stops its
+  remaining tasks from being claimed
+- Company tasks only run the stages their fields need (enrichment_plan.py)
+- A claimed batch of lead tasks loads the company context of each email
+  domain once (enrichment.company_contexts()) and is enriched grouped by
+  domain
+- With settings.ENRICHMENT_ASYNC_LEADS a claimed batch of lead tasks is
+  enriched concurrently by the asyncio pipeline (enrichment_async.py)
+- Tasks are claimed by priority across jobs; a job with a budget stops
+  when it is spent and defers its remaining tasks (enrichment_schedule.py)
+"""
+
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from .enrichment import apply_company_data, company_contexts, enrich_companies, enrich_lead
+from .enrichment_async import run_lead_enrichment
+from .enrichment_plan import plan_company, record_attempt
+from .enrichment_schedule import budget_exceeded
+from .metrics import tracking_spend
+from .models import Company, EnrichmentJob, EnrichmentTask, Lead
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_LEASE = 600
+MAX_ATTEMPTS = 3
+# Seconds before the first retry; doubled on each further attempt
+RETRY_BACKOFF = 30
+
+ACTIVE_STATUSES = ('pending', 'running')
+FINISHED_STATUSES = ('done', 'skipped', 'failed', 'deferred')
+
+
+def lease_duration() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'ENRICHMENT_TASK_LEASE', DEFAULT_LEASE))
+
+
+def enqueue_enrichment(kind: str, subjects, overwrite: bool = False, source: str = '',
+                       priorities: dict = None, budget: dict = None) -> EnrichmentJob:
+    """
+    Queue a job enriching the given company domains or lead emails.
+
+    Subjects that already have an unfinished task of the same kind are left
+    out, so pressing a button twice does not enrich everything twice. Lead
+    emails of the same priority are queued grouped by domain, so they are
+    claimed in batches that share a company.
+
+    Args:
+        priorities: Optional {subject: priority}; higher is claimed first
+        budget: Optional limits of the job, e.g. {'calls': 500, 'cost_usd': 1.0, 'seconds': 3600}
+
+    Returns:
+        EnrichmentJob: The new job (already 'completed' if nothing was queued)
+    """
+    with transaction.atomic():
+        busy = set(
+            EnrichmentTask.objects.filter(
+                job__kind=kind, job__status='queued', status__in=ACTIVE_STATUSES,
+            ).values_list('subject', flat=True)
+        )
+        subjects = [subject for subject in dict.fromkeys(subjects) if subject not in busy]
+        if kind == 'lead':
+            subjects.sort(key=lambda email: email.rsplit('@', 1)[-1].lower())
+
+        priorities = priorities or {}
+        job = EnrichmentJob.objects.create(
+            kind=kind, overwrite=overwrite, source=source, total=len(subjects), budget=budget or {},
+        )
+        EnrichmentTask.objects.bulk_create(
+            [EnrichmentTask(job=job, subject=subject, priority=priorities.get(subject, 0)) for subject in subjects],
+            batch_size=1000,
+        )
+        if not subjects:
+            job.status = 'completed'
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'finished_at'])
+    return job
+
+
+def claim_tasks(worker: str, limit: int = 1) -> list:
+    """
+    Atomically claim up to `limit` runnable tasks of one job for a worker.
+
+    Runnable tasks are pending ones whose backoff has passed and running ones
+    whose lease expired. The batch comes from the job of the highest priority
+    runnable task (the oldest job on ties), highest priority first, so a newer
+    job's valuable leads do not wait behind an older job. Tasks whose lease
+    expired MAX_ATTEMPTS times are failed instead of being claimed again.
+
+    Returns:
+        list: Claimed EnrichmentTask rows (with their job), possibly empty
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        expired = EnrichmentTask.objects.filter(status='running', lease_expires_at__lt=now)
+        expired.filter(attempts__gte=MAX_ATTEMPTS).update(
+            status='failed', error='Lease expired (worker stopped)', lease_expires_at=None, updated_at=now,
+        )
+
+        claimable = Q(status='pending', available_at__lte=now) | Q(status='running', lease_expires_at__lt=now)
+        runnable = EnrichmentTask.objects.select_for_update(skip_locked=True).filter(
+            claimable, job__status='queued',
+        ).order_by('-priority', 'job_id', 'id')
+        first = runnable.values_list('job_id', flat=True).first()
+        if first is None:
+            return []
+        ids = list(runnable.filter(job_id=first).values_list('id', flat=True)[:limit])
+        # A job's wall time budget counts from its first claim, not from when it was queued
+        EnrichmentJob.objects.filter(pk=first, started_at__isnull=True).update(started_at=now)
+        # skip_locked is a no-op on SQLite: the update re-checks that each task
+        # is still claimable, and only the rows it changed belong to this worker
+        lease_expires_at = now + lease_duration()
+        EnrichmentTask.objects.filter(claimable, id__in=ids).update(
+            status='running',
+            worker=worker,
+            lease_expires_at=lease_expires_at,
+            attempts=F('attempts') + 1,
+        )
+    return list(
+        EnrichmentTask.objects.select_related('job')
+        .filter(id__in=ids, status='running', worker=worker, lease_expires_at=lease_expires_at)
+        .order_by('-priority', 'id')
+    )
+
+
+def complete_task(task, status: str = 'done', result: dict = None) -> bool:
+    """
+    Record a finished task. Ignored (returns False) if the task's lease was
+    lost to another worker in the meantime.
+    """
+    return bool(EnrichmentTask.objects.filter(pk=task.pk, status='running', worker=task.worker).update(
+        status=status, result=result, error='', lease_expires_at=None, updated_at=timezone.now(),
+    ))
+
+
+def fail_task(task, error: str, retry: bool = True) -> bool:
+    """
+    Schedule a retry with backoff, or fail the task after MAX_ATTEMPTS
+    attempts. retry=False fails it right away (e.g. nothing was found).
+    """
+    retry = retry and task.attempts < MAX_ATTEMPTS
+    now = timezone.now()
+    return bool(EnrichmentTask.objects.filter(pk=task.pk, status='running', worker=task.worker).update(
+        status='pending' if retry else 'failed',
+        available_at=now + timedelta(seconds=RETRY_BACKOFF * 2 ** (task.attempts - 1)) if retry else now,
+        error=error[:1000],
+        lease_expires_at=None,
+        updated_at=now,
+    ))
+
+
+def process_tasks(tasks: list) -> dict:
+    """
+    Enrich the claimed tasks (all of one job) and save the results. The
+    provider calls are charged to the job's budget.
+
+    Returns:
+        dict: Counts of done / skipped / failed / deferred tasks
+    """
+    counts = dict.fromkeys(FINISHED_STATUSES, 0)
+    if not tasks:
+        return counts
+    job = tasks[0].job
+
+    # e.g. the job's wall time ran out while its tasks were waiting
+    reason = job_budget_exceeded(job)
+    if reason:
+        counts['deferred'] = defer_job(job, reason, claimed=tasks)
+        return counts
+
+    with tracking_spend() as spend:
+        _process_job_tasks(job, tasks, counts)
+    charge_job(job, spend)
+
+    finish_job_if_done(job)
+    return counts
+
+
+def _process_job_tasks(job, tasks, counts) -> None:
+    if job.kind == 'company':
+        companies = Company.objects.in_bulk([task.subject for task in tasks])
+        plans = {domain: plan_company(company, job.overwrite) for domain, company in companies.items()}
+        try:
+            results = enrich_companies([domain for domain, plan in plans.items() if plan], plans=plans)
+        except Exception:
+            results = {}
+            logger.exception('Company enrichment error')
+        for task in tasks:
+            outcome = _save_company(task, plans.get(task.subject), results.get(task.subject))
+            counts[outcome] += 1
+    elif getattr(settings, 'ENRICHMENT_ASYNC_LEADS', False):
+        leads = Lead.objects.in_bulk([task.subject for task in tasks])
+        try:
+            results = run_lead_enrichment(leads.values(), job.overwrite) if leads else {}
+        except Exception:
+            results = {}
+            logger.exception('Async lead enrichment error')
+        for task in tasks:
+            lead = leads.get(task.subject)
+            counts[_record_lead_result(task, results.get(task.subject)) if lead else _skip_missing_lead(task)] += 1
+    else:
+        leads = Lead.objects.in_bulk([task.subject for task in tasks])
+        contexts = company_contexts(lead.company_id for lead in leads.values())
+        # Tasks are claimed by priority; leads of one company run back to back
+        for task in sorted(tasks, key=lambda task: task.subject.rsplit('@', 1)[-1].lower()):
+            counts[_enrich_lead_task(task, leads.get(task.subject), contexts, job.overwrite)] += 1
+
+
+def _save_company(task, plan, enriched_data) -> str:
+    if plan is not None and not plan:
+        complete_task(task, 'skipped', {'reason': 'No missing or stale fields'})
+        return 'skipped'
+    try:
+        # Reloaded, so edits made while the providers were called are kept
+        company = Company.objects.filter(domain=task.subject).first()
+        if company is None or plan is None:
+            complete_task(task, 'skipped', {'reason': 'Company no longer exists'})
+            return 'skipped'
+        record_attempt(company, plan, enriched_data)
+        if not enriched_data or not any(enriched_data.get(field) for field in plan.fields):
+            company.save(update_fields=['enrichment_state'])
+            # Searching again would find the same nothing
+            fail_task(task, 'No data found', retry=False)
+            return 'failed'
+        # The plan holds only fields that are empty, stale or (overwriting) all
+        updated = apply_company_data(company, enriched_data, overwrite=True, fields=plan.fields)
+        company.save()
+        complete_task(task, 'done' if updated else 'skipped', {'updated': updated, 'stages': plan.stages()})
+        return 'done' if updated else 'skipped'
+    except Exception as e:
+        fail_task(task, str(e))
+        return 'failed'
+
+
+def _enrich_lead_task(task, lead, contexts, overwrite) -> str:
+    try:
+        if lead is None:
+            return _skip_missing_lead(task)
+        result = enrich_lead(lead, overwrite=overwrite, company=contexts.get(lead.company_id, {}))
+    except Exception as e:
+        fail_task(task, str(e))
+        return 'failed'
+    return _record_lead_result(task, result)
+
+
+def _skip_missing_lead(task) -> str:
+    complete_task(task, 'skipped', {'reason': 'Lead no longer exists'})
+    return 'skipped'
+
+
+def _record_lead_result(task, result) -> str:
+    """Finish a lead task from the enrich_lead() result (None if nothing was found)."""
+    if result is None:
+        fail_task(task, 'No data found', retry=False)
+        return 'failed'
+    if result.get('skipped'):
+        complete_task(task, 'skipped', result)
+        return 'skipped'
+    complete_task(task, 'done', result)
+    return 'done'
+
+
+def job_budget_exceeded(job):
+    """The limit of the job's budget that was reached, or None."""
+    if not job.budget:
+        return None
+    elapsed = (timezone.now() - job.started_at).total_seconds() if job.started_at else 0
+    return budget_exceeded(job.budget, job.spent_calls, job.spent_cost_usd, elapsed)
+
+
+def charge_job(job, spend) -> None:
+    """Add a batch's provider calls and cost to its job; defer the rest of the job once its budget is spent."""
+    if not spend.calls and not spend.cost_usd:
+        return
+    EnrichmentJob.objects.filter(pk=job.pk).update(
+        spent_calls=F('spent_calls') + spend.calls,
+        spent_cost_usd=F('spent_cost_usd') + spend.cost_usd,
+    )
+    job.refresh_from_db(fields=['spent_calls', 'spent_cost_usd', 'status', 'started_at'])
+    reason = job_budget_exceeded(job)
+    if reason and job.status == 'queued':
+        defer_job(job, reason)
+
+
+def defer_job(job, reason: str, claimed=()) -> int:
+    """
+    Stop a job whose budget is spent: its pending tasks (and the given
+    claimed ones) become 'deferred'. Returns the number of deferred tasks.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        deferred = EnrichmentTask.objects.filter(
+            Q(status='pending') | Q(pk__in=[task.pk for task in claimed], status='running'), job=job,
+        ).update(status='deferred', result={'reason': f'Budget spent ({reason})'}, lease_expires_at=None, updated_at=now)
+        EnrichmentJob.objects.filter(pk=job.pk, status='queued').update(status='over_budget', finished_at=now)
+    logger.warning('Enrichment job #%s over budget (%s): %s task(s) deferred', job.pk, reason, deferred)
+    return deferred
+
+
+def finish_job_if_done(job) -> None:
+    if not job.tasks.filter(status__in=ACTIVE_STATUSES).exists():
+        EnrichmentJob.objects.filter(pk=job.pk, status='queued').update(status='completed', finished_at=timezone.now())
+
+
+def has_runnable_work() -> bool:
+    """True while some queued job still has unfinished tasks."""
+    return EnrichmentTask.objects.filter(job__status='queued', status__in=ACTIVE_STATUSES).exists()
+
+
+def unfinished_task_count() -> int:
+    return EnrichmentTask.objects.filter(job__status='queued', status__in=ACTIVE_STATUSES).count()
+
+
+def job_status(job_id: int):
+    """
+    Progress of an enrichment job.
+
+    Returns:
+        dict: Status, task counts, progress, ETA and recent errors, or None
+              if there is no such job
+    """
+    job = EnrichmentJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return None
+
+    counts = dict.fromkeys(ACTIVE_STATUSES + FINISHED_STATUSES, 0)
+    counts.update(dict(job.tasks.values_list('status').annotate(n=Count('id')).order_by()))
+    processed = sum(counts[status] for status in FINISHED_STATUSES)
+
+    now = timezone.now()
+    elapsed = ((job.finished_at or now) - job.created_at).total_seconds()
+    eta_seconds = None
+    if job.status == 'queued' and processed and job.total > processed:
+        eta_seconds = round((job.total - processed) * elapsed / processed, 1)
+
+    errors = list(
+        job.tasks.exclude(error='').order_by('-updated_at').values('subject', 'status', 'attempts', 'error')[:20]
+    )
+    deferred = list(job.tasks.filter(status='deferred').order_by('-priority', 'id').values('subject', 'priority')[:20])
+
+    return {
+        'job_id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'processed': processed,
+        'total': job.total,
+        'percent': processed * 100 // job.total if job.total else 100,
+        'eta_seconds': eta_seconds,
+        'elapsed_seconds': round(elapsed, 1),
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'tasks': counts,
+        'errors': errors,
+        'budget': job.budget,
+        'spent': {'calls': job.spent_calls, 'cost_usd': round(job.spent_cost_usd, 6)},
+        'deferred': deferred,
+    }
+
+
+def active_jobs():
+    return EnrichmentJob.objects.filter(status='queued').order_by('created_at')
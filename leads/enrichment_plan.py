@@ -0,0 +1,159 @@
+"""
+Field-level planning of company re-enrichment.
+
+Company.enrichment_state records, per enriched field, when it was last
+attempted and last filled:
+    {"facebook": {"attempted": "<iso>", "succeeded": "<iso>" or null, "failures": 2}, ...}
+
+plan_company() turns that into the stages a run actually needs:
+- a field is wanted if it is empty, or was last filled more than max_age_days
+  ago (every field when overwriting)
+- a field the providers failed to fill max_failures times in a row is left
+  alone until cooldown_days after its last attempt
+- the website / LinkedIn lookups (search + select) run only for work_website /
+  linkedin; the GPT/Gemini extraction runs only if one of its fields is wanted
+
+Configured by settings.ENRICHMENT_FIELD_STALENESS.
+"""
+
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .enrichment import COMPANY_DATA_FIELDS, COMPANY_INFO_KEYS
+
+
+DEFAULT_STALENESS = {
+    'max_age_days': 180,
+    'max_failures': 3,
+    'cooldown_days': 30,
+}
+
+# Lookup kind of enrich_companies() -> the field it fills
+URL_FIELDS = {
+    'website': 'work_website',
+    'linkedin': 'linkedin',
+}
+
+
+def staleness_config() -> dict:
+    return {**DEFAULT_STALENESS, **getattr(settings, 'ENRICHMENT_FIELD_STALENESS', {})}
+
+
+def is_empty(value) -> bool:
+    return value is None or value == ''
+
+
+def _parse(timestamp):
+    return datetime.fromisoformat(timestamp) if timestamp else None
+
+
+class CompanyPlan:
+    """The fields one company needs, and the pipeline stages that fill them."""
+
+    def __init__(self, company, fields):
+        self.domain = company.domain
+        self.fields = frozenset(fields)
+        # Known URLs are passed to the extraction when their lookup is skipped
+        self.urls = {kind: getattr(company, field) or None for kind, field in URL_FIELDS.items()}
+
+    def needs(self, kind: str) -> bool:
+        """Whether the website or LinkedIn lookup has to run."""
+        return URL_FIELDS[kind] in self.fields
+
+    def known(self, kind: str):
+        return self.urls[kind]
+
+    @property
+    def extract(self) -> bool:
+        return any(field in self.fields for field in COMPANY_INFO_KEYS)
+
+    def stages(self) -> list:
+        return [kind for kind in URL_FIELDS if self.needs(kind)] + (['extract'] if self.extract else [])
+
+    def __bool__(self):
+        return bool(self.fields)
+
+    def __repr__(self):
+        return f"<CompanyPlan({self.domain!r}, stages={self.stages()})>"
+
+
+def wanted_fields(company, overwrite=False, now=None) -> set:
+    """Fields of the company that are empty or stale and not cooling down."""
+    config = staleness_config()
+    now = now or timezone.now()
+    max_age = timedelta(days=config['max_age_days'])
+    cooldown = timedelta(days=config['cooldown_days'])
+    state = company.enrichment_state or {}
+
+    fields = set()
+    for field in COMPANY_DATA_FIELDS:
+        record = state.get(field) or {}
+        attempted = _parse(record.get('attempted'))
+        if (
+            not overwrite
+            and record.get('failures', 0) >= config['max_failures']
+            and attempted and now - attempted < cooldown
+        ):
+            continue
+        succeeded = _parse(record.get('succeeded'))
+        if overwrite or is_empty(getattr(company, field)) or (succeeded and now - succeeded > max_age):
+            fields.add(field)
+    return fields
+
+
+def plan_company(company, overwrite=False, now=None) -> CompanyPlan:
+    return CompanyPlan(company, wanted_fields(company, overwrite, now))
+
+
+def record_attempt(company, plan: CompanyPlan, enriched_data, now=None) -> None:
+    """
+    Record which planned fields the run filled (without saving the company).
+    Fields it did not fill count one more consecutive failure.
+    """
+    now = (now or timezone.now()).isoformat()
+    state = dict(company.enrichment_state or {})
+    for field in plan.fields:
+        record = dict(state.get(field) or {})
+        record['attempted'] = now
+        if enriched_data and not is_empty(enriched_data.get(field)):
+            record['succeeded'] = now
+            record['failures'] = 0
+        else:
+            record.setdefault('succeeded', None)
+            record['failures'] = record.get('failures', 0) + 1
+        state[field] = record
+    company.enrichment_state = state
+
+
+def maybe_needs_enrichment():
+    """
+    Q of the companies a plan could select: some field is empty, or a field
+    has a recorded success that may have gone stale. plan_company() decides.
+    """
+    query = ~Q(enrichment_state={})
+    for field in COMPANY_DATA_FIELDS:
+        query |= Q(**{f'{field}__isnull': True})
+        if field != 'company_size':
+            query |= Q(**{field: ''})
+    return query
+
+
+def companies_to_enrich(companies, overwrite=False):
+    """
+    Domains of the given companies whose plan is not empty.
+
+    Returns:
+        tuple: (domains to enrich, number of companies checked and skipped
+                because their fields are filled and fresh or cooling down)
+    """
+    if not overwrite:
+        companies = companies.filter(maybe_needs_enrichment())
+    now = timezone.now()
+    domains, skipped = [], 0
+    for company in companies.only('domain', 'enrichment_state', *COMPANY_DATA_FIELDS).iterator(chunk_size=2000):
+        if plan_company(company, overwrite, now):
+            domains.append(company.domain)
+        else:
+            skipped += 1
+    return domains, skipped
@@ -0,0 +1,147 @@
+"""
+Priority and budget of enrichment work.
+
+Priority: lead tasks are claimed in order of expected value (lead_priority()):
+- lead_score, plus a bonus per lead stage
+- recency of last_active
+- a penalty for free email domains (little company data to find)
+
+Budget: a job (EnrichmentJob.budget) or a run_enrichment_workers run can be
+limited to a number of provider calls, a cost in USD and/or a wall time in
+seconds (counted from the job's first claimed task); 0 or missing means
+unlimited. Spend is counted with
+metrics.tracking_spend(). Once a limit is reached the job's remaining tasks
+are 'deferred' (reported by job_status()) and can be queued again later.
+Defaults come from settings.ENRICHMENT_JOB_BUDGET.
+"""
+
+import math
+import threading
+import time
+from django.conf import settings
+from django.utils import timezone
+from .scoring import LEAD_STAGES, is_free_email_domain
+
+
+# Added to lead_score per stage, from 'low' (0) to 'enterprise' (40)
+STAGE_BONUS = {stage: 10 * index for index, stage in enumerate(LEAD_STAGES.tolist())}
+# (days since last_active, bonus): the first matching row applies
+RECENCY_BONUS = ((7, 30), (30, 20), (90, 10))
+FREE_EMAIL_PENALTY = 25
+
+BUDGET_KEYS = ('calls', 'cost_usd', 'seconds')
+
+
+def lead_priority(lead_score, lead_stage, last_active, is_free_email, now=None) -> int:
+    """Expected value of enriching a lead; higher is enriched first."""
+    priority = (lead_score or 0) + STAGE_BONUS.get(lead_stage, 0)
+    if last_active is not None:
+        days = ((now or timezone.now()) - last_active).days
+        priority += next((bonus for limit, bonus in RECENCY_BONUS if days <= limit), 0)
+    if is_free_email:
+        priority -= FREE_EMAIL_PENALTY
+    return priority
+
+
+def prioritized_leads(leads) -> list:
+    """
+    [(email, priority), ...] of a Lead queryset, highest priority first
+    (ties keep leads of the same domain together).
+    """
+    now = timezone.now()
+    ranked = [
+        (email, lead_priority(score, stage, last_active, is_free_email_domain(email), now))
+        for email, score, stage, last_active in leads.order_by().values_list(
+            'email', 'lead_score', 'lead_stage', 'last_active',
+        ).iterator(chunk_size=2000)
+    ]
+    ranked.sort(key=lambda item: (-item[1], item[0].rsplit('@', 1)[-1].lower(), item[0]))
+    return ranked
+
+
+def default_budget() -> dict:
+    return {key: value for key, value in getattr(settings, 'ENRICHMENT_JOB_BUDGET', {}).items() if value}
+
+
+def budget_form_values(budget: dict) -> dict:
+    """Initial max_calls / max_cost / max_minutes of a budget form ('' for no limit)."""
+    return {
+        'max_calls': budget.get('calls') or '',
+        'max_cost': f"{budget['cost_usd']:g}" if budget.get('cost_usd') else '',
+        'max_minutes': f"{budget['seconds'] / 60:g}" if budget.get('seconds') else '',
+    }
+
+
+def parse_budget(params) -> dict:
+    """
+    Budget of a job from request parameters max_calls, max_cost (USD) and
+    max_minutes, falling back to settings.ENRICHMENT_JOB_BUDGET.
+
+    Raises:
+        ValueError: If a parameter is not a finite number
+    """
+    budget = default_budget()
+    for param, key, cast, scale in (
+        ('max_calls', 'calls', int, 1),
+        ('max_cost', 'cost_usd', float, 1),
+        ('max_minutes', 'seconds', float, 60),
+    ):
+        value = (params.get(param) or '').strip()
+        if value:
+            value = cast(value) * scale
+            # float() accepts 'inf' and 'nan'
+            if not math.isfinite(value):
+                raise ValueError(f'{param} must be a finite number')
+            if value > 0:
+                budget[key] = int(value) if key != 'cost_usd' else value
+            else:
+                budget.pop(key, None)
+    return budget
+
+
+def budget_exceeded(budget: dict, calls: int, cost_usd: float, seconds: float):
+    """The limit of the budget that was reached ('calls', 'cost_usd', 'seconds'), or None."""
+    spent = {'calls': calls, 'cost_usd': cost_usd, 'seconds': seconds}
+    for key in BUDGET_KEYS:
+        if budget.get(key) and spent[key] >= budget[key]:
+            return key
+    return None
+
+
+def describe_budget(budget: dict) -> str:
+    parts = []
+    if budget.get('calls'):
+        parts.append(f"{budget['calls']} calls")
+    if budget.get('cost_usd'):
+        parts.append(f"${budget['cost_usd']:g}")
+    if budget.get('seconds'):
+        parts.append(f"{budget['seconds'] / 60:g} min")
+    return ', '.join(parts) or 'unlimited'
+
+
+class RunBudget:
+    """Budget of one run_enrichment_workers run, charged by all its worker threads."""
+
+    def __init__(self, budget: dict):
+        self.budget = {key: value for key, value in budget.items() if value}
+        self.started = time.monotonic()
+        self.calls = 0
+        self.cost_usd = 0.0
+        self.lock = threading.Lock()
+
+    def charge(self, spend) -> None:
+        with self.lock:
+            self.calls += spend.calls
+            self.cost_usd += spend.cost_usd
+
+    def exceeded(self):
+        with self.lock:
+            return budget_exceeded(self.budget, self.calls, self.cost_usd, time.monotonic() - self.started)
+
+    def state(self) -> dict:
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'cost_usd': round(self.cost_usd, 6),
+                'seconds': round(time.monotonic() - self.started, 1),
+            }
@@ -0,0 +1,356 @@
+"""
+Management command to benchmark enrichment throughput offline.
+
+Every provider is replaced by the stub of leads/providers.py (no API calls,
+no credits), with the latency, jitter and error rate given on the command
+line. The command sweeps concurrency levels and rate-limit scales over the
+selected pipeline paths, reports entities/second and p50/p95/p99 latency per
+stage (search, select, extract, merge, save) and writes the results as JSON.
+"""
+import json
+import math
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from leads import enrichment
+from leads.circuit_breaker import reset_breakers
+from leads.enrichment import (
+    COMPANY_BATCH_SIZE,
+    apply_company_data,
+    enrich_companies,
+    enrich_company,
+    enrich_lead,
+    timed_stage,
+)
+from leads.enrichment_async import run_company_enrichment
+from leads.metrics import metrics_snapshot, reset_metrics
+from leads.models import Company, EnrichmentCache, Lead
+from leads.providers import DEFAULT_STUB, reset_providers
+from leads.rate_limit import DEFAULT_RATE_LIMITS, reset_limiters
+
+
+PATHS = ('company', 'batch', 'async', 'lead')
+STAGES = ('search', 'select', 'extract', 'merge', 'save')
+
+# Synthetic companies/leads live under this domain suffix and are deleted afterwards
+BENCHMARK_SUFFIX = '.benchmark.example'
+
+
+def parse_list(value, cast):
+    try:
+        return [cast(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise CommandError(f'Invalid list "{value}"')
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+def summarize_timings(timings: list) -> dict:
+    timings = sorted(timings)
+    return {
+        'count': len(timings),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 1) if timings else 0.0,
+        'p50_ms': round(percentile(timings, 50) * 1000, 1),
+        'p95_ms': round(percentile(timings, 95) * 1000, 1),
+        'p99_ms': round(percentile(timings, 99) * 1000, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark enrichment throughput against stubbed providers, sweeping concurrency and rate limits'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--paths',
+            type=str,
+            default='company,lead',
+            help=f'Comma-separated pipeline paths to run: {", ".join(PATHS)} (default: company,lead)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=str,
+            default='1,4,16',
+            help='Comma-separated numbers of entities enriched at once (default: 1,4,16)',
+        )
+        parser.add_argument(
+            '--rate-scale',
+            type=str,
+            default='1',
+            help='Comma-separated multipliers of the configured provider rate limits (default: 1)',
+        )
+        parser.add_argument(
+            '--entities',
+            type=int,
+            default=40,
+            help='Companies or leads enriched per run (default: 40)',
+        )
+        parser.add_argument('--latency', type=float, default=DEFAULT_STUB['latency'], help='Stub call latency in seconds')
+        parser.add_argument('--jitter', type=float, default=DEFAULT_STUB['jitter'], help='Stub latency jitter in seconds (+/-)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of stub calls that fail')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of stub calls answered with a 429')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the stub latency/error generator')
+        parser.add_argument(
+            '--warm-cache',
+            action='store_true',
+            help='Keep stub answers cached between runs (default: every run starts with a cold cache)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='enrichment_benchmark.json',
+            help='Where to write the JSON results (default: enrichment_benchmark.json)',
+        )
+        parser.add_argument(
+            '--compare',
+            type=str,
+            default=None,
+            help='Earlier results file to compare entities/second against',
+        )
+        parser.add_argument(
+            '--max-regression',
+            type=float,
+            default=None,
+            metavar='PCT',
+            help='With --compare: fail if any run is more than PCT%% slower than before',
+        )
+
+    def handle(self, *args, **options):
+        paths = parse_list(options['paths'], str)
+        unknown = set(paths) - set(PATHS)
+        if unknown:
+            raise CommandError(f'Unknown path(s): {", ".join(sorted(unknown))}')
+        concurrency_levels = parse_list(options['concurrency'], int)
+        rate_scales = parse_list(options['rate_scale'], float)
+        if options['entities'] < 1 or not concurrency_levels or not rate_scales:
+            raise CommandError('Nothing to benchmark')
+
+        stub = {
+            'latency': options['latency'],
+            'jitter': options['jitter'],
+            'error_rate': options['error_rate'],
+            'rate_limit_rate': options['rate_limit_rate'],
+            'seed': options['seed'],
+        }
+        base_limits = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'ENRICHMENT_RATE_LIMITS', {})}
+
+        self.stdout.write(
+            f"🏁 Benchmarking {', '.join(paths)} with {options['entities']} entities per run "
+            f"(stub latency {stub['latency']}s ±{stub['jitter']}s, error rate {stub['error_rate']})"
+        )
+        self.create_entities(options['entities'])
+        runs = []
+        try:
+            with override_settings(
+                ENRICHMENT_PROVIDERS={'gpt': 'stub', 'gemini': 'stub', 'search': 'stub'},
+                ENRICHMENT_STUB=stub,
+            ):
+                for path in paths:
+                    for rate_scale in rate_scales:
+                        limits = {
+                            provider: {**config, 'rate': config['rate'] * rate_scale}
+                            for provider, config in base_limits.items()
+                        }
+                        with override_settings(ENRICHMENT_RATE_LIMITS=limits):
+                            for concurrency in concurrency_levels:
+                                if not options['warm_cache']:
+                                    self.clear_stub_cache()
+                                run = self.run_once(path, concurrency, rate_scale)
+                                runs.append(run)
+                                self.print_run(run)
+        finally:
+            reset_providers()
+            reset_limiters()
+            reset_breakers()
+            reset_metrics()
+            self.clear_stub_cache()
+            Company.objects.filter(domain__endswith=BENCHMARK_SUFFIX).delete()
+
+        results = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'options': {
+                'entities': options['entities'],
+                'stub': stub,
+                'rate_limits': base_limits,
+                'warm_cache': options['warm_cache'],
+            },
+            'runs': runs,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"\n💾 Results written to {options['output']}"))
+
+        if options['compare']:
+            self.compare(runs, options['compare'], options['max_regression'])
+
+    # ---- Setup ----
+
+    def create_entities(self, count):
+        Company.objects.filter(domain__endswith=BENCHMARK_SUFFIX).delete()
+        domains = [f'bench-{i:04d}{BENCHMARK_SUFFIX}' for i in range(count)]
+        Company.objects.bulk_create([Company(domain=domain) for domain in domains])
+        Lead.objects.bulk_create([
+            Lead(email=f'first{i}.last{i}@{domain}', company_id=domain) for i, domain in enumerate(domains)
+        ])
+        self.domains = domains
+
+    def clear_stub_cache(self):
+        EnrichmentCache.objects.filter(provider__startswith='stub-').delete()
+
+    # ---- Runs ----
+
+    def run_once(self, path, concurrency, rate_scale):
+        # Fresh stubs (same seed), buckets at the new rates and closed circuits for every run
+        reset_providers()
+        reset_limiters()
+        reset_breakers()
+        reset_metrics()
+
+        timings = {stage: [] for stage in STAGES}
+        lock = threading.Lock()
+
+        def record(stage, elapsed):
+            with lock:
+                timings.setdefault(stage, []).append(elapsed)
+
+        enrichment.stage_listeners.append(record)
+        started = time.perf_counter()
+        try:
+            errors = getattr(self, f'run_{path}')(concurrency)
+        finally:
+            enrichment.stage_listeners.remove(record)
+        elapsed = time.perf_counter() - started
+
+        entities = len(self.domains)
+        return {
+            'path': path,
+            'concurrency': concurrency,
+            'rate_scale': rate_scale,
+            'entities': entities,
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'entities_per_second': round(entities / elapsed, 3) if elapsed else None,
+            'stages': {stage: summarize_timings(values) for stage, values in timings.items() if values},
+            'providers': {
+                provider: {
+                    'calls': metrics['calls'],
+                    'errors': metrics['errors'],
+                    'retries': metrics['retries'],
+                    'latency_p95_ms': metrics['latency_ms']['p95'],
+                    'rate_limit_wait_p95_ms': metrics['rate_limit_wait_ms']['p95'],
+                    'input_tokens': metrics['input_tokens'],
+                    'output_tokens': metrics['output_tokens'],
+                }
+                for provider, metrics in metrics_snapshot().items()
+            },
+        }
+
+    def save_company(self, domain, enriched_data):
+        if not enriched_data or not any(enriched_data.values()):
+            return False
+        with timed_stage('save'):
+            company = Company.objects.get(domain=domain)
+            apply_company_data(company, enriched_data, overwrite=True)
+            company.save()
+        return True
+
+    def run_company(self, concurrency):
+        """enrich_company() per domain on a thread pool, like ai_enrichment_stream did."""
+        def one(domain):
+            return self.save_company(domain, enrich_company(domain))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return sum(not ok for ok in executor.map(one, self.domains))
+
+    def run_batch(self, concurrency):
+        """enrich_companies() on batches of COMPANY_BATCH_SIZE domains, `concurrency` batches at once."""
+        batches = [self.domains[i:i + COMPANY_BATCH_SIZE] for i in range(0, len(self.domains), COMPANY_BATCH_SIZE)]
+
+        def one(batch):
+            results = enrich_companies(batch)
+            return sum(not self.save_company(domain, results.get(domain)) for domain in batch)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return sum(executor.map(one, batches))
+
+    def run_async(self, concurrency):
+        """The asyncio pipeline with `concurrency` as every provider's semaphore size."""
+        errors = 0
+
+        def save(domain, enriched_data):
+            nonlocal errors
+            errors += not self.save_company(domain, enriched_data)
+
+        run_company_enrichment(
+            self.domains,
+            on_result=save,
+            concurrency={'openai': concurrency, 'gemini': concurrency, 'ddgs': concurrency},
+        )
+        return errors
+
+    def run_lead(self, concurrency):
+        """enrich_lead() per lead on a thread pool (overwriting, so every run does the full work)."""
+        leads = list(Lead.objects.filter(company_id__in=self.domains))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = executor.map(lambda lead: enrich_lead(lead, overwrite=True), leads)
+            return sum(result is None for result in results)
+
+    # ---- Output ----
+
+    def print_run(self, run):
+        stages = '  '.join(
+            f"{stage} p50/p95/p99 {s['p50_ms']:.0f}/{s['p95_ms']:.0f}/{s['p99_ms']:.0f}ms"
+            for stage, s in run['stages'].items()
+        )
+        self.stdout.write(
+            f"  {run['path']:<8} concurrency={run['concurrency']:<3} rate×{run['rate_scale']:<4} "
+            f"{run['entities_per_second']:>7.2f} entities/s  {run['errors']} errors  {run['seconds']:.1f}s"
+        )
+        if stages:
+            self.stdout.write(f"    {stages}")
+
+    def compare(self, runs, path, max_regression):
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+        before = {(run['path'], run['concurrency'], run['rate_scale']): run for run in previous.get('runs', [])}
+        self.stdout.write(f"\n📊 Compared with {path} ({previous.get('git_commit') or 'unknown commit'}):")
+        regressions = []
+        for run in runs:
+            old = before.get((run['path'], run['concurrency'], run['rate_scale']))
+            if not old or not old.get('entities_per_second') or not run['entities_per_second']:
+                continue
+            change = (run['entities_per_second'] / old['entities_per_second'] - 1) * 100
+            self.stdout.write(
+                f"  {run['path']:<8} concurrency={run['concurrency']:<3} rate×{run['rate_scale']:<4} "
+                f"{old['entities_per_second']:.2f} → {run['entities_per_second']:.2f} entities/s ({change:+.1f}%)"
+            )
+            if max_regression is not None and change < -max_regression:
+                regressions.append(run)
+
+        if regressions:
+            raise CommandError(f'{len(regressions)} run(s) regressed by more than {max_regression}%')
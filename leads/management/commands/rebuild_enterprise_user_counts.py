@@ -0,0 +1,38 @@
+"""
+Management command to rebuild and verify Company.enterprise_user_count.
+"""
+from django.core.management.base import BaseCommand
+from leads.rescoring import rebuild_enterprise_user_counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized enterprise user count of every company from its leads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report companies whose stored count is wrong, without fixing them',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('\n' + '='*80))
+        self.stdout.write(self.style.SUCCESS('REBUILDING ENTERPRISE USER COUNTS'))
+        self.stdout.write(self.style.SUCCESS('='*80))
+
+        verify_only = options['verify']
+        mismatches = rebuild_enterprise_user_counts(apply=not verify_only)
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('\n✅ All company counts are correct'))
+            return
+
+        for domain, stored, actual in mismatches[:50]:
+            self.stdout.write(f'  {domain}: stored {stored}, actual {actual}')
+        if len(mismatches) > 50:
+            self.stdout.write(f'  ... and {len(mismatches) - 50} more')
+
+        if verify_only:
+            self.stdout.write(self.style.WARNING(f'\n⚠️  {len(mismatches)} company count(s) out of date'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'\n✅ Fixed {len(mismatches)} company count(s)'))
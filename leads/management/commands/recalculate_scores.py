@@ -1,9 +1,33 @@
 """
 Management command to recalculate lead scores and stages for all leads.
 """
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Count, Avg, Min, Max
-from leads.models import Lead
+from leads.models import Lead, RescoreCheckpoint
+from leads.rescoring import (
+    DEFAULT_CHUNK_SIZE,
+    count_shard,
+    filter_leads,
+    find_resumable_run,
+    live_checkpoints,
+    new_run_id,
+    rescore_leads,
+    start_checkpoint,
+    summarize_stats,
+)
+from leads.rescoring_workers import rescore_in_workers
+from leads.scoring import team_user_counts
+
+
+def parse_shard(value):
+    """Parse an `i/n` shard spec into (index, count)."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise CommandError(f'Invalid --shard "{value}", expected i/n (e.g. 0/4)')
+    if count < 1 or not 0 <= index < count:
+        raise CommandError(f'Invalid --shard "{value}", index must be between 0 and n-1')
+    return index, count
 
 
 class Command(BaseCommand):
@@ -26,53 +50,163 @@ class Command(BaseCommand):
             default=None,
             help='Limit number of leads to process',
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Number of leads scored and written per batch (default: {DEFAULT_CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes; work is partitioned by company domain',
+        )
+        parser.add_argument(
+            '--shard',
+            type=str,
+            default=None,
+            help='Only process shard i of n company-domain partitions, e.g. 0/4 (for splitting across hosts)',
+        )
+        parser.add_argument(
+            '--resume',
+            nargs='?',
+            const='',
+            default=None,
+            metavar='RUN_ID',
+            help='Resume an interrupted run from its checkpoint (default: the latest unfinished run)',
+        )
+        parser.add_argument(
+            '--changed-only',
+            action='store_true',
+            help='Only write leads whose score or stage changed',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Compute new scores and report the changes without writing anything',
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('\n' + '='*80))
         self.stdout.write(self.style.SUCCESS('RECALCULATING LEAD SCORES AND STAGES'))
         self.stdout.write(self.style.SUCCESS('='*80))
 
-        # Build query
-        leads = Lead.objects.all()
-        
-        if options['email']:
-            leads = leads.filter(email=options['email'])
-        
-        if options['stage']:
-            leads = leads.filter(lead_stage=options['stage'])
+        dry_run = options['dry_run']
+        if dry_run and options['resume'] is not None:
+            raise CommandError('--dry-run cannot be combined with --resume')
+
+        if dry_run:
+            # Nothing is written, so there is nothing to checkpoint
+            run_id = None
+            self.stdout.write(self.style.WARNING('\nDRY RUN: no changes will be written'))
+        elif options['resume'] is not None:
+            checkpoint = find_resumable_run(options['resume'] or None)
+            if checkpoint is None:
+                if options['resume'] and live_checkpoints().filter(run_id=options['resume']).exists():
+                    raise CommandError(f'Run {options["resume"]} is still in progress in another process')
+                raise CommandError('No interrupted rescoring run to resume')
+            run = RescoreCheckpoint.objects.filter(run_id=checkpoint.run_id)
+            if not run.exclude(status='completed').exists():
+                self.stdout.write(self.style.WARNING(f'⚠️  Run {checkpoint.run_id} already completed'))
+                return
+            run_id = checkpoint.run_id
+            # The run continues with the options it was started with
+            options.update(checkpoint.options)
+            self.stdout.write(f'\nResuming run {run_id}')
+        else:
+            run_id = new_run_id()
+            self.stdout.write(f'\nRun id: {run_id} (resume with --resume {run_id})')
+        run_options = {
+            key: options[key]
+            for key in ('email', 'stage', 'limit', 'chunk_size', 'workers', 'shard', 'changed_only')
+        }
+        changed_only = options['changed_only']
+
+        filters = {
+            'email': options['email'],
+            'stage': options['stage'],
+        }
+        limit = options['limit']
+        shard = parse_shard(options['shard']) if options['shard'] else None
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
         
-        if options['limit']:
-            leads = leads[:options['limit']]
+        # Build query
+        leads = filter_leads(**filters)
         
-        total = leads.count()
+        total = count_shard(leads, shard, limit)
         
         if total == 0:
             self.stdout.write(self.style.WARNING('⚠️  No leads found matching criteria'))
             return
         
-        self.stdout.write(f'\nProcessing {total} leads...\n')
-        
-        updated = 0
-        failed = 0
-        
-        for i, lead in enumerate(leads, 1):
+        if shard:
+            self.stdout.write(f'\nShard {shard[0]}/{shard[1]}')
+        self.stdout.write(f'\nProcessing {total} leads with {workers} worker(s)...\n')
+        
+        def on_progress(processed):
+            pct = processed * 100 // total
+            self.stdout.write(f'  Progress: {processed}/{total} ({pct}%)')
+        
+        if workers > 1:
+            result = rescore_in_workers(
+                filters,
+                workers,
+                shard=shard or (0, 1),
+                chunk_size=options['chunk_size'],
+                on_progress=on_progress,
+                limit=limit,
+                run_id=run_id,
+                options=run_options,
+                changed_only=changed_only,
+                dry_run=dry_run,
+            )
+        else:
+            checkpoint = start_checkpoint(run_id, shard, run_options, total) if run_id else None
             try:
-                # Save will trigger auto-calculation
-                lead.save()
-                updated += 1
-                
-                if i % 100 == 0 or i == total:
-                    pct = i * 100 // total
-                    self.stdout.write(f'  Progress: {i}/{total} ({pct}%)')
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'  Error updating {lead.email}: {e}'))
-                failed += 1
-        
-        self.stdout.write(self.style.SUCCESS(f'\n✅ Successfully updated {updated}/{total} leads'))
+                # Team adoption counts for every domain in a single GROUP BY
+                result = rescore_leads(
+                    leads,
+                    chunk_size=options['chunk_size'],
+                    team_counts=team_user_counts(),
+                    on_progress=on_progress,
+                    shard=shard,
+                    limit=limit,
+                    checkpoint=checkpoint,
+                    changed_only=changed_only,
+                    dry_run=dry_run,
+                )
+            except BaseException:
+                if checkpoint:
+                    checkpoint.finish('failed')
+                raise
+            if checkpoint:
+                checkpoint.finish(summary=summarize_stats(result))
+        updated = result['updated']
+        failed = result['failed']
+        
+        for error in result['errors']:
+            self.stdout.write(self.style.ERROR(f'  Error updating {error}'))
+        
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(f'\n🔍 {result["changed"]}/{total} leads would change'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'\n✅ Successfully updated {updated}/{total} leads'))
+            self.stdout.write(f'  Changed: {result["changed"]}')
         
         if failed > 0:
             self.stdout.write(self.style.WARNING(f'⚠️  Failed: {failed}'))
         
+        if result['transitions']:
+            self.stdout.write(self.style.SUCCESS('\n🔀 STAGE TRANSITIONS:\n'))
+            for (old_stage, new_stage), count in result['transitions'].most_common():
+                self.stdout.write(f'  {old_stage or "none"}→{new_stage}: {count}')
+        
+        if dry_run:
+            return
+        
         # Show stats
         self.stdout.write(self.style.SUCCESS('\n📊 SCORING STATISTICS:\n'))
         
@@ -0,0 +1,158 @@
+"""
+Management command that processes the enrichment job queue.
+"""
+import logging
+import os
+import socket
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from leads.enrichment import COMPANY_BATCH_SIZE
+from leads.enrichment_jobs import claim_tasks, has_runnable_work, process_tasks, unfinished_task_count
+from leads.enrichment_schedule import RunBudget, describe_budget
+from leads.metrics import flush_metrics, tracking_spend
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run N enrichment workers that claim and process queued enrichment tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of worker threads (default: 4)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=COMPANY_BATCH_SIZE,
+            help=f'Tasks claimed per worker at a time; company tasks are enriched as one batch (default: {COMPANY_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=5.0,
+            help='Seconds an idle worker waits before looking for new tasks (default: 5)',
+        )
+        parser.add_argument(
+            '--exit-when-empty',
+            action='store_true',
+            help='Stop once no queued job has unfinished tasks (default: keep polling)',
+        )
+        parser.add_argument(
+            '--metrics-flush',
+            type=float,
+            default=getattr(settings, 'ENRICHMENT_METRICS_FLUSH_INTERVAL', 60),
+            help='Seconds between writes of provider call metrics to the database, 0 to disable '
+                 '(default: settings.ENRICHMENT_METRICS_FLUSH_INTERVAL)',
+        )
+        parser.add_argument('--max-calls', type=int, default=0, help='Stop after this many provider calls (default: no limit)')
+        parser.add_argument('--max-cost', type=float, default=0, help='Stop after spending this many USD (default: no limit)')
+        parser.add_argument('--max-minutes', type=float, default=0, help='Stop after this many minutes (default: no limit)')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        prefix = f"{socket.gethostname()}-{os.getpid()}"
+        stop = threading.Event()
+        totals = {'done': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+        totals_lock = threading.Lock()
+        # Budget of this run; a worker does not claim new tasks once it is spent
+        budget = RunBudget({
+            'calls': options['max_calls'],
+            'cost_usd': options['max_cost'],
+            'seconds': options['max_minutes'] * 60,
+        })
+
+        def work(name):
+            try:
+                while not stop.is_set():
+                    if budget.exceeded():
+                        stop.set()
+                        return
+                    try:
+                        if not work_once(name):
+                            return
+                    except Exception:
+                        # e.g. database is locked; tasks claimed by this batch
+                        # are picked up again once their lease expires
+                        logger.exception('Enrichment worker %s error', name)
+                        stop.wait(options['poll'])
+            finally:
+                # Worker threads are not closed by Django's request cycle
+                connection.close()
+
+        def work_once(name) -> bool:
+            """Claim and process one batch; False once the worker should exit."""
+            tasks = claim_tasks(name, options['batch_size'])
+            if not tasks:
+                if options['exit_when_empty'] and not has_runnable_work():
+                    return False
+                stop.wait(options['poll'])
+                return True
+            with tracking_spend() as spend:
+                try:
+                    counts = process_tasks(tasks)
+                finally:
+                    budget.charge(spend)
+            with totals_lock:
+                for status, count in counts.items():
+                    totals[status] += count
+            self.stdout.write(
+                f"[{name}] job #{tasks[0].job_id}: {counts['done']} done, "
+                f"{counts['skipped']} skipped, {counts['failed']} failed"
+                + (f", {counts['deferred']} deferred" if counts['deferred'] else '')
+            )
+            return True
+
+        def flush():
+            try:
+                while not stop.wait(options['metrics_flush']):
+                    try:
+                        flush_metrics()
+                    except Exception:
+                        # e.g. database is locked; the counters are kept for the next flush
+                        logger.exception('Metrics flush error')
+            finally:
+                connection.close()
+
+        self.stdout.write(f'🚀 Starting {workers} enrichment worker(s) ({prefix}), budget: {describe_budget(budget.budget)}')
+        threads = [
+            threading.Thread(target=work, args=(f'{prefix}-{i}',), name=f'enrichment-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        if options['metrics_flush'] > 0:
+            threading.Thread(target=flush, name='enrichment-metrics-flush', daemon=True).start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            # Workers finish their current batch; tasks of a hard kill are
+            # picked up again once their lease expires
+            self.stdout.write(self.style.WARNING('Stopping after the current batches...'))
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        stop.set()
+        if options['metrics_flush'] > 0:
+            flush_metrics()
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Workers stopped: {totals['done']} done, {totals['skipped']} skipped, {totals['failed']} failed"
+            + (f", {totals['deferred']} deferred by job budgets" if totals['deferred'] else '')
+        ))
+        reason = budget.exceeded()
+        if reason:
+            spent = budget.state()
+            self.stdout.write(self.style.WARNING(
+                f"⏸️  Run budget spent ({reason}: {spent['calls']} calls, ${spent['cost_usd']:.4f}, {spent['seconds']:.0f}s); "
+                f"{unfinished_task_count()} queued task(s) deferred to the next run"
+            ))
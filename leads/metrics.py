@@ -0,0 +1,359 @@
+"""
+Provider call metrics.
+
+Every DuckDuckGo, OpenAI and Gemini call goes through
+rate_limit.call_with_rate_limit(), which tracks it with track_call():
+- outcome: ok, error, rate_limited (still 429 after the retries),
+  unavailable (circuit open) or cancelled
+- retries after rate-limit errors
+- latency of the provider call itself and time spent waiting for the rate
+  limiter, as histograms
+- tokens and cost, reported by the provider from the response's usage
+  metadata (record_usage()), priced with settings.ENRICHMENT_MODEL_PRICES
+
+tracking_spend() additionally counts the calls and cost made inside a block
+(including provider calls it runs on other threads through
+enrichment.run_parallel()), which the enrichment budgets are charged with.
+
+Numbers are aggregated in memory per provider and process (metrics_snapshot(),
+GET /enrichment-metrics/). flush_metrics() moves them to the ProviderMetric
+table, which run_enrichment_workers does every
+settings.ENRICHMENT_METRICS_FLUSH_INTERVAL seconds (0 = never).
+"""
+
+import bisect
+import contextvars
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+from .circuit_breaker import ProviderUnavailable
+from .models import ProviderMetric
+
+
+# USD per million (input, output) tokens
+DEFAULT_MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gemini-2.5-flash': (0.30, 2.50),
+}
+
+# Upper bounds of the histogram buckets (the last bucket is unbounded)
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+OUTCOMES = ('ok', 'error', 'rate_limited', 'unavailable', 'cancelled')
+
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are the upper bound of the bucket they fall in."""
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, snapshot: dict) -> None:
+        """Add a snapshot() with the same bounds, e.g. one read back from the database."""
+        for index, count in enumerate(snapshot.get('buckets', [])):
+            self.counts[index] += count
+        self.count += snapshot.get('count', 0)
+        self.total += snapshot.get('sum', 0)
+        self.max = max(self.max, snapshot.get('max', 0))
+
+    def percentile(self, pct: float):
+        if not self.count:
+            return None
+        rank = pct / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return round(min(self.bounds[index], self.max) if index < len(self.bounds) else self.max, 1)
+        return round(self.max, 1)
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'mean': round(self.total / self.count, 1) if self.count else None,
+            'max': round(self.max, 1),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'bounds': list(self.bounds),
+            'buckets': list(self.counts),
+        }
+
+
+class ProviderMetrics:
+    """Calls of one provider since the last flush."""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.started_at = timezone.now()
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.retries = 0
+        self.latency = Histogram(LATENCY_BUCKETS_MS)
+        self.wait = Histogram(LATENCY_BUCKETS_MS)
+        self.tokens = Histogram(TOKEN_BUCKETS)
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def record(self, call) -> None:
+        with self.lock:
+            self.outcomes[call.outcome] += 1
+            self.retries += call.retries
+            if call.outcome != 'unavailable':
+                self.latency.observe(call.latency * 1000)
+                self.wait.observe(call.waited * 1000)
+            if call.usage:
+                self.tokens.observe(sum(usage['input_tokens'] + usage['output_tokens'] for usage in call.usage))
+            for usage in call.usage:
+                model = self.models.setdefault(
+                    usage['model'], {'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost_usd': 0.0},
+                )
+                model['calls'] += 1
+                model['input_tokens'] += usage['input_tokens']
+                model['output_tokens'] += usage['output_tokens']
+                model['cost_usd'] += usage['cost_usd']
+
+    def absorb(self, other: 'ProviderMetrics') -> None:
+        """Add the counts of another (detached) ProviderMetrics of the same provider."""
+        with self.lock:
+            self.started_at = min(self.started_at, other.started_at)
+            for outcome, count in other.outcomes.items():
+                self.outcomes[outcome] += count
+            self.retries += other.retries
+            self.latency.merge(other.latency.snapshot())
+            self.wait.merge(other.wait.snapshot())
+            self.tokens.merge(other.tokens.snapshot())
+            for name, usage in other.models.items():
+                model = self.models.setdefault(name, {'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost_usd': 0.0})
+                for key, value in usage.items():
+                    model[key] += value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            calls = sum(self.outcomes.values())
+            return {
+                'since': self.started_at.isoformat(),
+                'calls': calls,
+                'errors': calls - self.outcomes['ok'],
+                'outcomes': dict(self.outcomes),
+                'retries': self.retries,
+                'latency_ms': self.latency.snapshot(),
+                'rate_limit_wait_ms': self.wait.snapshot(),
+                'tokens_per_call': self.tokens.snapshot(),
+                'input_tokens': sum(model['input_tokens'] for model in self.models.values()),
+                'output_tokens': sum(model['output_tokens'] for model in self.models.values()),
+                'cost_usd': round(sum(model['cost_usd'] for model in self.models.values()), 6),
+                'models': {name: dict(model, cost_usd=round(model['cost_usd'], 6)) for name, model in self.models.items()},
+            }
+
+
+class ProviderCall:
+    """One tracked call (including its rate-limit retries)."""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.outcome = None
+        self.retries = 0
+        self.waited = 0.0
+        self.latency = 0.0
+        self.usage = []
+
+
+class Spend:
+    """Provider calls and cost of a tracking_spend() block; nested blocks also charge their parent."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.calls = 0
+        self.cost_usd = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, calls: int, cost_usd: float) -> None:
+        with self.lock:
+            self.calls += calls
+            self.cost_usd += cost_usd
+        if self.parent is not None:
+            self.parent.add(calls, cost_usd)
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+_current_call = contextvars.ContextVar('enrichment_provider_call', default=None)
+_current_spend = contextvars.ContextVar('enrichment_spend', default=None)
+
+
+def get_metrics(provider: str) -> ProviderMetrics:
+    with _metrics_lock:
+        metrics = _metrics.get(provider)
+        if metrics is None:
+            metrics = _metrics[provider] = ProviderMetrics(provider)
+        return metrics
+
+
+@contextmanager
+def track_call(provider: str):
+    """
+    Track one provider call. The caller adds retries and rate-limiter waits
+    to the yielded ProviderCall and may set its outcome (e.g. 'rate_limited')
+    before re-raising; the rest of the block counts as provider latency.
+    """
+    call = ProviderCall(provider)
+    token = _current_call.set(call)
+    started = time.monotonic()
+    try:
+        yield call
+        call.outcome = 'ok'
+    except ProviderUnavailable:
+        call.outcome = 'unavailable'
+        raise
+    except Exception:
+        call.outcome = call.outcome or 'error'
+        raise
+    except BaseException:
+        call.outcome = 'cancelled'
+        raise
+    finally:
+        _current_call.reset(token)
+        call.latency = max(0.0, time.monotonic() - started - call.waited)
+        get_metrics(provider).record(call)
+        spend = _current_spend.get()
+        if spend is not None and call.outcome != 'unavailable':
+            spend.add(1, sum(usage['cost_usd'] for usage in call.usage))
+
+
+@contextmanager
+def tracking_spend():
+    """Count the provider calls and cost made inside the block (yields a Spend)."""
+    spend = Spend(_current_spend.get())
+    token = _current_spend.set(spend)
+    try:
+        yield spend
+    finally:
+        _current_spend.reset(token)
+
+
+def model_prices() -> dict:
+    return {**DEFAULT_MODEL_PRICES, **getattr(settings, 'ENRICHMENT_MODEL_PRICES', {})}
+
+
+def record_usage(model: str, input_tokens, output_tokens) -> None:
+    """Token usage of a response, reported by the provider inside a tracked call."""
+    call = _current_call.get()
+    if call is None:
+        return
+    input_tokens, output_tokens = int(input_tokens or 0), int(output_tokens or 0)
+    input_price, output_price = model_prices().get(model, (0.0, 0.0))
+    call.usage.append({
+        'model': model,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cost_usd': (input_tokens * input_price + output_tokens * output_price) / 1_000_000,
+    })
+
+
+def metrics_snapshot() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    return {provider: provider_metrics.snapshot() for provider, provider_metrics in metrics.items()}
+
+
+def reset_metrics() -> None:
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def process_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def flush_metrics() -> int:
+    """
+    Write this process's metrics to the ProviderMetric table and start new
+    in-memory counters. If the write fails the counters are kept for the
+    next flush. Returns the number of rows written.
+    """
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+        _metrics.clear()
+    try:
+        return _write_metrics(metrics)
+    except Exception:
+        _restore_metrics(metrics)
+        raise
+
+
+def _write_metrics(metrics) -> int:
+    now = timezone.now()
+    rows = []
+    for provider_metrics in metrics:
+        snapshot = provider_metrics.snapshot()
+        if not snapshot['calls']:
+            continue
+        rows.append(ProviderMetric(
+            provider=provider_metrics.provider,
+            process=process_name(),
+            started_at=provider_metrics.started_at,
+            ended_at=now,
+            calls=snapshot['calls'],
+            errors=snapshot['errors'],
+            retries=snapshot['retries'],
+            input_tokens=snapshot['input_tokens'],
+            output_tokens=snapshot['output_tokens'],
+            cost_usd=snapshot['cost_usd'],
+            latency_p50_ms=snapshot['latency_ms']['p50'],
+            latency_p95_ms=snapshot['latency_ms']['p95'],
+            data=snapshot,
+        ))
+    ProviderMetric.objects.bulk_create(rows)
+    return len(rows)
+
+
+def _restore_metrics(metrics) -> None:
+    """Put counters that could not be flushed back, merged with calls recorded since."""
+    with _metrics_lock:
+        for provider_metrics in metrics:
+            current = _metrics.get(provider_metrics.provider)
+            if current is None:
+                _metrics[provider_metrics.provider] = provider_metrics
+            else:
+                current.absorb(provider_metrics)
+
+
+def recorded_metrics(since) -> dict:
+    """Flushed metrics of all processes since a datetime, summed per provider."""
+    rows = ProviderMetric.objects.filter(ended_at__gte=since)
+    totals = {
+        row['provider']: row
+        for row in rows.values('provider').annotate(
+            calls=Sum('calls'), errors=Sum('errors'), retries=Sum('retries'),
+            input_tokens=Sum('input_tokens'), output_tokens=Sum('output_tokens'), cost_usd=Sum('cost_usd'),
+        ).order_by()
+    }
+    latency = {provider: Histogram(LATENCY_BUCKETS_MS) for provider in totals}
+    for provider, data in rows.values_list('provider', 'data'):
+        latency[provider].merge(data.get('latency_ms', {}))
+
+    return {
+        provider: {
+            **{key: value for key, value in total.items() if key != 'provider'},
+            'cost_usd': round(total['cost_usd'] or 0, 6),
+            'latency_ms': latency[provider].snapshot(),
+        }
+        for provider, total in totals.items()
+    }
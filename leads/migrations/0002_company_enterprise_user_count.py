@@ -0,0 +1,50 @@
+# Generated by Django 5.2.10 on 2026-10-17 05:55
+
+from django.db import migrations, models
+from django.db.models import Count, F, Value
+from django.db.models.functions import Lower, StrIndex, Substr
+
+
+# Copy of leads.scoring.FREE_EMAIL_DOMAINS when this migration was written;
+# migrations must not depend on the current scoring rules.
+FREE_EMAIL_DOMAINS = [
+    'gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com',
+    'aol.com', 'mail.com', 'yandex.com', 'protonmail.com',
+    'icloud.com', 'mail.ru', 'qq.com', '163.com',
+    'gmx.com', 'web.de', 'live.com', 'msn.com',
+    'inbox.com', 'zoho.com', 'fastmail.com', 'tutanota.com',
+    'hotmail.co.uk', 'yahoo.co.uk', 'myyahoo.com',
+]
+
+
+def populate_enterprise_user_count(apps, schema_editor):
+    Company = apps.get_model('leads', 'Company')
+    Lead = apps.get_model('leads', 'Lead')
+
+    rows = (
+        Lead.objects.order_by()
+        .filter(email__contains='@')
+        .annotate(email_domain=Lower(Substr('email', StrIndex('email', Value('@')) + 1)))
+        .exclude(email_domain__in=FREE_EMAIL_DOMAINS)
+        .filter(email_domain=F('company_id'))
+        .values('company_id')
+        .annotate(user_count=Count('email'))
+    )
+    for row in rows:
+        Company.objects.filter(domain=row['company_id']).update(enterprise_user_count=row['user_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='enterprise_user_count',
+            field=models.IntegerField(default=0, editable=False, help_text="Leads on this company's own (non-free) email domain"),
+        ),
+        migrations.RunPython(populate_enterprise_user_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0002_company_enterprise_user_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RescoreCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.CharField(db_index=True, max_length=32)),
+                ('shard_index', models.IntegerField(default=0)),
+                ('shard_count', models.IntegerField(default=1)),
+                ('options', models.JSONField(default=dict, help_text='Command options of the run, reused on --resume')),
+                ('last_email', models.CharField(blank=True, help_text='Keyset cursor: every lead up to this email has been processed', max_length=255, null=True)),
+                ('scanned', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Rescore Checkpoint',
+                'verbose_name_plural': 'Rescore Checkpoints',
+                'db_table': 'rescore_checkpoints',
+                'ordering': ['-started_at'],
+                'unique_together': {('run_id', 'shard_index', 'shard_count')},
+            },
+        ),
+    ]
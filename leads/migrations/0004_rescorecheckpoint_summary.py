@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0003_rescorecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rescorecheckpoint',
+            name='summary',
+            field=models.JSONField(default=dict, help_text='Final stats of the shard (changes, stage transitions, errors)'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0004_rescorecheckpoint_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrichmentCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(help_text='What was enriched, e.g. company, lead, website, linkedin', max_length=20)),
+                ('subject', models.CharField(help_text='Domain or email (lowercase)', max_length=255)),
+                ('provider', models.CharField(help_text='gpt, gemini, ...', max_length=20)),
+                ('prompt_version', models.CharField(max_length=20)),
+                ('value', models.JSONField(null=True)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Enrichment Cache Entry',
+                'verbose_name_plural': 'Enrichment Cache',
+                'db_table': 'enrichment_cache',
+                'unique_together': {('kind', 'subject', 'provider', 'prompt_version')},
+            },
+        ),
+    ]
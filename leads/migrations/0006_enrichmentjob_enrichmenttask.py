@@ -0,0 +1,57 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0005_enrichmentcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrichmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('company', 'Company'), ('lead', 'Lead')], max_length=20)),
+                ('overwrite', models.BooleanField(default=False, help_text='Replace existing field values, not only empty ones')),
+                ('source', models.CharField(blank=True, help_text='View that queued the job', max_length=50)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='queued', max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Enrichment Job',
+                'verbose_name_plural': 'Enrichment Jobs',
+                'db_table': 'enrichment_jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EnrichmentTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(help_text='Company domain or lead email', max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('skipped', 'Skipped'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Not claimed before this time (retry backoff)')),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='leads.enrichmentjob')),
+            ],
+            options={
+                'verbose_name': 'Enrichment Task',
+                'verbose_name_plural': 'Enrichment Tasks',
+                'db_table': 'enrichment_tasks',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='enrichment__status_19504e_idx')],
+                'unique_together': {('job', 'subject')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0006_enrichmentjob_enrichmenttask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='enrichment_state',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Per enriched field: last attempt, last success and consecutive failures'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0007_company_enrichment_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(help_text='Rate limiter name: openai, gemini, ddgs', max_length=20)),
+                ('process', models.CharField(blank=True, help_text='host-pid that made the calls', max_length=100)),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField(db_index=True)),
+                ('calls', models.IntegerField(default=0)),
+                ('errors', models.IntegerField(default=0)),
+                ('retries', models.IntegerField(default=0)),
+                ('input_tokens', models.BigIntegerField(default=0)),
+                ('output_tokens', models.BigIntegerField(default=0)),
+                ('cost_usd', models.FloatField(default=0)),
+                ('latency_p50_ms', models.FloatField(blank=True, null=True)),
+                ('latency_p95_ms', models.FloatField(blank=True, null=True)),
+                ('data', models.JSONField(default=dict, help_text='Full snapshot, including histogram buckets')),
+            ],
+            options={
+                'verbose_name': 'Provider Metric',
+                'verbose_name_plural': 'Provider Metrics',
+                'db_table': 'provider_metrics',
+                'ordering': ['-ended_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0008_providermetric'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrichmentjob',
+            name='budget',
+            field=models.JSONField(blank=True, default=dict, help_text='Limits of the job: calls, cost_usd, seconds (see leads/enrichment_schedule.py)'),
+        ),
+        migrations.AddField(
+            model_name='enrichmentjob',
+            name='spent_calls',
+            field=models.IntegerField(default=0, help_text='Provider calls made for the job'),
+        ),
+        migrations.AddField(
+            model_name='enrichmentjob',
+            name='spent_cost_usd',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='enrichmenttask',
+            name='priority',
+            field=models.IntegerField(default=0, help_text='Higher is claimed first within its job'),
+        ),
+        migrations.AlterField(
+            model_name='enrichmentjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('over_budget', 'Over budget')], default='queued', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='enrichmenttask',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('skipped', 'Skipped'), ('failed', 'Failed'), ('deferred', 'Deferred')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0009_enrichment_priority_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrichmentjob',
+            name='started_at',
+            field=models.DateTimeField(blank=True, help_text="When a worker first claimed one of the job's tasks", null=True),
+        ),
+    ]
@@ -1,6 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
-from .scoring import auto_calculate_score_and_stage
+from .scoring import auto_calculate_score_and_stage, team_key, team_user_counts
 
 
 class Company(models.Model):
@@ -54,6 +54,21 @@ class Company(models.Model):
     pdl_last_funding_date = models.DateTimeField(blank=True, null=True)
     pdl_number_funding_rounds = models.IntegerField(blank=True, null=True)
     
+    # Scoring fields (maintained automatically from leads)
+    enterprise_user_count = models.IntegerField(
+        default=0,
+        editable=False,
+        help_text="Leads on this company's own (non-free) email domain"
+    )
+    
+    # Enrichment bookkeeping (see leads/enrichment_plan.py)
+    enrichment_state = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Per enriched field: last attempt, last success and consecutive failures"
+    )
+
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -70,6 +85,44 @@ class Company(models.Model):
         return f"<Company(domain={self.domain!r}, company_name={self.company_name!r})>"
 
 
+class LeadQuerySet(models.QuerySet):
+    """Lead queryset that keeps scores and team counts correct on bulk writes."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .rescoring import (
+            company_team_counts, refresh_companies_after_upsert, rescore_teams, score_new_leads, upsert_companies,
+        )
+
+        objs = list(objs)
+        with transaction.atomic():
+            if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+                # Rows that already exist must not be counted as new members;
+                # recount the affected companies once the rows are written
+                companies = upsert_companies(objs)
+                before = company_team_counts(companies)
+                objs = super().bulk_create(objs, *args, **kwargs)
+                refresh_companies_after_upsert(companies, before)
+                return objs
+            crossed_teams = score_new_leads(objs)
+            objs = super().bulk_create(objs, *args, **kwargs)
+            if crossed_teams:
+                rescore_teams(crossed_teams)
+        return objs
+
+    def delete(self):
+        from .rescoring import adjust_enterprise_user_count, rescore_teams, teams_left_below_threshold
+
+        with transaction.atomic():
+            removed = team_user_counts(self)
+            result = super().delete()
+            for key, count in removed.items():
+                adjust_enterprise_user_count(key, -count)
+            left_teams = teams_left_below_threshold(removed)
+            if left_teams:
+                rescore_teams(left_teams)
+        return result
+
+
 class Lead(models.Model):
     """Lead model - one per email."""
 
@@ -143,6 +196,14 @@ class Lead(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = LeadQuerySet.as_manager()
+
+    # Fields calculate_lead_score() reads from the lead itself
+    SCORING_INPUT_FIELDS = ('email', 'company_id', 'session_count', 'pdl_job_title')
+
+    # Scoring inputs as last loaded from / written to the database
+    _stored_inputs = None
+
     class Meta:
         db_table = 'leads'
         verbose_name = 'Lead'
@@ -156,9 +217,276 @@ class Lead(models.Model):
     def __repr__(self):
         return f"<Lead(email={self.email!r}, domain={self.company_id!r}, lead_score={self.lead_score})>"
 
-    def save(self, *args, **kwargs):
-        """Override save to automatically calculate score and stage."""
-        # Auto-calculate lead score and stage based on lead data
-        auto_calculate_score_and_stage(self)
-        super().save(*args, **kwargs)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(field in field_names for field in cls.SCORING_INPUT_FIELDS):
+            instance._stored_inputs = instance._scoring_inputs()
+        return instance
+
+    def _scoring_inputs(self) -> dict:
+        return {field: getattr(self, field) for field in self.SCORING_INPUT_FIELDS}
+
+    def _get_stored_inputs(self, force_insert=False):
+        """Scoring inputs currently in the database for this lead (None for a new row)."""
+        stored = self._stored_inputs
+        if stored is None and not force_insert and self.email:
+            stored = Lead.objects.filter(email=self.email).values(*self.SCORING_INPUT_FIELDS).first()
+        if stored is not None and stored['email'] != self.email:
+            # A changed email saves a new row; the old row keeps its inputs
+            stored = None
+        return stored
+
+    def save(self, *args, skip_scoring=False, **kwargs):
+        """
+        Override save to automatically calculate score and stage.
+
+        Scoring only runs when a scoring input (SCORING_INPUT_FIELDS) is
+        written with a new value, so saves that touch e.g. crm_owner or
+        enrichment timestamps skip the scoring queries. update_fields is
+        honored, and bulk pipelines can opt out with skip_scoring=True.
+        """
+        from .rescoring import adjust_enterprise_user_count, refresh_team_after_join, refresh_team_after_leave
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            written = set(self.SCORING_INPUT_FIELDS)
+        else:
+            written = {'company_id' if name == 'company' else name for name in update_fields}
+
+        stored = self._get_stored_inputs(force_insert=kwargs.get('force_insert', False))
+        current = self._scoring_inputs()
+        persisted = {
+            field: current[field] if stored is None or field in written else stored[field]
+            for field in self.SCORING_INPUT_FIELDS
+        }
+
+        if persisted != stored and not skip_scoring:
+            # Auto-calculate lead score and stage based on lead data
+            auto_calculate_score_and_stage(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'lead_score', 'lead_stage'}
+
+        previous_key = team_key(stored['email'], stored['company_id']) if stored else None
+        key = team_key(persisted['email'], persisted['company_id'])
+
+        if key == previous_key:
+            super().save(*args, **kwargs)
+        else:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                adjust_enterprise_user_count(previous_key, -1)
+                adjust_enterprise_user_count(key, 1)
+                refresh_team_after_leave(previous_key)
+                if refresh_team_after_join(key):
+                    # This lead was rescored with its team; pick up the new values
+                    self.refresh_from_db(fields=['lead_score', 'lead_stage'])
+        self._stored_inputs = persisted
+
+    def delete(self, *args, **kwargs):
+        """Override delete to rescore the lead's team if it drops below the adoption threshold."""
+        from .rescoring import adjust_enterprise_user_count, refresh_team_after_leave
+
+        # Django clears the primary key (email) on delete, so resolve the team first
+        key = team_key(self.email, self.company_id)
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            adjust_enterprise_user_count(key, -1)
+            refresh_team_after_leave(key)
+        self._stored_inputs = None
+        return result
+
+
+class RescoreCheckpoint(models.Model):
+    """Progress of one shard of a recalculate_scores run, used by --resume."""
+
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    run_id = models.CharField(max_length=32, db_index=True)
+    shard_index = models.IntegerField(default=0)
+    shard_count = models.IntegerField(default=1)
+    options = models.JSONField(default=dict, help_text="Command options of the run, reused on --resume")
+    last_email = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        help_text="Keyset cursor: every lead up to this email has been processed"
+    )
+    scanned = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    status = models.CharField(max_length=20, default='running', choices=STATUS_CHOICES)
+    summary = models.JSONField(default=dict, help_text="Final stats of the shard (changes, stage transitions, errors)")
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'rescore_checkpoints'
+        verbose_name = 'Rescore Checkpoint'
+        verbose_name_plural = 'Rescore Checkpoints'
+        ordering = ['-started_at']
+        unique_together = [('run_id', 'shard_index', 'shard_count')]
+
+    def __str__(self):
+        return f"{self.run_id} [{self.shard_index}/{self.shard_count}] {self.status}"
+
+    def record_progress(self, last_email: str, scanned: int, stats: dict, summary: dict = None):
+        """Persist the keyset cursor, counters and (so far) summary after a chunk."""
+        self.last_email = last_email
+        self.scanned = scanned
+        self.processed = stats['processed']
+        self.updated = stats['updated']
+        self.failed = stats['failed']
+        if summary is not None:
+            self.summary = summary
+        self.save(update_fields=['last_email', 'scanned', 'processed', 'updated', 'failed', 'summary', 'updated_at'])
+
+    def finish(self, status: str = 'completed', summary: dict = None):
+        self.status = status
+        self.finished_at = timezone.now()
+        if summary is not None:
+            self.summary = summary
+        self.save(update_fields=['status', 'summary', 'finished_at', 'updated_at'])
 
+
+class EnrichmentCache(models.Model):
+    """Cached result of one enrichment provider call for a company or lead."""
+
+    kind = models.CharField(max_length=20, help_text="What was enriched, e.g. company, lead, website, linkedin")
+    subject = models.CharField(max_length=255, help_text="Domain or email (lowercase)")
+    provider = models.CharField(max_length=20, help_text="gpt, gemini, ...")
+    prompt_version = models.CharField(max_length=20)
+    value = models.JSONField(null=True)
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'enrichment_cache'
+        verbose_name = 'Enrichment Cache Entry'
+        verbose_name_plural = 'Enrichment Cache'
+        unique_together = [('kind', 'subject', 'provider', 'prompt_version')]
+
+    def __str__(self):
+        return f"{self.kind}:{self.subject} [{self.provider} {self.prompt_version}]"
+
+
+class EnrichmentJob(models.Model):
+    """A batch of enrichment work queued by a view, processed by run_enrichment_workers."""
+
+    KIND_CHOICES = [
+        ('company', 'Company'),
+        ('lead', 'Lead'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('completed', 'Completed'),
+        ('cancelled', 'Cancelled'),
+        ('over_budget', 'Over budget'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    overwrite = models.BooleanField(default=False, help_text="Replace existing field values, not only empty ones")
+    source = models.CharField(max_length=50, blank=True, help_text="View that queued the job")
+    status = models.CharField(max_length=20, default='queued', choices=STATUS_CHOICES)
+    total = models.IntegerField(default=0)
+    budget = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Limits of the job: calls, cost_usd, seconds (see leads/enrichment_schedule.py)"
+    )
+    spent_calls = models.IntegerField(default=0, help_text="Provider calls made for the job")
+    spent_cost_usd = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(
+        blank=True, null=True, help_text="When a worker first claimed one of the job's tasks"
+    )
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'enrichment_jobs'
+        verbose_name = 'Enrichment Job'
+        verbose_name_plural = 'Enrichment Jobs'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} ({self.total}) {self.status}"
+
+
+class EnrichmentTask(models.Model):
+    """
+    Enrichment of one company domain or lead email within a job.
+
+    Workers claim pending tasks whose available_at has passed, or running
+    tasks whose lease expired (their worker died), so an interrupted run
+    resumes where it stopped. Tasks left when the job's budget ran out are
+    'deferred'.
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+        ('deferred', 'Deferred'),
+    ]
+
+    job = models.ForeignKey(EnrichmentJob, on_delete=models.CASCADE, related_name='tasks')
+    subject = models.CharField(max_length=255, help_text="Company domain or lead email")
+    priority = models.IntegerField(default=0, help_text="Higher is claimed first within its job")
+    status = models.CharField(max_length=20, default='pending', choices=STATUS_CHOICES)
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, help_text="Not claimed before this time (retry backoff)")
+    worker = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'enrichment_tasks'
+        verbose_name = 'Enrichment Task'
+        verbose_name_plural = 'Enrichment Tasks'
+        unique_together = [('job', 'subject')]
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.job.kind}:{self.subject} {self.status}"
+
+
+class ProviderMetric(models.Model):
+    """Provider call metrics of one process over one flush interval (see leads/metrics.py)."""
+
+    provider = models.CharField(max_length=20, help_text="Rate limiter name: openai, gemini, ddgs")
+    process = models.CharField(max_length=100, blank=True, help_text="host-pid that made the calls")
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(db_index=True)
+    calls = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+    retries = models.IntegerField(default=0)
+    input_tokens = models.BigIntegerField(default=0)
+    output_tokens = models.BigIntegerField(default=0)
+    cost_usd = models.FloatField(default=0)
+    latency_p50_ms = models.FloatField(blank=True, null=True)
+    latency_p95_ms = models.FloatField(blank=True, null=True)
+    data = models.JSONField(default=dict, help_text="Full snapshot, including histogram buckets")
+
+    class Meta:
+        db_table = 'provider_metrics'
+        verbose_name = 'Provider Metric'
+        verbose_name_plural = 'Provider Metrics'
+        ordering = ['-ended_at']
+
+    def __str__(self):
+        return f"{self.provider} {self.started_at:%Y-%m-%d %H:%M}-{self.ended_at:%H:%M} ({self.calls} calls)"
@@ -0,0 +1,457 @@
+"""
+Enrichment providers.
+
+Every external service used by enrichment sits behind one small interface,
+selected per role by settings.ENRICHMENT_PROVIDERS:
+- 'gpt' and 'gemini' roles: EnrichmentProvider, text completions
+  (OpenAIProvider, GeminiProvider)
+- 'search' role: SearchProvider, web search (DDGSearchProvider)
+- 'stub' backend for any role: StubProvider / StubSearchProvider answer with
+  deterministic fixture data after a configurable latency, jitter and error
+  rate (settings.ENRICHMENT_STUB), so the pipeline can be benchmarked and
+  load-tested offline without spending API credits
+
+API clients are created on first use, not at import time. Stubs keep the
+rate limiter / circuit breaker name (`service`) of the provider they replace,
+but cache their answers under their own name (`cache_name`) so fixture data
+never mixes with real answers in the enrichment cache.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from django.conf import settings
+from dotenv import load_dotenv
+from duckduckgo_search import DDGS
+from google import genai
+from google.genai import types as genai_types
+from openai import AsyncOpenAI, OpenAI
+from .metrics import record_usage
+
+load_dotenv("keys.env")
+
+GEMINI_MODEL = 'gemini-2.5-flash'
+GPT_MODEL = "gpt-4o-mini"
+
+# A provider call that takes longer than this many seconds counts as failed
+PROVIDER_CALL_TIMEOUT = float(os.getenv("ENRICHMENT_CALL_TIMEOUT", "30"))
+
+# Rate limiter / circuit breaker name of each role
+ROLE_SERVICES = {'gpt': 'openai', 'gemini': 'gemini', 'search': 'ddgs'}
+
+DEFAULT_PROVIDERS = {'gpt': 'openai', 'gemini': 'gemini', 'search': 'ddg'}
+DEFAULT_STUB = {'latency': 0.5, 'jitter': 0.2, 'error_rate': 0.0, 'rate_limit_rate': 0.0, 'seed': 0}
+
+
+class EnrichmentProvider:
+    """A language model that answers extraction prompts with text."""
+
+    name = ''
+    service = ''
+
+    @property
+    def cache_name(self) -> str:
+        return self.name
+
+    @property
+    def configured(self) -> bool:
+        """False if the provider cannot be used (e.g. missing API key)."""
+        return True
+
+    def complete(self, prompt: str, system: str = None, temperature: float = None) -> str:
+        raise NotImplementedError
+
+    def async_session(self):
+        """
+        Async client for one event loop (see enrichment_async.py).
+        The returned object has `async complete(prompt, system, temperature)`
+        and `async close()`.
+        """
+        raise NotImplementedError
+
+
+class SearchProvider:
+    """A web search returning [{'title', 'url', 'snippet'}, ...]."""
+
+    name = 'search'
+    service = 'ddgs'
+
+    @property
+    def cache_name(self) -> str:
+        return self.service
+
+    def search(self, query: str, max_results: int) -> list:
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        """Drop per-thread state after an error."""
+
+
+# ---- OpenAI ----
+
+class OpenAIProvider(EnrichmentProvider):
+    name = 'gpt'
+    service = 'openai'
+
+    def __init__(self, model: str = GPT_MODEL):
+        self.model = model
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                # The client gives up after the call timeout, so hung calls count towards the circuit breaker
+                self._client = OpenAI(api_key=self.api_key, timeout=PROVIDER_CALL_TIMEOUT)
+            return self._client
+
+    def messages(self, prompt, system):
+        return ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+
+    def options(self, temperature):
+        return {} if temperature is None else {'temperature': temperature}
+
+    def answer(self, response):
+        """The response text, after reporting its token usage."""
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            record_usage(self.model, usage.prompt_tokens, usage.completion_tokens)
+        return response.choices[0].message.content
+
+    def complete(self, prompt, system=None, temperature=None):
+        response = self.client.chat.completions.create(
+            model=self.model, messages=self.messages(prompt, system), **self.options(temperature)
+        )
+        return self.answer(response)
+
+    def async_session(self):
+        provider = self
+        client = AsyncOpenAI(api_key=self.api_key, timeout=PROVIDER_CALL_TIMEOUT)
+
+        class Session:
+            async def complete(self, prompt, system=None, temperature=None):
+                response = await client.chat.completions.create(
+                    model=provider.model, messages=provider.messages(prompt, system), **provider.options(temperature)
+                )
+                return provider.answer(response)
+
+            async def close(self):
+                await client.close()
+
+        return Session()
+
+
+# ---- Gemini ----
+
+class GeminiProvider(EnrichmentProvider):
+    name = 'gemini'
+    service = 'gemini'
+
+    def __init__(self, model: str = GEMINI_MODEL):
+        self.model = model
+        self.api_key = os.getenv("GENAI_API_KEY")
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = genai.Client(
+                    api_key=self.api_key,
+                    http_options=genai_types.HttpOptions(timeout=int(PROVIDER_CALL_TIMEOUT * 1000)),
+                )
+            return self._client
+
+    def config(self, system, temperature):
+        if system is None and temperature is None:
+            return None
+        return genai_types.GenerateContentConfig(system_instruction=system, temperature=temperature)
+
+    def answer(self, response):
+        """The response text, after reporting its token usage (thinking tokens are billed as output)."""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            record_usage(
+                self.model,
+                usage.prompt_token_count,
+                (usage.candidates_token_count or 0) + (getattr(usage, 'thoughts_token_count', None) or 0),
+            )
+        return response.text
+
+    def complete(self, prompt, system=None, temperature=None):
+        response = self.client.models.generate_content(
+            model=self.model, contents=prompt, config=self.config(system, temperature)
+        )
+        return self.answer(response)
+
+    def async_session(self):
+        provider = self
+        client = self.client.aio
+
+        class Session:
+            async def complete(self, prompt, system=None, temperature=None):
+                response = await client.models.generate_content(
+                    model=provider.model, contents=prompt, config=provider.config(system, temperature)
+                )
+                return provider.answer(response)
+
+            async def close(self):
+                pass
+
+        return Session()
+
+
+# ---- DuckDuckGo ----
+
+class DDGSearchProvider(SearchProvider):
+    """DuckDuckGo text search; each thread reuses one DDGS session."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = DDGS()
+        return session
+
+    def reset(self):
+        self._local.session = None
+
+    def search(self, query, max_results):
+        return [
+            {
+                "title": r.get("title", ""),
+                "url": r.get("href") or r.get("link"),
+                "snippet": r.get("body", ""),
+            }
+            for r in self.session().text(query, max_results=max_results)
+            if r.get("href") or r.get("link")
+        ]
+
+
+# ---- Offline stubs ----
+
+class StubProviderError(Exception):
+    """Simulated provider failure."""
+
+
+class StubRateLimitError(Exception):
+    """Simulated 429 (recognized by rate_limit.is_rate_limit_error)."""
+
+    status_code = 429
+
+    def __init__(self):
+        super().__init__('429 simulated rate limit')
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+
+
+class _Simulation:
+    """Latency, jitter and errors of a stub, drawn from a seeded generator."""
+
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0, rate_limit_rate=0.0, seed=0):
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.error_rate = float(error_rate)
+        self.rate_limit_rate = float(rate_limit_rate)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def draw(self):
+        """(delay in seconds, exception to raise or None) of the next call."""
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return delay, StubRateLimitError()
+        if roll < self.rate_limit_rate + self.error_rate:
+            return delay, StubProviderError('simulated provider error')
+        return delay, None
+
+
+INDUSTRIES = ['Software', 'Financial Services', 'Healthcare', 'Manufacturing', 'Education', 'Retail']
+JOB_TITLES = ['Software Engineer', 'Engineering Manager', 'VP Engineering', 'CTO', 'Product Manager', 'Analyst']
+
+
+def stub_company(domain: str) -> dict:
+    """Deterministic company fixture of a domain."""
+    n = _digest(domain)
+    name = domain.split('.')[0].replace('-', ' ').title()
+    return {
+        "company_name": f"{name} Inc",
+        "industry": INDUSTRIES[n % len(INDUSTRIES)],
+        "company_size": 10 + n % 5000,
+        "hq_country": "US",
+        "org_type": "private",
+        "tech_stack": "Python, AWS",
+        "street": f"{100 + n % 900} Main St",
+        "city": "Springfield",
+        "state": "IL",
+        "postal_code": f"{62700 + n % 100}",
+        "country": "United States",
+        "work_phone": f"+1 217 555 {n % 10000:04d}",
+        "facebook": f"https://www.facebook.com/{domain.split('.')[0]}",
+    }
+
+
+def stub_lead(email: str) -> dict:
+    """Deterministic person fixture of an email."""
+    parts = [part for part in re.split(r'[._\-+0-9]+', email.split('@')[0]) if part]
+    first = parts[0].title() if parts else None
+    last = parts[-1].title() if len(parts) > 1 else None
+    slug = '-'.join(part.lower() for part in parts) or email.split('@')[0]
+    return {
+        "first_name": first,
+        "last_name": last,
+        "job_title": JOB_TITLES[_digest(email) % len(JOB_TITLES)],
+        "linkedin_url": f"https://www.linkedin.com/in/{slug}",
+    }
+
+
+def stub_answer(prompt: str) -> str:
+    """Fixture answer to one of the prompts built in enrichment.py."""
+    if prompt.startswith("You are selecting the best URL"):
+        urls = re.findall(r'\((https?://[^)\s]+)\)', prompt)
+        if "Type: linkedin" in prompt:
+            urls = [url for url in urls if "linkedin.com/company" in url] or urls
+        return urls[0] if urls else "none"
+    if prompt.startswith("Extract comprehensive company information for each"):
+        domains = re.findall(r'^- (\S+) \(Website:', prompt, re.MULTILINE)
+        return json.dumps([dict(stub_company(domain), domain=domain) for domain in domains])
+    match = re.search(r'Based on the domain "([^"]+)"', prompt)
+    if match:
+        return json.dumps(stub_company(match.group(1)))
+    match = re.search(r'professional with email: (\S+)', prompt)
+    if match:
+        return json.dumps(stub_lead(match.group(1)))
+    return "{}"
+
+
+class StubProvider(EnrichmentProvider):
+    """Offline stand-in for a language model."""
+
+    def __init__(self, name: str, service: str, **simulation):
+        self.name = name
+        self.service = service
+        self.simulation = _Simulation(**simulation)
+
+    @property
+    def cache_name(self) -> str:
+        return f'stub-{self.name}'
+
+    def answer(self, prompt):
+        """Fixture answer; usage is estimated at four characters per token (the 'stub' model is not priced)."""
+        text = stub_answer(prompt)
+        record_usage('stub', len(prompt) // 4, len(text) // 4)
+        return text
+
+    def complete(self, prompt, system=None, temperature=None):
+        delay, error = self.simulation.draw()
+        time.sleep(delay)
+        if error:
+            raise error
+        return self.answer(prompt)
+
+    def async_session(self):
+        provider = self
+
+        class Session:
+            async def complete(self, prompt, system=None, temperature=None):
+                delay, error = provider.simulation.draw()
+                await asyncio.sleep(delay)
+                if error:
+                    raise error
+                return provider.answer(prompt)
+
+            async def close(self):
+                pass
+
+        return Session()
+
+
+class StubSearchProvider(SearchProvider):
+    """Offline stand-in for web search: a website and a LinkedIn result per query."""
+
+    def __init__(self, **simulation):
+        self.simulation = _Simulation(**simulation)
+
+    @property
+    def cache_name(self) -> str:
+        return 'stub-ddgs'
+
+    def search(self, query, max_results):
+        delay, error = self.simulation.draw()
+        time.sleep(delay)
+        if error:
+            raise error
+        words = [word for word in re.split(r'\W+', query.lower()) if word and word not in ('site', 'linkedin', 'com', 'in', 'company', 'official')]
+        slug = '-'.join(words[:2]) or 'example'
+        results = [
+            {"title": f"{slug.title()} - Official Site", "url": f"https://www.{slug.replace('-', '')}.com", "snippet": f"Welcome to {slug}."},
+            {"title": f"{slug.title()} | LinkedIn", "url": f"https://www.linkedin.com/company/{slug}", "snippet": f"{slug} on LinkedIn."},
+            {"title": f"{slug.title()} - Profile", "url": f"https://www.linkedin.com/in/{slug}", "snippet": f"{slug}, Software Engineer."},
+        ]
+        return results[:max_results]
+
+
+# ---- Registry ----
+
+BACKENDS = {
+    'openai': OpenAIProvider,
+    'gemini': GeminiProvider,
+    'ddg': DDGSearchProvider,
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def stub_settings() -> dict:
+    return {**DEFAULT_STUB, **getattr(settings, 'ENRICHMENT_STUB', {})}
+
+
+def build_provider(role: str, backend: str):
+    if backend == 'stub':
+        if role == 'search':
+            return StubSearchProvider(**stub_settings())
+        return StubProvider(role, ROLE_SERVICES[role], **stub_settings())
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown enrichment provider backend '{backend}' for '{role}'")
+    return BACKENDS[backend]()
+
+
+def get_provider(role: str):
+    """The provider of a role ('gpt', 'gemini' or 'search'), created from settings on first use."""
+    with _providers_lock:
+        provider = _providers.get(role)
+        if provider is None:
+            backends = {**DEFAULT_PROVIDERS, **getattr(settings, 'ENRICHMENT_PROVIDERS', {})}
+            provider = _providers[role] = build_provider(role, backends[role])
+        return provider
+
+
+def reset_providers() -> None:
+    """Forget the created providers, e.g. after changing ENRICHMENT_PROVIDERS / ENRICHMENT_STUB."""
+    with _providers_lock:
+        _providers.clear()
@@ -0,0 +1,238 @@
+"""
+Process-wide rate limiting for enrichment providers.
+
+Each provider (ddgs, openai, gemini) has one token bucket shared by every
+thread and event loop of the process, configured by
+settings.ENRICHMENT_RATE_LIMITS:
+
+    ENRICHMENT_RATE_LIMITS = {
+        'openai': {'rate': 8, 'burst': 8},   # requests per second, bucket size
+        ...
+    }
+
+Callers only wait when the bucket is empty. A 429 / rate-limit error halves
+the provider's rate and pauses it with exponential backoff; every successful
+call then restores the rate gradually (AIMD).
+
+Calls also go through the provider's circuit breaker (circuit_breaker.py):
+failed calls count towards opening it, and while it is open calls fail at
+once with ProviderUnavailable.
+"""
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from django.conf import settings
+from .circuit_breaker import get_breaker
+from .metrics import track_call
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_RATE_LIMITS = {
+    'ddgs': {'rate': 1.0, 'burst': 2},
+    'openai': {'rate': 8.0, 'burst': 8},
+    'gemini': {'rate': 4.0, 'burst': 4},
+}
+
+# Adaptive backoff after a rate-limit error
+MIN_RATE_FACTOR = 0.1
+RECOVERY_STEP = 0.05
+INITIAL_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# Retries of a call that failed with a rate-limit error
+DEFAULT_RETRIES = 2
+
+# Rate-limit exception types of the OpenAI and DuckDuckGo clients
+RATE_LIMIT_ERRORS = ('RateLimitError', 'RatelimitException')
+# Explicit rate-limit wording, for errors that carry no status code
+RATE_LIMIT_MESSAGE = re.compile(r'rate[ _-]?limit|too many requests|resource[ _]exhausted', re.IGNORECASE)
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose rate adapts to rate-limit errors."""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.factor = 1.0
+        self.backoff = 0.0
+        self.paused_until = 0.0
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def current_rate(self) -> float:
+        return self.rate * self.factor
+
+    def reserve(self) -> float:
+        """
+        Take a token, going into debt if the bucket is empty.
+
+        Returns:
+            float: Seconds the caller must wait before making its request
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.current_rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.current_rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self) -> float:
+        """
+        Record a rate-limit error: halve the rate and pause the provider.
+
+        Returns:
+            float: The pause in seconds
+        """
+        with self.lock:
+            self.factor = max(MIN_RATE_FACTOR, self.factor / 2)
+            self.backoff = min(MAX_BACKOFF, self.backoff * 2 if self.backoff else INITIAL_BACKOFF)
+            self.paused_until = max(self.paused_until, time.monotonic() + self.backoff)
+            return self.backoff
+
+    def reward(self) -> None:
+        """Record a successful call: recover the rate step by step."""
+        with self.lock:
+            self.factor = min(1.0, self.factor + RECOVERY_STEP)
+            if self.factor == 1.0:
+                self.backoff = 0.0
+
+    def state(self) -> dict:
+        with self.lock:
+            return {
+                'rate': self.rate,
+                'current_rate': round(self.current_rate, 3),
+                'burst': self.burst,
+                'paused_for': round(max(0.0, self.paused_until - time.monotonic()), 3),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> TokenBucket:
+    """The process-wide bucket of a provider (created from settings on first use)."""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limits = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'ENRICHMENT_RATE_LIMITS', {})}
+            config = limits.get(provider, {'rate': 1.0, 'burst': 1})
+            limiter = _limiters[provider] = TokenBucket(config['rate'], config.get('burst', 1))
+        return limiter
+
+
+def reset_limiters() -> None:
+    """Forget the buckets, e.g. after changing ENRICHMENT_RATE_LIMITS."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def limiter_states() -> dict:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {provider: limiter.state() for provider, limiter in limiters.items()}
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    True for HTTP 429 / rate-limit errors of any provider client: the
+    client's rate-limit exception type, a 429 status code on the error
+    (OpenAI status_code, Gemini code) or its response, or else an explicit
+    "rate limit" / "Too Many Requests" / RESOURCE_EXHAUSTED message.
+    """
+    if type(error).__name__ in RATE_LIMIT_ERRORS:
+        return True
+    response = getattr(error, 'response', None)
+    statuses = (
+        getattr(error, 'status_code', None),
+        getattr(error, 'code', None),
+        getattr(response, 'status_code', None),
+    )
+    if 429 in statuses:
+        return True
+    return bool(RATE_LIMIT_MESSAGE.search(str(error)))
+
+
+def call_with_rate_limit(provider: str, fn, retries: int = DEFAULT_RETRIES):
+    """
+    Call fn() once the provider's bucket allows it.
+    Rate-limit errors slow the provider down and are retried up to `retries` times.
+    The call is recorded in the provider's metrics (see metrics.py).
+
+    Raises:
+        ProviderUnavailable: If the provider's circuit is open
+    """
+    limiter = get_limiter(provider)
+    breaker = get_breaker(provider)
+    with track_call(provider) as call:
+        breaker.before_call()
+        for attempt in range(retries + 1):
+            started = time.monotonic()
+            limiter.acquire()
+            call.waited += time.monotonic() - started
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == retries:
+                    breaker.record_failure()
+                    if is_rate_limit_error(e):
+                        call.outcome = 'rate_limited'
+                    raise
+                logger.warning('%s rate limited, backing off %ss', provider, limiter.penalize())
+                call.retries += 1
+                continue
+            except BaseException:
+                breaker.abandon()
+                raise
+            limiter.reward()
+            breaker.record_success()
+            return result
+
+
+async def call_with_rate_limit_async(provider: str, fn, retries: int = DEFAULT_RETRIES):
+    """Async call_with_rate_limit(); fn is a coroutine function."""
+    limiter = get_limiter(provider)
+    breaker = get_breaker(provider)
+    with track_call(provider) as call:
+        breaker.before_call()
+        for attempt in range(retries + 1):
+            try:
+                started = time.monotonic()
+                await limiter.acquire_async()
+                call.waited += time.monotonic() - started
+                result = await fn()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == retries:
+                    breaker.record_failure()
+                    if is_rate_limit_error(e):
+                        call.outcome = 'rate_limited'
+                    raise
+                logger.warning('%s rate limited, backing off %ss', provider, limiter.penalize())
+                call.retries += 1
+                continue
+            except BaseException:
+                # e.g. the task was cancelled
+                breaker.abandon()
+                raise
+            limiter.reward()
+            breaker.record_success()
+            return result
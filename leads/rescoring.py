@@ -0,0 +1,549 @@
+"""
+Bulk Lead Rescoring Engine
+
+Set-based counterpart of Lead.save() scoring, used by the
+`recalculate_scores` management command:
+1. Enterprise user counts for every domain come from a single GROUP BY
+2. Leads are read in keyset order over email and scored in memory, chunk by
+   chunk, with the vectorized calculate_lead_scores() kernel
+3. Each chunk is written back with a handful of set-based UPDATEs on
+   lead_score/lead_stage (one per distinct score); in changed-only mode just
+   the rows whose score or stage differs from the stored one, in dry-run
+   mode none at all. Stage transitions are counted either way.
+
+Work can be split into shards by company domain (see rescoring_workers),
+so every process owns whole domains and team counts need no coordination.
+Runs record their keyset cursor in RescoreCheckpoint and can be resumed.
+
+It also keeps team adoption incremental: when a save, delete or bulk_create
+moves a domain across TEAM_ADOPTION_THRESHOLD, only that domain's leads are
+rescored instead of the whole table.
+"""
+
+import uuid
+import zlib
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from .models import Company, Lead, RescoreCheckpoint
+from .scoring import (
+    TEAM_ADOPTION_THRESHOLD,
+    annotate_email_domain,
+    build_score_columns,
+    calculate_lead_scores,
+    extract_domain,
+    get_team_user_count,
+    team_key,
+    team_user_counts,
+)
+
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# Stay below SQLite's default limit of 999 bound parameters per query
+MAX_QUERY_PARAMS = 900
+
+# Companies per query when rescoring many teams at once
+TEAM_BATCH_SIZE = MAX_QUERY_PARAMS
+
+# A running checkpoint without progress for this long belongs to a dead process
+STALE_AFTER = timedelta(minutes=5)
+
+# Only the columns scoring reads (plus the pk and the columns we write)
+SCORING_FIELDS = ('email', 'company', 'session_count', 'pdl_job_title', 'lead_score', 'lead_stage')
+
+
+def score_chunk(leads: list, team_counts: dict) -> None:
+    """Score a list of leads in memory using precomputed team counts."""
+    columns = build_score_columns(
+        (lead.email, lead.session_count, lead.pdl_job_title,
+         team_counts.get((lead.company_id, extract_domain(lead.email)), 0))
+        for lead in leads
+    )
+    scores, stages = calculate_lead_scores(columns)
+    for lead, score, stage in zip(leads, scores.tolist(), stages.tolist()):
+        lead.lead_score = score
+        lead.lead_stage = stage
+
+
+def write_chunk(leads: list) -> None:
+    """
+    Persist the scores of a chunk.
+
+    Scores only take ~100 distinct values (and the score decides the stage),
+    so rows are grouped by (score, stage) and written with one
+    UPDATE ... WHERE email IN (...) per group. That is far cheaper than
+    bulk_update(), whose CASE WHEN statements SQLite caps at a few rows each.
+    """
+    groups = defaultdict(list)
+    for lead in leads:
+        groups[(lead.lead_score, lead.lead_stage)].append(lead.email)
+
+    with transaction.atomic():
+        for (score, stage), emails in groups.items():
+            for start in range(0, len(emails), MAX_QUERY_PARAMS):
+                Lead.objects.filter(email__in=emails[start:start + MAX_QUERY_PARAMS]).update(
+                    lead_score=score, lead_stage=stage
+                )
+
+
+def filter_leads(email: str = None, stage: str = None):
+    """Build the Lead queryset selected by the recalculate_scores filters."""
+    leads = Lead.objects.all()
+    if email:
+        leads = leads.filter(email=email)
+    if stage:
+        leads = leads.filter(lead_stage=stage)
+    return leads
+
+
+def shard_of(domain: str, shard_count: int) -> int:
+    """Stable shard index of a company domain (the same in every process)."""
+    return zlib.crc32(domain.encode('utf-8')) % shard_count
+
+
+def count_shard(leads, shard: tuple = None, limit: int = None) -> int:
+    """Number of leads a run over this queryset processes (optionally one shard, first `limit` by email)."""
+    if limit:
+        leads = leads.order_by('email')[:limit]
+    if not shard:
+        return leads.count()
+    index, count = shard
+    if limit:
+        domains = leads.values_list('company_id', flat=True).iterator(chunk_size=DEFAULT_CHUNK_SIZE)
+        return sum(1 for domain in domains if shard_of(domain, count) == index)
+    # One row per company rather than one per lead
+    per_company = (
+        leads.order_by().values('company_id').annotate(lead_count=Count('email'))
+        .values_list('company_id', 'lead_count').iterator(chunk_size=DEFAULT_CHUNK_SIZE)
+    )
+    return sum(lead_count for domain, lead_count in per_company if shard_of(domain, count) == index)
+
+
+def company_ranges(leads, parts: int, shard: tuple = None) -> list:
+    """
+    Split the companies of a Lead queryset into `parts` contiguous company_id
+    ranges holding about the same number of leads, from one GROUP BY pass.
+
+    Args:
+        shard: Optional (index, count); only companies of this shard are counted
+
+    Returns:
+        list: [(low, high), ...] for in_company_range(); together they cover
+              every company_id, so leads added meanwhile are not missed
+    """
+    per_company = [
+        (domain, lead_count)
+        for domain, lead_count in leads.order_by('company_id').values('company_id')
+        .annotate(lead_count=Count('email')).values_list('company_id', 'lead_count')
+        if not shard or shard_of(domain, shard[1]) == shard[0]
+    ]
+    total = sum(lead_count for _, lead_count in per_company)
+    bounds = []
+    seen = 0
+    for domain, lead_count in per_company:
+        # Cut before the company that would take this part furthest past its share
+        if len(bounds) < parts - 1 and seen and seen + lead_count / 2 > total * (len(bounds) + 1) / parts:
+            bounds.append(domain)
+        seen += lead_count
+    edges = [None] + bounds + [None]
+    ranges = [(edges[part], edges[part + 1]) for part in range(len(edges) - 1)]
+    # Fewer companies than parts: the remaining parts get an empty range
+    return ranges + [('', '')] * (parts - len(ranges))
+
+
+def in_company_range(leads, company_range: tuple):
+    """Leads whose company_id is in [low, high) of a company_ranges() range (None = unbounded)."""
+    low, high = company_range
+    if low is not None:
+        leads = leads.filter(company_id__gte=low)
+    if high is not None:
+        leads = leads.filter(company_id__lt=high)
+    return leads
+
+
+def limit_cutoff(leads, limit: int):
+    """Email of the `limit`-th lead in email order (None without a limit or with fewer leads)."""
+    if not limit:
+        return None
+    return leads.order_by('email').values_list('email', flat=True)[limit - 1:limit].first()
+
+
+def rescore_leads(leads=None, chunk_size: int = DEFAULT_CHUNK_SIZE, team_counts: dict = None,
+                  on_progress=None, shard: tuple = None, limit: int = None, checkpoint=None,
+                  changed_only: bool = False, dry_run: bool = False) -> dict:
+    """
+    Recalculate score and stage for a queryset of leads in bulk.
+
+    Leads are read in keyset order over email (WHERE email > cursor
+    ORDER BY email LIMIT chunk_size), so every chunk costs the same at any
+    depth and no read cursor stays open while the chunk is written.
+
+    Args:
+        leads: Lead queryset to rescore (defaults to all leads)
+        chunk_size: Number of leads read, scored and written per batch
+        team_counts: Precomputed team_user_counts() (computed if omitted)
+        on_progress: Optional callable(processed) called after every chunk
+        shard: Optional (index, count); only leads whose company domain
+               hashes to this shard are rescored
+        limit: Only consider the first `limit` leads in email order
+        checkpoint: Optional RescoreCheckpoint; the run starts after its
+                    cursor and records its progress there after every chunk
+        changed_only: Only write leads whose score or stage changed
+        dry_run: Compute and compare scores without writing anything
+
+    Returns:
+        dict: {'processed': int, 'updated': int, 'changed': int, 'failed': int,
+               'errors': [str, ...], 'transitions': Counter({(old_stage, new_stage): int})}
+    """
+    if leads is None:
+        leads = Lead.objects.all()
+    if team_counts is None:
+        team_counts = team_user_counts()
+
+    stats = empty_stats()
+    cursor = None
+    scanned = 0
+    if checkpoint:
+        cursor = checkpoint.last_email
+        scanned = checkpoint.scanned
+        stats = checkpoint_stats(checkpoint)
+
+    ordered = leads.only(*SCORING_FIELDS).order_by('email')
+    while limit is None or scanned < limit:
+        page = ordered if cursor is None else ordered.filter(email__gt=cursor)
+        size = chunk_size if limit is None else min(chunk_size, limit - scanned)
+        chunk = list(page[:size])
+        if not chunk:
+            break
+        scanned += len(chunk)
+        cursor = chunk[-1].email
+
+        if shard:
+            index, count = shard
+            chunk = [lead for lead in chunk if shard_of(lead.company_id, count) == index]
+        if chunk:
+            _flush(chunk, team_counts, stats, write=None if dry_run else 'changed' if changed_only else 'all')
+
+        if checkpoint:
+            checkpoint.record_progress(cursor, scanned, stats, summarize_stats(stats))
+        if on_progress:
+            on_progress(stats['processed'])
+
+    return stats
+
+
+def _flush(chunk: list, team_counts: dict, stats: dict, write: str = 'all') -> None:
+    """
+    Score one chunk and write it back, recording the outcome in stats.
+
+    write is 'all', 'changed' (only leads whose score or stage changed) or
+    None (dry run).
+    """
+    stored = [(lead.lead_score, lead.lead_stage) for lead in chunk]
+    try:
+        score_chunk(chunk, team_counts)
+        changed = [
+            lead for lead, (score, stage) in zip(chunk, stored)
+            if (lead.lead_score, lead.lead_stage) != (score, stage)
+        ]
+        written = chunk if write == 'all' else changed if write == 'changed' else []
+        if written:
+            write_chunk(written)
+        stats['updated'] += len(written)
+        stats['changed'] += len(changed)
+        stats['transitions'].update(
+            (stage, lead.lead_stage)
+            for lead, (_, stage) in zip(chunk, stored)
+            if lead.lead_stage != stage
+        )
+    except Exception as e:
+        stats['failed'] += len(chunk)
+        stats['errors'].append(f'{chunk[0].email}..{chunk[-1].email}: {e}')
+    stats['processed'] += len(chunk)
+
+
+def empty_stats() -> dict:
+    return {'processed': 0, 'updated': 0, 'changed': 0, 'failed': 0, 'errors': [], 'transitions': Counter()}
+
+
+def merge_stats(results) -> dict:
+    """Combine the stats of several rescore_leads() runs (e.g. one per shard)."""
+    merged = empty_stats()
+    for stats in results:
+        for key, value in stats.items():
+            merged[key] += value
+    return merged
+
+
+def summarize_stats(stats: dict, max_errors: int = 20) -> dict:
+    """JSON-friendly summary of rescore_leads() stats, stored on finished checkpoints."""
+    return {
+        'changed': stats['changed'],
+        'transitions': {
+            f'{old_stage or "none"}→{new_stage}': count
+            for (old_stage, new_stage), count in stats['transitions'].most_common()
+        },
+        'errors': stats['errors'][:max_errors],
+    }
+
+
+def checkpoint_stats(checkpoint) -> dict:
+    """rescore_leads() stats recorded by a checkpoint, to resume (or report) its shard."""
+    stats = empty_stats()
+    stats.update(processed=checkpoint.processed, updated=checkpoint.updated, failed=checkpoint.failed)
+    summary = checkpoint.summary or {}
+    stats['changed'] = summary.get('changed', 0)
+    stats['errors'] = list(summary.get('errors', []))
+    for transition, count in summary.get('transitions', {}).items():
+        old_stage, new_stage = transition.split('→')
+        stats['transitions'][(None if old_stage == 'none' else old_stage, new_stage)] = count
+    return stats
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def start_checkpoint(run_id: str, shard: tuple, options: dict, total: int = 0):
+    """Create the checkpoint of one shard of a run, or load it when resuming."""
+    index, count = shard or (0, 1)
+    checkpoint, created = RescoreCheckpoint.objects.get_or_create(
+        run_id=run_id,
+        shard_index=index,
+        shard_count=count,
+        defaults={'options': options, 'total': total},
+    )
+    if not created and checkpoint.status != 'completed':
+        checkpoint.status = 'running'
+        checkpoint.save(update_fields=['status', 'updated_at'])
+    return checkpoint
+
+
+def live_checkpoints():
+    """Running checkpoints that recorded progress within STALE_AFTER (their process is alive)."""
+    return RescoreCheckpoint.objects.filter(status='running', updated_at__gte=timezone.now() - STALE_AFTER)
+
+
+def find_resumable_run(run_id: str = None):
+    """
+    Find a run to resume: the given run id, or the latest run that did not complete.
+    Runs another process is still executing (see live_checkpoints()) are never returned.
+
+    Returns:
+        RescoreCheckpoint: Any checkpoint of that run (its options describe the run), or None
+    """
+    checkpoints = RescoreCheckpoint.objects.exclude(run_id__in=live_checkpoints().values('run_id'))
+    if run_id:
+        return checkpoints.filter(run_id=run_id).order_by('-started_at').first()
+    return checkpoints.exclude(status='completed').order_by('-started_at').first()
+
+
+# ---------------------------------------------------------------------------
+# Incremental team adoption
+# ---------------------------------------------------------------------------
+
+def team_members(key: tuple):
+    """Queryset of the leads that make up a team (company domain, email domain)."""
+    company_domain, email_domain = key
+    return annotate_email_domain(Lead.objects.filter(company_id=company_domain)).filter(email_domain=email_domain)
+
+
+def team_size(key: tuple) -> int:
+    """Number of enterprise users currently in a team."""
+    return get_team_user_count(key)
+
+
+def rescore_team(key: tuple) -> dict:
+    """Rescore every lead of one team; cost scales with the team, not the table."""
+    return rescore_leads(team_members(key), team_counts={key: team_size(key)})
+
+
+def rescore_teams(keys) -> dict:
+    """
+    Rescore several teams at once, a batch of companies per query.
+
+    Rescores every lead of the teams' companies; leads outside the teams
+    keep the same score, so this is safe and far cheaper than one
+    rescore_team() call per team.
+    """
+    return rescore_companies({company_domain for company_domain, _ in keys})
+
+
+def rescore_companies(companies) -> dict:
+    """Rescore every lead of the given companies, a batch of companies per query."""
+    companies = sorted(companies)
+    results = []
+    for start in range(0, len(companies), TEAM_BATCH_SIZE):
+        leads = Lead.objects.filter(company_id__in=companies[start:start + TEAM_BATCH_SIZE])
+        results.append(rescore_leads(leads, team_counts=team_user_counts(leads)))
+    return merge_stats(results)
+
+
+def company_team_counts(companies) -> dict:
+    """team_user_counts() of the leads of the given companies, a batch of companies per query."""
+    companies = sorted(companies)
+    counts = {}
+    for start in range(0, len(companies), TEAM_BATCH_SIZE):
+        counts.update(team_user_counts(Lead.objects.filter(company_id__in=companies[start:start + TEAM_BATCH_SIZE])))
+    return counts
+
+
+def refresh_team_after_join(key: tuple) -> bool:
+    """
+    Call after a lead joined a team (insert or domain change).
+    Rescores the team only if the join crossed the adoption threshold.
+
+    Returns:
+        bool: True if the team was rescored
+    """
+    if key is None or team_size(key) != TEAM_ADOPTION_THRESHOLD:
+        return False
+    rescore_team(key)
+    return True
+
+
+def refresh_team_after_leave(key: tuple) -> bool:
+    """
+    Call after a lead left a team (delete or domain change).
+    Rescores the remaining members only if the team dropped below the threshold.
+
+    Returns:
+        bool: True if the team was rescored
+    """
+    if key is None or team_size(key) != TEAM_ADOPTION_THRESHOLD - 1:
+        return False
+    rescore_team(key)
+    return True
+
+
+def score_new_leads(leads: list) -> set:
+    """
+    Score leads about to be bulk-inserted, counting them towards their teams
+    and their companies' enterprise_user_count.
+
+    Returns:
+        set: Team keys the insert pushes across the adoption threshold; their
+             existing members must be rescored once the rows exist.
+    """
+    keys = [team_key(lead.email, lead.company_id) for lead in leads]
+    companies = {key[0] for key in keys if key}
+    existing = team_user_counts(Lead.objects.filter(company_id__in=companies)) if companies else {}
+
+    added = {}
+    for key in keys:
+        if key:
+            added[key] = added.get(key, 0) + 1
+    after = {key: existing.get(key, 0) + count for key, count in added.items()}
+
+    score_chunk(leads, after)
+    for key, count in added.items():
+        adjust_enterprise_user_count(key, count)
+    return {
+        key for key, count in after.items()
+        if existing.get(key, 0) < TEAM_ADOPTION_THRESHOLD <= count
+    }
+
+
+def upsert_companies(leads: list) -> set:
+    """
+    Companies whose teams a bulk_create with ignore_conflicts or
+    update_conflicts can change: those of the new rows, plus the current
+    companies of rows that already exist (an update may move them).
+    """
+    companies = {lead.company_id for lead in leads}
+    emails = [lead.email for lead in leads]
+    for start in range(0, len(emails), MAX_QUERY_PARAMS):
+        companies.update(
+            Lead.objects.filter(email__in=emails[start:start + MAX_QUERY_PARAMS]).values_list('company_id', flat=True)
+        )
+    return companies
+
+
+def refresh_companies_after_upsert(companies: set, before: dict) -> None:
+    """
+    Call after a bulk_create with conflicts, with the company_team_counts()
+    of those companies from before it: fixes their enterprise_user_count
+    and rescores their leads against the actual team sizes.
+    """
+    after = company_team_counts(companies)
+    for key in before.keys() | after.keys():
+        adjust_enterprise_user_count(key, after.get(key, 0) - before.get(key, 0))
+    rescore_companies(companies)
+
+
+def teams_left_below_threshold(removed: dict) -> set:
+    """
+    Call after leads were bulk-deleted, with the team_user_counts() of the
+    deleted leads.
+
+    Returns:
+        set: Team keys the delete dropped below the adoption threshold that
+             still have members; those members must be rescored.
+    """
+    remaining = company_team_counts({company_domain for company_domain, _ in removed})
+    return {
+        key for key, count in removed.items()
+        if 0 < remaining.get(key, 0) < TEAM_ADOPTION_THRESHOLD <= remaining.get(key, 0) + count
+    }
+
+
+# ---------------------------------------------------------------------------
+# Company.enterprise_user_count
+# ---------------------------------------------------------------------------
+
+def adjust_enterprise_user_count(key: tuple, delta: int) -> None:
+    """
+    Atomically shift Company.enterprise_user_count when a lead joins or
+    leaves its company's own-domain team.
+    """
+    if key is None or key[0] != key[1] or not delta:
+        return
+    Company.objects.filter(domain=key[0]).update(enterprise_user_count=F('enterprise_user_count') + delta)
+
+
+def own_domain_team_counts(leads) -> dict:
+    """
+    Enterprise users per company among the given leads, counting only leads
+    on their company's own domain (what Company.enterprise_user_count tracks).
+
+    Returns:
+        dict: {company_domain: user_count, ...}
+    """
+    return {
+        company_domain: count
+        for (company_domain, email_domain), count in team_user_counts(leads).items()
+        if company_domain == email_domain
+    }
+
+
+def rebuild_enterprise_user_counts(apply: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE) -> list:
+    """
+    Recompute Company.enterprise_user_count from the leads table.
+
+    Args:
+        apply: Write the corrected values (False only reports them)
+        chunk_size: Number of companies written per bulk_update
+
+    Returns:
+        list: [(domain, stored_count, actual_count), ...] for every mismatch
+    """
+    actual = own_domain_team_counts(Lead.objects.all())
+    stored = Company.objects.values_list('domain', 'enterprise_user_count').iterator(chunk_size=chunk_size)
+    mismatches = [
+        (domain, count, actual.get(domain, 0))
+        for domain, count in stored
+        if count != actual.get(domain, 0)
+    ]
+
+    if apply:
+        for start in range(0, len(mismatches), chunk_size):
+            companies = [
+                Company(domain=domain, enterprise_user_count=count)
+                for domain, _, count in mismatches[start:start + chunk_size]
+            ]
+            with transaction.atomic():
+                Company.objects.bulk_update(companies, ['enterprise_user_count'])
+    return mismatches
@@ -0,0 +1,144 @@
+"""
+Background rescoring jobs for the "Recalculate Score" HTTP endpoints.
+
+A job is an ordinary checkpointed rescoring run executed in a daemon thread
+of the web process, so the request returns immediately with the run id as
+job id. Progress is read back from the job's RescoreCheckpoint rows, which
+also makes the job resumable from the command line
+(`recalculate_scores --resume <job id>`) if the server stops mid-run.
+
+Only one run may be active at a time: a checkpoint that is still 'running'
+and has recorded progress within STALE_AFTER blocks new jobs.
+"""
+
+import logging
+import threading
+from django.db import connection
+from django.utils import timezone
+from .models import Lead, RescoreCheckpoint
+from .rescoring import (
+    DEFAULT_CHUNK_SIZE,
+    STALE_AFTER,
+    live_checkpoints,
+    new_run_id,
+    rescore_leads,
+    start_checkpoint,
+    summarize_stats,
+)
+from .scoring import team_user_counts
+
+
+logger = logging.getLogger(__name__)
+
+_start_lock = threading.Lock()
+
+
+class RescoreJobRunning(Exception):
+    """Raised when a rescoring job is requested while another run is active."""
+
+    def __init__(self, run_id):
+        super().__init__(f'Rescoring run {run_id} is already in progress')
+        self.run_id = run_id
+
+
+def active_run():
+    """Latest running checkpoint that is still making progress, or None."""
+    return live_checkpoints().order_by('-started_at').first()
+
+
+def start_rescore_job() -> str:
+    """
+    Start rescoring every lead in a background thread.
+
+    Returns:
+        str: Job id (the run id of its checkpoint)
+
+    Raises:
+        RescoreJobRunning: If another rescoring run is active
+    """
+    with _start_lock:
+        running = active_run()
+        if running:
+            raise RescoreJobRunning(running.run_id)
+        run_id = new_run_id()
+        checkpoint = start_checkpoint(
+            run_id,
+            None,
+            {'changed_only': True, 'chunk_size': DEFAULT_CHUNK_SIZE, 'workers': 1, 'shard': None,
+             'email': None, 'stage': None, 'limit': None},
+            total=Lead.objects.count(),
+        )
+
+    threading.Thread(target=_run_job, args=(checkpoint,), name=f'rescore-{run_id}', daemon=True).start()
+    return run_id
+
+
+def _run_job(checkpoint) -> None:
+    try:
+        stats = rescore_leads(team_counts=team_user_counts(), checkpoint=checkpoint, changed_only=True)
+        checkpoint.finish(summary=summarize_stats(stats))
+    except Exception:
+        logger.exception('Rescoring job %s failed', checkpoint.run_id)
+        checkpoint.finish('failed')
+    finally:
+        # The thread's connection is not closed by the request cycle
+        connection.close()
+
+
+def job_status(run_id: str):
+    """
+    Progress of a rescoring run, aggregated over all of its shards.
+
+    Returns:
+        dict: Status, progress, ETA and (once finished) final stats, or None
+              if there is no such run
+    """
+    checkpoints = list(RescoreCheckpoint.objects.filter(run_id=run_id))
+    if not checkpoints:
+        return None
+
+    now = timezone.now()
+    statuses = {checkpoint.status for checkpoint in checkpoints}
+    if 'failed' in statuses:
+        status = 'failed'
+    elif 'running' in statuses:
+        last_update = max(checkpoint.updated_at for checkpoint in checkpoints)
+        status = 'stalled' if now - last_update > STALE_AFTER else 'running'
+    else:
+        status = 'completed'
+
+    processed = sum(checkpoint.processed for checkpoint in checkpoints)
+    total = sum(checkpoint.total for checkpoint in checkpoints)
+    started_at = min(checkpoint.started_at for checkpoint in checkpoints)
+    finished_at = None if status == 'running' else max(
+        (checkpoint.finished_at or checkpoint.updated_at) for checkpoint in checkpoints
+    )
+    elapsed = ((finished_at or now) - started_at).total_seconds()
+
+    eta_seconds = None
+    if status == 'running' and processed and total > processed:
+        eta_seconds = round((total - processed) * elapsed / processed, 1)
+
+    transitions = {}
+    for checkpoint in checkpoints:
+        for transition, count in checkpoint.summary.get('transitions', {}).items():
+            transitions[transition] = transitions.get(transition, 0) + count
+
+    return {
+        'job_id': run_id,
+        'status': status,
+        'processed': processed,
+        'total': total,
+        'percent': processed * 100 // total if total else 100,
+        'eta_seconds': eta_seconds,
+        'elapsed_seconds': round(elapsed, 1),
+        'started_at': started_at.isoformat(),
+        'finished_at': finished_at.isoformat() if finished_at else None,
+        'stats': {
+            'updated': sum(checkpoint.updated for checkpoint in checkpoints),
+            'failed': sum(checkpoint.failed for checkpoint in checkpoints),
+            'changed': sum(checkpoint.summary.get('changed', 0) for checkpoint in checkpoints),
+            'transitions': transitions,
+            'errors': [error for checkpoint in checkpoints for error in checkpoint.summary.get('errors', [])],
+        },
+    }
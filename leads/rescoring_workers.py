@@ -0,0 +1,165 @@
+"""
+Multi-process rescoring.
+
+Splits a rescoring run into shards by company domain and runs each shard in
+its own process. Every process owns whole domains, so team adoption counts
+need no cross-process coordination; progress and stats are aggregated in
+the parent.
+
+A host that runs shard i of n (`--shard i/n`) splits its companies into
+contiguous company_id ranges with about the same number of leads, one per
+worker, from a single GROUP BY in the parent. Workers only read the leads
+of their range, and get the team counts the parent computed once.
+
+Worker j checkpoints the global shard (i + n*j) of n*N, so hosts and
+workers never overlap, and records its range there: a run is resumed with
+the same number of workers and the same ranges.
+"""
+
+import multiprocessing
+from queue import Empty
+
+
+def worker_shards(shard: tuple, workers: int) -> list:
+    """Global (index, count) shards handled by the workers of one host shard."""
+    index, count = shard
+    return [(index + count * worker, count * workers) for worker in range(workers)]
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _rescore_shard(worker: int, filters: dict, shard: tuple, host_shard: tuple, company_range: tuple,
+                   last_email: str, team_counts: dict, chunk_size: int, run_id: str, options: dict,
+                   changed_only: bool, dry_run: bool, progress_queue) -> dict:
+    from .rescoring import (
+        checkpoint_stats, filter_leads, in_company_range, rescore_leads, start_checkpoint, summarize_stats,
+    )
+
+    def on_progress(processed):
+        progress_queue.put((worker, processed))
+
+    # Created (or left from the interrupted run) by the parent
+    checkpoint = start_checkpoint(run_id, shard, options) if run_id else None
+    if checkpoint and checkpoint.status == 'completed':
+        # Finished before the run was interrupted; keep its summary
+        return checkpoint_stats(checkpoint)
+
+    leads = in_company_range(filter_leads(**filters), company_range)
+    if last_email is not None:
+        # --limit: the first `limit` leads of the whole host, not of this range
+        leads = leads.filter(email__lte=last_email)
+    try:
+        stats = rescore_leads(
+            leads,
+            chunk_size=chunk_size,
+            team_counts=team_counts,
+            on_progress=on_progress,
+            shard=host_shard if host_shard[1] > 1 else None,
+            checkpoint=checkpoint,
+            changed_only=changed_only,
+            dry_run=dry_run,
+        )
+    except Exception:
+        if checkpoint:
+            checkpoint.finish('failed')
+        raise
+    if checkpoint:
+        checkpoint.finish(summary=summarize_stats(stats))
+    return stats
+
+
+def _worker_ranges(leads, shard: tuple, workers: int, run_id: str) -> list:
+    """company_ranges() of the workers, or the ones recorded when the run started."""
+    from .models import RescoreCheckpoint
+    from .rescoring import company_ranges
+
+    if run_id:
+        recorded = {
+            (checkpoint.shard_index, checkpoint.shard_count): checkpoint.options.get('company_range')
+            for checkpoint in RescoreCheckpoint.objects.filter(run_id=run_id)
+        }
+        ranges = [recorded.get(worker_shard) for worker_shard in worker_shards(shard, workers)]
+        if all(company_range is not None for company_range in ranges):
+            return [tuple(company_range) for company_range in ranges]
+    return company_ranges(leads, workers, shard if shard[1] > 1 else None)
+
+
+def rescore_in_workers(filters: dict, workers: int, shard: tuple = (0, 1), chunk_size: int = None,
+                       on_progress=None, limit: int = None, run_id: str = None, options: dict = None,
+                       changed_only: bool = False, dry_run: bool = False) -> dict:
+    """
+    Rescore the leads selected by filters with a pool of worker processes.
+
+    Args:
+        filters: Keyword arguments for rescoring.filter_leads()
+        workers: Number of processes
+        shard: (index, count) of the host-level shard to process
+        chunk_size: Number of leads scored and written per batch
+        on_progress: Optional callable(processed) with the total across workers
+        limit: Only consider the first `limit` leads in email order
+        run_id: Checkpoint every worker's shard under this run id (resumes
+                from existing checkpoints of the run)
+        options: Command options stored with new checkpoints
+        changed_only: Only write leads whose score or stage changed
+        dry_run: Compare scores without writing anything
+
+    Returns:
+        dict: Merged rescore_leads() stats of all workers
+    """
+    from django.db import connections
+    from .rescoring import DEFAULT_CHUNK_SIZE, filter_leads, limit_cutoff, merge_stats, start_checkpoint
+    from .scoring import team_user_counts
+
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+
+    leads = filter_leads(**filters)
+    last_email = limit_cutoff(leads, limit)
+    if last_email is not None:
+        leads = leads.filter(email__lte=last_email)
+    ranges = _worker_ranges(leads, shard, workers, run_id)
+    if run_id:
+        # Recorded before any worker starts, so a resume always finds every range
+        for worker_shard, company_range in zip(worker_shards(shard, workers), ranges):
+            start_checkpoint(run_id, worker_shard, {**(options or {}), 'company_range': company_range})
+    # Team adoption counts for every domain in a single GROUP BY, shared by all workers
+    team_counts = team_user_counts()
+
+    # Workers open their own connections; don't share the parent's
+    connections.close_all()
+
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager, context.Pool(workers, initializer=_init_worker) as pool:
+        progress_queue = manager.Queue()
+        results = [
+            pool.apply_async(
+                _rescore_shard,
+                (worker, filters, worker_shard, shard, company_range, last_email,
+                 _counts_in_range(team_counts, company_range), chunk_size, run_id, options or {},
+                 changed_only, dry_run, progress_queue),
+            )
+            for worker, (worker_shard, company_range) in enumerate(zip(worker_shards(shard, workers), ranges))
+        ]
+
+        progress = [0] * workers
+        while not all(result.ready() for result in results) or not progress_queue.empty():
+            try:
+                worker, processed = progress_queue.get(timeout=0.5)
+            except Empty:
+                continue
+            progress[worker] = processed
+            if on_progress:
+                on_progress(sum(progress))
+
+        return merge_stats(result.get() for result in results)
+
+
+def _counts_in_range(team_counts: dict, company_range: tuple) -> dict:
+    """The team counts a worker needs: those of the companies in its range."""
+    low, high = company_range
+    return {
+        key: count for key, count in team_counts.items()
+        if (low is None or key[0] >= low) and (high is None or key[0] < high)
+    }
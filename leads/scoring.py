@@ -9,7 +9,10 @@ Implements sophisticated multi-signal lead scoring algorithm based on:
 5. Email type signals
 """
 
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Value
+from django.db.models.functions import Lower, StrIndex, Substr
+from functools import lru_cache
+import numpy as np
 import re
 
 
@@ -23,22 +26,42 @@ FREE_EMAIL_DOMAINS = {
     'hotmail.co.uk', 'yahoo.co.uk', 'myyahoo.com',
 }
 
-# Job title scoring hierarchy
-JOB_TITLE_SCORES = {
-    'ciso': 20,
-    'cto': 20,
-    'chief information': 20,
-    'chief technology': 20,
-    'vp': 15,
-    'vice president': 15,
-    'director': 15,
-    'manager': 10,
-    'senior': 8,
-    'engineer': 5,
-    'developer': 5,
-    'analyst': 5,
-    'specialist': 5,
-}
+# Enterprise users needed on one domain for the team adoption bonus
+TEAM_ADOPTION_THRESHOLD = 2
+
+# Stage thresholds: a score >= LEAD_STAGE_THRESHOLDS[i] reaches LEAD_STAGES[i + 1]
+LEAD_STAGE_THRESHOLDS = np.array([20, 40, 60, 80])
+LEAD_STAGES = np.array(['low', 'medium', 'high', 'very_high', 'enterprise'])
+
+# Job title rules: (keyword, score, hierarchical level), matched as substrings
+# of the lowercased title. When several keywords match, the highest score wins.
+JOB_TITLE_RULES = [
+    ('ciso', 20, 'high'),
+    ('chief information', 20, 'high'),
+    ('cto', 20, 'high'),
+    ('chief technology', 20, 'high'),
+    ('vp ', 15, 'high'),
+    ('vice president', 15, 'high'),
+    ('director', 15, 'high'),
+    ('manager', 10, 'medium'),
+    ('senior', 8, 'medium'),
+    ('engineer', 5, 'low'),
+    ('developer', 5, 'low'),
+    ('analyst', 5, 'low'),
+    ('specialist', 5, 'low'),
+]
+
+UNKNOWN_JOB_TITLE = (0, 'unknown')
+
+_JOB_TITLE_LOOKUP = {keyword: (score, level) for keyword, score, level in JOB_TITLE_RULES}
+
+# One alternation inside a lookahead finds every (overlapping) keyword in a
+# single scan, e.g. both 'director' and the 'cto' inside it.
+_JOB_TITLE_PATTERN = re.compile(
+    '(?=(' + '|'.join(re.escape(keyword) for keyword, _, _ in JOB_TITLE_RULES) + '))'
+)
+
+JOB_TITLE_CACHE_SIZE = 4096
 
 
 def is_free_email_domain(email: str) -> bool:
@@ -56,39 +79,37 @@ def extract_domain(email: str) -> str:
     return email.split('@')[1].lower()
 
 
+@lru_cache(maxsize=JOB_TITLE_CACHE_SIZE)
+def _classify_normalized_title(title: str) -> tuple:
+    """Classify an already lowercased job title (memoized)."""
+    best = UNKNOWN_JOB_TITLE
+    for match in _JOB_TITLE_PATTERN.finditer(title):
+        rule = _JOB_TITLE_LOOKUP[match.group(1)]
+        if rule[0] > best[0]:
+            best = rule
+    return best
+
+
+def classify_job_title(job_title: str) -> tuple:
+    """
+    Classify a job title in a single pass.
+
+    Returns:
+        tuple: (score: int, hierarchical_level: str)
+    """
+    if not job_title:
+        return UNKNOWN_JOB_TITLE
+    return _classify_normalized_title(job_title.lower())
+
+
+def classify_titles(job_titles) -> list:
+    """Classify many job titles at once (e.g. for rescoring or CSV import)."""
+    return [classify_job_title(job_title) for job_title in job_titles]
+
+
 def get_job_title_score(job_title: str) -> int:
     """Calculate score based on job title."""
-    if not job_title:
-        return 0
-    
-    job_title_lower = job_title.lower()
-    
-    # Check for CISO/CTO first (highest priority)
-    if 'ciso' in job_title_lower or 'chief information' in job_title_lower:
-        return 20
-    if 'cto' in job_title_lower or 'chief technology' in job_title_lower:
-        return 20
-    
-    # Check for VP/Director
-    if 'vp ' in job_title_lower or 'vice president' in job_title_lower:
-        return 15
-    if 'director' in job_title_lower:
-        return 15
-    
-    # Check for Manager
-    if 'manager' in job_title_lower:
-        return 10
-    
-    # Check for Senior
-    if 'senior' in job_title_lower:
-        return 8
-    
-    # Default for IC roles
-    for keyword in ['engineer', 'developer', 'analyst', 'specialist']:
-        if keyword in job_title_lower:
-            return 5
-    
-    return 0
+    return classify_job_title(job_title)[0]
 
 
 def count_users_per_domain(lead_domain: str) -> dict:
@@ -117,10 +138,81 @@ def count_users_per_domain(lead_domain: str) -> dict:
     return {domain: len(emails) for domain, emails in users_per_domain.items()}
 
 
-def calculate_lead_score(lead) -> tuple:
+def team_key(email: str, company_domain: str):
     """
-    Calculate lead score and stage based on multiple signals.
-    
+    Identify the team a lead counts towards for the team adoption signal.
+
+    Returns:
+        tuple: (company_domain, email_domain), or None for free/invalid emails
+    """
+    email_domain = extract_domain(email)
+    if not email_domain or email_domain in FREE_EMAIL_DOMAINS:
+        return None
+    return (company_domain, email_domain)
+
+
+def annotate_email_domain(leads):
+    """Annotate a Lead queryset with the lowercased `email_domain` of each lead."""
+    return leads.filter(email__contains='@').annotate(
+        email_domain=Lower(Substr('email', StrIndex('email', Value('@')) + 1))
+    )
+
+
+def get_team_user_count(key: tuple) -> int:
+    """
+    Number of enterprise users in a team (company domain, email domain).
+
+    Leads on their company's own domain are counted by the materialized
+    Company.enterprise_user_count column; any other pairing falls back to
+    count_users_per_domain().
+    """
+    from leads.models import Company
+
+    company_domain, email_domain = key
+    if company_domain == email_domain:
+        count = Company.objects.filter(domain=company_domain).values_list('enterprise_user_count', flat=True).first()
+        return count or 0
+    return count_users_per_domain(company_domain).get(email_domain, 0)
+
+
+def team_user_counts(leads=None) -> dict:
+    """
+    Count enterprise users per (company domain, email domain) in one GROUP BY.
+
+    This is the set-based equivalent of calling count_users_per_domain() for
+    every company: free email providers are excluded and each lead is counted
+    once under the email domain it signed up with.
+
+    Args:
+        leads: Optional Lead queryset to restrict the count (defaults to all leads)
+
+    Returns:
+        dict: {(company_domain, email_domain): user_count, ...}
+    """
+    from leads.models import Lead
+
+    if leads is None:
+        leads = Lead.objects.all()
+
+    rows = (
+        annotate_email_domain(leads.order_by())
+        .exclude(email_domain__in=FREE_EMAIL_DOMAINS)
+        .values('company_id', 'email_domain')
+        .annotate(user_count=Count('email'))
+    )
+    return {(row['company_id'], row['email_domain']): row['user_count'] for row in rows}
+
+
+def score_lead_signals(email: str, session_count, job_title: str, team_user_count: int) -> tuple:
+    """
+    Score a lead from its raw signals, without touching the database.
+
+    Args:
+        email: Lead email address
+        session_count: Number of sessions (may be None)
+        job_title: Job title (may be None)
+        team_user_count: Enterprise users sharing this lead's email domain
+
     Returns:
         tuple: (score: int, stage: str)
     """
@@ -128,43 +220,34 @@ def calculate_lead_score(lead) -> tuple:
     
     # Signal 1: Base Score - Session Count (0-50 points)
     # 1 session = 1 point (max 50)
-    if lead.session_count:
-        session_score = min(lead.session_count, 50)
+    if session_count:
+        session_score = min(session_count, 50)
         score += session_score
     
     # Signal 2: Product Adoption - Months of Usage
     # 6+ months of usage = +25 bonus
     # Estimated from session count: ~10 sessions per month
-    if lead.session_count and lead.session_count >= 60:
+    if session_count and session_count >= 60:
         score += 25
     
     # Signal 3: Team Adoption Signal - Users Per Domain (most important)
     # 2+ unique users on same ENTERPRISE domain = +30 bonus
-    try:
-        domain_user_counts = count_users_per_domain(lead.company.domain)
-        
-        # Check if this lead's email domain has 2+ users
-        email_domain = extract_domain(lead.email)
-        if email_domain and email_domain in domain_user_counts:
-            if domain_user_counts[email_domain] >= 2:
-                score += 30
-    except Exception:
-        # If counting fails, skip this signal
-        pass
+    if team_user_count >= TEAM_ADOPTION_THRESHOLD:
+        score += 30
     
     # Signal 4: Job Title Hierarchy (5-20 points)
-    if lead.pdl_job_title:
-        score += get_job_title_score(lead.pdl_job_title)
+    if job_title:
+        score += get_job_title_score(job_title)
     
     # Signal 5: Gmail Qualified Adjustment (+5 points)
     # Applied when using Gmail but with other positive signals
-    if is_free_email_domain(lead.email) and lead.email.endswith('@gmail.com'):
+    if is_free_email_domain(email) and email.endswith('@gmail.com'):
         if score > 0:  # Only if there are other positive signals
             score += 5
     
     # Signal 6: Enterprise Domain Bonus (+30 points)
     # Using corporate domain (not free email provider)
-    if not is_free_email_domain(lead.email):
+    if not is_free_email_domain(email):
         score += 30
     
     # Signal 7: ASN / Corporate IP Signals (future enhancement)
@@ -175,7 +258,7 @@ def calculate_lead_score(lead) -> tuple:
     # (can be added when email security data is available)
     
     # Signal 9: Free Email Penalty (-10 points)
-    if is_free_email_domain(lead.email) and not lead.email.endswith('@gmail.com'):
+    if is_free_email_domain(email) and not email.endswith('@gmail.com'):
         score -= 10
     
     # Clamp score between 0-100
@@ -196,6 +279,92 @@ def calculate_lead_score(lead) -> tuple:
     return score, stage
 
 
+def build_score_columns(rows) -> dict:
+    """
+    Turn raw lead signals into the column arrays used by calculate_lead_scores().
+
+    Args:
+        rows: Iterable of (email, session_count, job_title, team_user_count) tuples
+
+    Returns:
+        dict: {'session_count', 'free_email', 'gmail', 'job_title_score', 'team_adoption'} arrays
+    """
+    session_counts = []
+    free_email = []
+    gmail = []
+    job_titles = []
+    team_adoption = []
+
+    for email, session_count, job_title, team_user_count in rows:
+        is_free = is_free_email_domain(email)
+        session_counts.append(session_count or 0)
+        free_email.append(is_free)
+        gmail.append(is_free and email.endswith('@gmail.com'))
+        job_titles.append(job_title)
+        team_adoption.append(team_user_count >= TEAM_ADOPTION_THRESHOLD)
+
+    title_scores = [score for score, _ in classify_titles(job_titles)]
+
+    return {
+        'session_count': np.array(session_counts, dtype=np.int64),
+        'free_email': np.array(free_email, dtype=bool),
+        'gmail': np.array(gmail, dtype=bool),
+        'job_title_score': np.array(title_scores, dtype=np.int64),
+        'team_adoption': np.array(team_adoption, dtype=bool),
+    }
+
+
+def calculate_lead_scores(columns: dict) -> tuple:
+    """
+    Vectorized version of score_lead_signals() for many leads at once.
+
+    Args:
+        columns: Arrays as returned by build_score_columns()
+
+    Returns:
+        tuple: (scores: int ndarray, stages: str ndarray)
+    """
+    sessions = columns['session_count']
+    free_email = columns['free_email']
+    gmail = columns['gmail']
+
+    # Signals 1-4: sessions (max 50), 6+ months usage, team adoption, job title
+    score = np.minimum(sessions, 50)
+    score = score + np.where(sessions >= 60, 25, 0)
+    score = score + np.where(columns['team_adoption'], 30, 0)
+    score = score + columns['job_title_score']
+
+    # Signal 5: Gmail qualified, only on top of other positive signals
+    score = score + np.where(gmail & (score > 0), 5, 0)
+
+    # Signal 6: Enterprise domain bonus / Signal 9: free email penalty
+    score = score + np.where(free_email, 0, 30)
+    score = score - np.where(free_email & ~gmail, 10, 0)
+
+    score = np.clip(score, 0, 100)
+    stages = LEAD_STAGES[np.searchsorted(LEAD_STAGE_THRESHOLDS, score, side='right')]
+    return score, stages
+
+
+def calculate_lead_score(lead) -> tuple:
+    """
+    Calculate lead score and stage based on multiple signals.
+    
+    Returns:
+        tuple: (score: int, stage: str)
+    """
+    team_user_count = 0
+    try:
+        key = team_key(lead.email, lead.company_id)
+        if key:
+            team_user_count = get_team_user_count(key)
+    except Exception:
+        # If counting fails, skip this signal
+        pass
+    
+    return score_lead_signals(lead.email, lead.session_count, lead.pdl_job_title, team_user_count)
+
+
 def auto_calculate_score_and_stage(lead):
     """
     Automatically calculate and update lead score and stage.
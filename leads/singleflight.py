@@ -0,0 +1,87 @@
+"""
+In-process single-flight registry.
+
+When several threads ask for the same key at once (e.g. two views enriching
+the same domain), only the first one runs the work; the others wait for and
+share its result. Counters record how many calls ran and how many were
+coalesced onto an in-flight call.
+"""
+
+import threading
+from collections import Counter
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Registry of in-flight calls keyed by (kind, key)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = Counter()
+        self._coalesced = Counter()
+
+    def do(self, kind: str, key: str, fn):
+        """
+        Run fn() for (kind, key), or wait for the call already running for it.
+
+        Returns:
+            tuple: (result, shared) where shared is True if the result came
+                   from another caller's call. Errors of that call are raised
+                   in every waiting caller.
+        """
+        flight_key = (kind, key)
+        with self._lock:
+            call = self._calls.get(flight_key)
+            leader = call is None
+            if leader:
+                call = self._calls[flight_key] = _Call()
+                self._executed[kind] += 1
+            else:
+                self._coalesced[kind] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+            call.done.set()
+        return call.result, False
+
+    def record_coalesced(self, kind: str, count: int = 1) -> None:
+        """Count calls coalesced elsewhere (e.g. inside the async pipeline)."""
+        with self._lock:
+            self._coalesced[kind] += count
+
+    def stats(self) -> dict:
+        """{kind: {'executed': int, 'coalesced': int, 'in_flight': int}}"""
+        with self._lock:
+            in_flight = Counter(kind for kind, _ in self._calls)
+            kinds = set(self._executed) | set(self._coalesced)
+            return {
+                kind: {
+                    'executed': self._executed[kind],
+                    'coalesced': self._coalesced[kind],
+                    'in_flight': in_flight[kind],
+                }
+                for kind in sorted(kinds)
+            }
+
+
+# Shared by enrich_company() and enrich_lead()
+enrichment_flights = SingleFlight()
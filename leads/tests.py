@@ -1,3 +1,1051 @@
-from django.test import TestCase
+import queue
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from itertools import product
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import enrichment, enrichment_jobs
+from .circuit_breaker import CircuitBreaker, ProviderUnavailable, reset_breakers
+from .enrichment import (
+    build_company_batch_prompt, build_lead_prompt, build_url_selection_prompt, collect_candidates, company_contexts,
+    parse_json_response, person_search_queries, run_parallel, search_person_with_ddgs, stage_listeners, timed_stage,
+    validate_company_info,
+)
+from .enrichment_cache import MISS, cached_call, evict, get_cached, set_cached
+from .enrichment_plan import plan_company, record_attempt
+from .enrichment_jobs import (
+    MAX_ATTEMPTS, charge_job, claim_tasks, complete_task, enqueue_enrichment, fail_task, job_budget_exceeded, job_status,
+    process_tasks,
+)
+from .enrichment_schedule import lead_priority, parse_budget, prioritized_leads
+from .metrics import Histogram, Spend, flush_metrics, metrics_snapshot, record_usage, recorded_metrics, reset_metrics
+from .models import Company, EnrichmentCache, EnrichmentJob, EnrichmentTask, Lead, ProviderMetric, RescoreCheckpoint
+from .providers import StubProvider, StubProviderError, StubRateLimitError, reset_providers
+from .rate_limit import TokenBucket, call_with_rate_limit, get_limiter, is_rate_limit_error, reset_limiters
+from .rescoring import (
+    checkpoint_stats, company_ranges, count_shard, find_resumable_run, in_company_range, limit_cutoff, merge_stats,
+    rescore_leads, start_checkpoint, summarize_stats,
+)
+from .rescoring_jobs import RescoreJobRunning, start_rescore_job
+from .rescoring_jobs import job_status as rescore_job_status
+from .rescoring_workers import _rescore_shard, worker_shards
+from .scoring import (
+    build_score_columns, calculate_lead_score, calculate_lead_scores, classify_job_title, classify_titles,
+    score_lead_signals, team_user_counts,
+)
+from .management.commands.benchmark_enrichment import percentile
+from .singleflight import SingleFlight
+from .web_search import search_cache_key, search_web
+
+
+class VectorizedScoringTests(SimpleTestCase):
+    """calculate_lead_scores() must apply exactly the same rules as score_lead_signals()."""
+
+    EMAILS = ['ana@acme.com', 'bob@gmail.com', 'cy@GMAIL.com', 'dee@yahoo.com', 'not-an-email']
+    SESSION_COUNTS = [None, -5, 0, 1, 19, 49, 50, 59, 60, 200]
+    JOB_TITLES = [None, '', 'CTO', 'Director of Sales', 'VP Engineering', 'Manager', 'Senior Analyst', 'janitor']
+    TEAM_USER_COUNTS = [0, 1, 2, 7]
+
+    def test_matches_scalar_scoring(self):
+        rows = list(product(self.EMAILS, self.SESSION_COUNTS, self.JOB_TITLES, self.TEAM_USER_COUNTS))
+        scores, stages = calculate_lead_scores(build_score_columns(rows))
+
+        for row, score, stage in zip(rows, scores.tolist(), stages.tolist()):
+            with self.subTest(row=row):
+                self.assertEqual((score, stage), score_lead_signals(*row))
+
+    def test_stage_thresholds(self):
+        rows = [('x@acme.com', sessions, None, 0) for sessions in (0, 9, 10, 29, 30, 49, 50)]
+        _, stages = calculate_lead_scores(build_score_columns(rows))
+        self.assertEqual(
+            stages.tolist(),
+            ['medium', 'medium', 'high', 'high', 'very_high', 'very_high', 'enterprise'],
+        )
+
+
+class JobTitleClassifierTests(SimpleTestCase):
+
+    def test_highest_matching_rule_wins(self):
+        self.assertEqual(classify_job_title('Senior Engineering Manager'), (10, 'medium'))
+        self.assertEqual(classify_job_title('VP of Engineering'), (15, 'high'))
+        self.assertEqual(classify_job_title('CISO'), (20, 'high'))
+
+    def test_matches_overlapping_keywords(self):
+        # 'director' contains 'cto'; substring matching has always scored it as CTO
+        self.assertEqual(classify_job_title('Director'), (20, 'high'))
+
+    def test_unknown_titles(self):
+        self.assertEqual(classify_titles([None, '', 'Janitor', 'vp']), [(0, 'unknown')] * 4)
+
+
+class BulkRescoringTests(TestCase):
+
+    def setUp(self):
+        for domain in ('acme.com', 'gmail.com', 'solo.io'):
+            Company.objects.create(domain=domain)
+        for email, domain, sessions, title in [
+            ('a@acme.com', 'acme.com', 5, 'CTO'),
+            ('b@acme.com', 'acme.com', 70, 'Director'),
+            ('f@Acme.com', 'acme.com', -3, 'manager'),
+            ('c@gmail.com', 'gmail.com', 3, None),
+            ('g@gmail.com', 'acme.com', 10, 'senior dev'),
+            ('e@solo.io', 'solo.io', None, 'VP Sales'),
+            ('not-an-email', 'solo.io', 1, None),
+        ]:
+            Lead.objects.create(email=email, company_id=domain, session_count=sessions, pdl_job_title=title)
+
+    def test_matches_per_lead_scoring(self):
+        expected = {lead.email: calculate_lead_score(lead) for lead in Lead.objects.all()}
+        Lead.objects.update(lead_score=0, lead_stage=None)
+        call_command('recalculate_scores', chunk_size=3, stdout=StringIO())
+        self.assertEqual({lead.email: (lead.lead_score, lead.lead_stage) for lead in Lead.objects.all()}, expected)
+
+    def test_filters_and_limit(self):
+        Lead.objects.update(lead_score=0)
+        call_command('recalculate_scores', limit=2, chunk_size=1, stdout=StringIO())
+        self.assertEqual(Lead.objects.exclude(lead_score=0).count(), 2)
+        call_command('recalculate_scores', email='e@solo.io', stdout=StringIO())
+        self.assertNotEqual(Lead.objects.get(email='e@solo.io').lead_score, 0)
+        self.assertEqual(Lead.objects.filter(lead_score=0).count(), 4)
+
+
+class IncrementalTeamScoringTests(TestCase):
+    """Team adoption (+30 from two enterprise users per domain) follows joins and leaves."""
+
+    def setUp(self):
+        Company.objects.create(domain='acme.com')
+        Company.objects.create(domain='other.com')
+
+    def score(self, email):
+        return Lead.objects.get(email=email).lead_score
+
+    def test_join_and_leave(self):
+        Lead.objects.create(email='a@acme.com', company_id='acme.com')
+        self.assertEqual(self.score('a@acme.com'), 30)
+        b = Lead.objects.create(email='b@acme.com', company_id='acme.com')
+        self.assertEqual((b.lead_score, self.score('a@acme.com')), (60, 60))
+
+        b.company_id = 'other.com'
+        b.save()
+        self.assertEqual(self.score('a@acme.com'), 30)
+        b.company_id = 'acme.com'
+        b.save()
+        self.assertEqual(self.score('a@acme.com'), 60)
+        b.delete()
+        self.assertEqual(self.score('a@acme.com'), 30)
+
+    def test_bulk_create_rescores_existing_members(self):
+        Lead.objects.create(email='a@acme.com', company_id='acme.com')
+        Lead.objects.bulk_create([
+            Lead(email='b@acme.com', company_id='acme.com', session_count=5),
+            Lead(email='c@gmail.com', company_id='acme.com', session_count=5),
+        ])
+        self.assertEqual(
+            (self.score('a@acme.com'), self.score('b@acme.com'), self.score('c@gmail.com')), (60, 65, 10),
+        )
+
+    def test_bulk_create_with_conflicts_counts_existing_rows_once(self):
+        Lead.objects.create(email='a@acme.com', company_id='acme.com')
+        Lead.objects.bulk_create(
+            [Lead(email='a@acme.com', company_id='acme.com'), Lead(email='b@acme.com', company_id='acme.com')],
+            ignore_conflicts=True,
+        )
+        self.assertEqual((self.score('a@acme.com'), self.score('b@acme.com')), (60, 60))
+        self.assertEqual(Company.objects.get(domain='acme.com').enterprise_user_count, 2)
+
+        # An upsert that moves a lead to another company leaves its old team
+        Lead.objects.bulk_create(
+            [Lead(email='a@acme.com', company_id='other.com')],
+            update_conflicts=True, unique_fields=['email'], update_fields=['company'],
+        )
+        self.assertEqual(self.score('b@acme.com'), 30)
+        self.assertEqual(
+            dict(Company.objects.values_list('domain', 'enterprise_user_count')), {'acme.com': 1, 'other.com': 0},
+        )
+
+    def test_bulk_delete_rescores_remaining_members(self):
+        for email in ('a@acme.com', 'b@acme.com', 'c@gmail.com'):
+            Lead.objects.create(email=email, company_id='acme.com')
+        self.assertEqual(self.score('a@acme.com'), 60)
+        Lead.objects.filter(email__in=['b@acme.com', 'c@gmail.com']).delete()
+        self.assertEqual(self.score('a@acme.com'), 30)
+
+
+class EnterpriseUserCountTests(TestCase):
+
+    def setUp(self):
+        Company.objects.create(domain='acme.com')
+        Company.objects.create(domain='other.com')
+
+    def count(self, domain):
+        return Company.objects.get(domain=domain).enterprise_user_count
+
+    def test_follows_saves_moves_and_deletes(self):
+        for email in ('a@acme.com', 'b@acme.com', 'c@gmail.com'):
+            Lead.objects.create(email=email, company_id='acme.com')
+        Lead.objects.bulk_create([Lead(email='d@acme.com', company_id='acme.com')])
+        self.assertEqual(self.count('acme.com'), 3)
+
+        lead = Lead.objects.get(email='a@acme.com')
+        lead.company_id = 'other.com'
+        lead.save()
+        self.assertEqual((self.count('acme.com'), self.count('other.com')), (2, 0))
+
+        Lead.objects.filter(email__in=['b@acme.com', 'c@gmail.com']).delete()
+        self.assertEqual(self.count('acme.com'), 1)
+        Lead.objects.get(email='d@acme.com').delete()
+        self.assertEqual(self.count('acme.com'), 0)
+
+    def test_rebuild_command(self):
+        Lead.objects.create(email='a@acme.com', company_id='acme.com')
+        Company.objects.update(enterprise_user_count=9)
+        out = StringIO()
+        call_command('rebuild_enterprise_user_counts', verify=True, stdout=out)
+        self.assertIn('2 company count(s) out of date', out.getvalue())
+        self.assertEqual(self.count('acme.com'), 9)
+        call_command('rebuild_enterprise_user_counts', stdout=StringIO())
+        self.assertEqual((self.count('acme.com'), self.count('other.com')), (1, 0))
+
+
+class SkipScoringTests(TestCase):
+    """Lead.save() only rescores when a scoring input is written with a new value."""
+
+    def setUp(self):
+        Company.objects.create(domain='acme.com')
+        Lead.objects.create(email='a@acme.com', company_id='acme.com', session_count=5)
+        self.lead = Lead.objects.get(email='a@acme.com')
+
+    def test_unrelated_saves_skip_scoring(self):
+        with self.assertNumQueries(1):
+            self.lead.crm_owner = 'ana'
+            self.lead.save()
+        self.lead.session_count = 10
+        with self.assertNumQueries(1):
+            self.lead.save(update_fields=['crm_owner'])
+        self.assertEqual(Lead.objects.get(email='a@acme.com').lead_score, 35)
+
+    def test_changed_inputs_rescore(self):
+        self.lead.session_count = 10
+        self.lead.save(update_fields=['session_count'])
+        self.assertEqual(Lead.objects.get(email='a@acme.com').lead_score, 40)
+
+        self.lead.session_count = 20
+        self.lead.save(skip_scoring=True)
+        self.assertEqual(Lead.objects.get(email='a@acme.com').lead_score, 40)
+
+
+class ChangedOnlyRescoringTests(TestCase):
+
+    def setUp(self):
+        Company.objects.create(domain='acme.com')
+        for i in range(3):
+            Lead.objects.create(email=f'u{i}@acme.com', company_id='acme.com', session_count=i)
+        Lead.objects.filter(email='u0@acme.com').update(lead_score=0, lead_stage='low')
+
+    def test_dry_run_reports_without_writing(self):
+        stats = rescore_leads(dry_run=True)
+        self.assertEqual((stats['changed'], stats['updated']), (1, 0))
+        self.assertEqual(stats['transitions'], {('low', 'very_high'): 1})
+        self.assertEqual(Lead.objects.get(email='u0@acme.com').lead_stage, 'low')
+
+    def test_changed_only_writes_changed_rows(self):
+        stats = rescore_leads(changed_only=True)
+        self.assertEqual((stats['changed'], stats['updated']), (1, 1))
+        self.assertEqual(Lead.objects.get(email='u0@acme.com').lead_stage, 'very_high')
+        self.assertEqual(rescore_leads(changed_only=True)['updated'], 0)
+
+
+class ShardedRescoringTests(TestCase):
+
+    def setUp(self):
+        for i in range(6):
+            Company.objects.create(domain=f'c{i}.com')
+            for j in range(i % 3 + 1):
+                Lead.objects.create(email=f'u{j}@c{i}.com', company_id=f'c{i}.com', session_count=j)
+
+    def test_worker_shards_partition_host_shards(self):
+        self.assertEqual(worker_shards((1, 2), 3), [(1, 6), (3, 6), (5, 6)])
+        hosts = [shard for host in range(2) for shard in worker_shards((host, 2), 3)]
+        self.assertEqual(sorted(index for index, _ in hosts), list(range(6)))
+
+    def test_shards_cover_every_lead_once(self):
+        Lead.objects.update(lead_score=0)
+        shards = [(index, 3) for index in range(3)]
+        self.assertEqual(sum(count_shard(Lead.objects.all(), shard) for shard in shards), Lead.objects.count())
+
+        results = [rescore_leads(shard=shard, chunk_size=2) for shard in shards]
+        self.assertEqual(
+            [stats['processed'] for stats in results], [count_shard(Lead.objects.all(), shard) for shard in shards],
+        )
+        self.assertEqual(merge_stats(results)['processed'], Lead.objects.count())
+        self.assertFalse(Lead.objects.filter(lead_score=0).exists())
+
+    def test_company_ranges_split_the_leads(self):
+        leads = Lead.objects.all()
+        for parts in (1, 3, 10):
+            ranges = company_ranges(leads, parts)
+            self.assertEqual(len(ranges), parts)
+            sizes = [in_company_range(leads, company_range).count() for company_range in ranges]
+            self.assertEqual(sum(sizes), leads.count())
+            if parts == 3:
+                self.assertTrue(all(sizes))
+
+    def test_workers_read_their_range_with_the_parent_team_counts(self):
+        expected = {lead.email: calculate_lead_score(lead) for lead in Lead.objects.all()}
+        Lead.objects.update(lead_score=0)
+        team_counts = team_user_counts()
+        cutoff = limit_cutoff(Lead.objects.all(), 8)
+        with mock.patch('leads.rescoring.team_user_counts', side_effect=AssertionError('counted in a worker')):
+            results = [
+                _rescore_shard(worker, {}, (worker, 3), (0, 1), company_range, cutoff, team_counts, 2,
+                               None, {}, False, False, queue.Queue())
+                for worker, company_range in enumerate(company_ranges(Lead.objects.filter(email__lte=cutoff), 3))
+            ]
+        self.assertEqual(merge_stats(results)['processed'], 8)
+        rescored = Lead.objects.filter(email__lte=cutoff)
+        self.assertEqual({lead.email: (lead.lead_score, lead.lead_stage) for lead in rescored},
+                         {email: expected[email] for email in rescored.values_list('email', flat=True)})
+        self.assertEqual(Lead.objects.filter(lead_score=0).count(), 4)
+
+
+class ResumableRescoringTests(TestCase):
+
+    def setUp(self):
+        Company.objects.create(domain='acme.com')
+        for i in range(5):
+            Lead.objects.create(email=f'u{i}@acme.com', company_id='acme.com', session_count=i)
+        Lead.objects.update(lead_score=0)
+
+    def test_resume_continues_after_the_checkpoint(self):
+        checkpoint = start_checkpoint('run1', None, {'chunk_size': 2})
+        rescore_leads(limit=2, chunk_size=2, checkpoint=checkpoint)
+        self.assertEqual((checkpoint.last_email, checkpoint.processed), ('u1@acme.com', 2))
+
+        checkpoint.finish('failed')
+        resumed = start_checkpoint('run1', None, {})
+        self.assertEqual(resumed.status, 'running')
+        stats = rescore_leads(chunk_size=2, checkpoint=resumed)
+        self.assertEqual((stats['processed'], resumed.scanned), (5, 5))
+        self.assertFalse(Lead.objects.filter(lead_score=0).exists())
+
+    def test_resumed_stats_include_changes_before_the_restart(self):
+        Lead.objects.update(lead_stage=None)
+        checkpoint = start_checkpoint('run1', None, {})
+        rescore_leads(limit=2, chunk_size=2, checkpoint=checkpoint)
+        checkpoint.finish('failed')
+
+        stats = rescore_leads(chunk_size=2, checkpoint=start_checkpoint('run1', None, {}))
+        self.assertEqual((stats['changed'], sum(stats['transitions'].values())), (5, 5))
+        self.assertEqual(checkpoint_stats(RescoreCheckpoint.objects.get(run_id='run1'))['transitions'], stats['transitions'])
+
+    def test_completed_shards_are_not_rerun(self):
+        checkpoint = start_checkpoint('run1', (0, 2), {})
+        stats = rescore_leads(checkpoint=checkpoint)
+        checkpoint.finish(summary=summarize_stats(stats))
+
+        with mock.patch('leads.rescoring.rescore_leads') as rescore:
+            resumed = _rescore_shard(
+                0, {}, (0, 2), (0, 1), (None, None), None, {}, 100, 'run1', {}, False, False, queue.Queue(),
+            )
+        rescore.assert_not_called()
+        self.assertEqual((resumed['processed'], resumed['changed']), (stats['processed'], stats['changed']))
+        self.assertEqual(RescoreCheckpoint.objects.get(run_id='run1').summary, summarize_stats(stats))
+
+    def test_runs_still_in_progress_are_not_resumed(self):
+        start_checkpoint('live', None, {})
+        self.assertIsNone(find_resumable_run())
+        self.assertIsNone(find_resumable_run('live'))
+
+        RescoreCheckpoint.objects.filter(run_id='live').update(updated_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(find_resumable_run().run_id, 'live')
+        with self.assertRaisesMessage(CommandError, 'still in progress'):
+            start_checkpoint('other', None, {})
+            call_command('recalculate_scores', resume='other', stdout=StringIO())
+
+
+class RescoreJobTests(TestCase):
+
+    def setUp(self):
+        Company.objects.create(domain='acme.com')
+        for i in range(3):
+            Lead.objects.create(email=f'u{i}@acme.com', company_id='acme.com', session_count=i)
+        # The job thread is not started; tests run its work in the test's transaction
+        patcher = mock.patch('leads.rescoring_jobs.threading.Thread')
+        self.thread = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_job_at_a_time(self):
+        job_id = start_rescore_job()
+        self.thread.return_value.start.assert_called_once_with()
+        with self.assertRaises(RescoreJobRunning) as raised:
+            start_rescore_job()
+        self.assertEqual(raised.exception.run_id, job_id)
+
+        response = self.client.post(reverse('leads:recalculate_scores'), HTTP_ACCEPT='application/json')
+        self.assertEqual((response.status_code, response.json()['job_id']), (409, job_id))
+
+        # A job whose process died stops blocking new ones
+        RescoreCheckpoint.objects.update(updated_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(rescore_job_status(job_id)['status'], 'stalled')
+        response = self.client.post(reverse('leads:recalculate_scores'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+
+    def test_status_of_a_finished_job(self):
+        Lead.objects.filter(email='u0@acme.com').update(lead_score=0, lead_stage='low')
+        job_id = start_rescore_job()
+        self.assertEqual(rescore_job_status(job_id)['status'], 'running')
+
+        _, kwargs = self.thread.call_args
+        [checkpoint] = kwargs['args']
+        stats = rescore_leads(checkpoint=checkpoint, changed_only=True)
+        checkpoint.finish(summary=summarize_stats(stats))
+
+        status = self.client.get(reverse('leads:recalculate_status', args=[job_id])).json()
+        self.assertEqual((status['status'], status['processed'], status['total'], status['percent']), ('completed', 3, 3, 100))
+        self.assertEqual(status['stats']['transitions'], {'low→very_high': 1})
+        self.assertEqual(self.client.get(reverse('leads:recalculate_status', args=['nope'])).status_code, 404)
+
+
+class EnrichmentCacheTests(TestCase):
+
+    def test_answers_are_cached_per_prompt_version(self):
+        calls = []
+
+        def ask():
+            calls.append(1)
+            return {'company_name': 'Acme'}
+
+        self.assertEqual(cached_call('company', 'Acme.com ', 'gpt', 'v1', ask), {'company_name': 'Acme'})
+        self.assertEqual(cached_call('company', 'acme.com', 'gpt', 'v1', ask), {'company_name': 'Acme'})
+        cached_call('company', 'acme.com', 'gpt', 'v2', ask)
+        cached_call('company', 'acme.com', 'gpt', 'v1', ask, use_cache=False)
+        self.assertEqual(len(calls), 3)
+        # Failed calls are not cached
+        self.assertIsNone(cached_call('company', 'b.com', 'gpt', 'v1', lambda: None))
+        self.assertIs(get_cached('company', 'b.com', 'gpt', 'v1'), MISS)
+
+    def test_entries_expire(self):
+        set_cached('lead', 'a@acme.com', 'gemini', 'v1', {'job_title': 'CTO'}, ttl=60)
+        EnrichmentCache.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIs(get_cached('lead', 'a@acme.com', 'gemini', 'v1'), MISS)
+        self.assertEqual(evict(), 1)
+        with override_settings(ENRICHMENT_CACHE_TTL=0):
+            set_cached('lead', 'a@acme.com', 'gemini', 'v1', {'job_title': 'CTO'})
+        self.assertFalse(EnrichmentCache.objects.exists())
+
+    @mock.patch.dict('leads.enrichment_cache._pending_hits', clear=True)
+    def test_hits_only_write_once_the_entry_is_stale(self):
+        set_cached('company', 'a.com', 'gpt', 'v1', {'company_name': 'A'})
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                get_cached('company', 'a.com', 'gpt', 'v1')
+        self.assertEqual(EnrichmentCache.objects.get().hits, 0)
+
+        EnrichmentCache.objects.update(last_used_at=timezone.now() - timedelta(days=4))
+        with self.assertNumQueries(2):
+            get_cached('company', 'a.com', 'gpt', 'v1')
+        entry = EnrichmentCache.objects.get()
+        self.assertEqual(entry.hits, 4)
+        self.assertGreater(entry.last_used_at, timezone.now() - timedelta(minutes=1))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for domain in ('a.com', 'b.com', 'c.com', 'd.com'):
+            set_cached('company', domain, 'gpt', 'v1', {'company_name': domain})
+        EnrichmentCache.objects.update(last_used_at=timezone.now() - timedelta(days=4))
+        get_cached('company', 'a.com', 'gpt', 'v1')
+        get_cached('company', 'c.com', 'gpt', 'v1')
+
+        self.assertEqual(evict(max_entries=2), 2)
+        self.assertEqual(sorted(EnrichmentCache.objects.values_list('subject', flat=True)), ['a.com', 'c.com'])
+
+
+class WebSearchTests(TestCase):
+
+    def setUp(self):
+        self.queries = []
+        self.answers = {}
+
+        def live_search(query, max_results):
+            self.queries.append(query)
+            return [{'title': url, 'url': url, 'snippet': ''} for url in self.answers.get(query, [])]
+
+        patcher = mock.patch('leads.web_search.live_search', side_effect=live_search)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_are_cached_per_normalized_query(self):
+        self.answers['acme official site'] = ['https://acme.com']
+        search_web('Acme  Official Site')
+        self.assertEqual(search_web('acme official site')[0]['url'], 'https://acme.com')
+        search_web('acme official site', max_results=5)
+        self.assertEqual(self.queries, ['acme official site', 'acme official site'])
+
+    def test_long_queries_do_not_share_a_cache_entry(self):
+        prefix = 'x' * 300
+        self.assertNotEqual(search_cache_key(prefix + ' a', 10), search_cache_key(prefix + ' b', 10))
+        self.assertNotEqual(search_cache_key('acme', 10), search_cache_key('acme', 5))
+
+    def test_fallback_queries_only_run_without_a_hit(self):
+        self.answers['acme official site'] = ['https://www.acme.com/']
+        self.assertEqual([item['url'] for item in collect_candidates('acme.com')], ['https://www.acme.com/'])
+        self.assertEqual(len(self.queries), 1)
+
+        self.answers['globex company website'] = ['https://globex.io']
+        self.assertEqual([item['url'] for item in collect_candidates('globex.io')], ['https://globex.io'])
+        self.assertEqual(self.queries[1:], ['globex official site', 'globex company website', 'globex homepage'])
+
+    def test_person_fallback_finds_the_profile(self):
+        self.answers['jane@acme.com linkedin'] = ['https://www.linkedin.com/in/jane-doe']
+        results = search_person_with_ddgs('jane@acme.com')
+        self.assertEqual([item['url'] for item in results], ['https://www.linkedin.com/in/jane-doe'])
+        self.assertEqual(
+            self.queries,
+            ['"jane@acme.com"', 'jane site:linkedin.com/in', 'jane@acme.com linkedin', 'jane linkedin profile'],
+        )
+
+
+class ParallelProviderCallTests(SimpleTestCase):
+
+    def test_results_keep_call_order(self):
+        def answer(value, delay):
+            time.sleep(delay)
+            return value
+
+        self.assertEqual(run_parallel(lambda: answer('gpt', 0.05), lambda: answer('gemini', 0)), ['gpt', 'gemini'])
+
+    def test_calls_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=2)
+        # Each call only returns once the other one is running too
+        self.assertEqual(run_parallel(lambda: barrier.wait() >= 0, lambda: barrier.wait() >= 0), [True, True])
+
+    def test_errors_and_timeouts_yield_none(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = time.monotonic()
+        with self.assertLogs('leads.enrichment', 'WARNING') as logs:
+            results = run_parallel(lambda: int('x'), lambda: release.wait(5), lambda: 'ok', timeout=0.2)
+        self.assertEqual(results, [None, None, 'ok'])
+        self.assertEqual([record.levelname for record in logs.records], ['ERROR', 'WARNING'])
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class RateLimitTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_limiters()
+        reset_breakers()
+        self.addCleanup(reset_limiters)
+        self.addCleanup(reset_breakers)
+
+    def test_bucket_allows_bursts_then_paces(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual((bucket.reserve(), bucket.reserve()), (0.0, 0.0))
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+
+    def test_rate_limit_errors_halve_the_rate_and_back_off(self):
+        bucket = TokenBucket(rate=10, burst=100)
+        self.assertEqual((bucket.penalize(), bucket.penalize()), (1.0, 2.0))
+        self.assertEqual(bucket.state()['current_rate'], 2.5)
+        self.assertGreater(bucket.reserve(), 1.9)
+        for _ in range(20):
+            bucket.reward()
+        self.assertEqual((bucket.state()['current_rate'], bucket.backoff), (10, 0.0))
+
+    @override_settings(ENRICHMENT_RATE_LIMITS={'test': {'rate': 1000, 'burst': 10}})
+    def test_429_is_retried_after_backing_off(self):
+        answers = iter([StubRateLimitError(), 'ok'])
+
+        def call():
+            answer = next(answers)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        with mock.patch('leads.rate_limit.INITIAL_BACKOFF', 0.05), self.assertLogs('leads.rate_limit', 'WARNING'):
+            started = time.monotonic()
+            self.assertEqual(call_with_rate_limit('test', call), 'ok')
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertLess(get_limiter('test').state()['current_rate'], 1000)
+
+        # Other errors are not retried
+        calls = []
+        with self.assertRaises(ValueError):
+            call_with_rate_limit('test', lambda: calls.append(1) or int('x'))
+        self.assertEqual(len(calls), 1)
+
+    def test_rate_limit_error_detection(self):
+        class APIError(Exception):
+            def __init__(self, message, status_code=None, response=None):
+                super().__init__(message)
+                self.status_code = status_code
+                self.response = response
+
+        self.assertTrue(is_rate_limit_error(APIError('slow down', status_code=429)))
+        self.assertTrue(is_rate_limit_error(APIError('error', response=mock.Mock(status_code=429))))
+        self.assertTrue(is_rate_limit_error(Exception('HTTP Error: Too Many Requests')))
+        self.assertTrue(is_rate_limit_error(Exception('429 RESOURCE_EXHAUSTED. Quota exceeded')))
+        self.assertTrue(is_rate_limit_error(StubRateLimitError()))
+        # A 429 elsewhere in the message is not a rate limit
+        self.assertFalse(is_rate_limit_error(Exception('Lead 4291 not found on port 14290')))
+        self.assertFalse(is_rate_limit_error(APIError('bad request', status_code=400)))
+
+
+class CompanyBatchValidationTests(SimpleTestCase):
+
+    def test_normalizes_types(self):
+        info = validate_company_info({'domain': 'a.com', 'company_name': 'A', 'company_size': '1,200', 'city': 42})
+        self.assertEqual((info['company_name'], info['company_size'], info['city']), ('A', 1200, '42'))
+        self.assertNotIn('domain', info)
+
+    def test_rejects_unusable_items(self):
+        self.assertIsNone(validate_company_info('A Inc'))
+        self.assertIsNone(validate_company_info({'domain': 'a.com', 'company_name': None}))
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_calls_share_one_run(self):
+        flights = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        runs = []
+
+        def work():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return {'name': 'Acme'}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do('company', 'acme.com', work)))
+        leader.start()
+        started.wait(5)
+        waiters = [
+            threading.Thread(target=lambda: results.append(flights.do('company', 'acme.com', work)))
+            for _ in range(3)
+        ]
+        for thread in waiters:
+            thread.start()
+        while flights.stats()['company']['coalesced'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader, *waiters]:
+            thread.join(5)
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True])
+        self.assertEqual(flights.stats(), {'company': {'executed': 1, 'coalesced': 3, 'in_flight': 0}})
+
+    def test_errors_reach_waiters_and_clear_the_key(self):
+        flights = SingleFlight()
+        with self.assertRaises(ValueError):
+            flights.do('lead', 'a@b.com', lambda: int('x'))
+        self.assertEqual(flights.do('lead', 'a@b.com', lambda: 1), (1, False))
+
+
+class EnrichmentQueueTests(TestCase):
+
+    def test_enqueue_skips_subjects_already_queued(self):
+        first = enqueue_enrichment('company', ['a.com', 'b.com', 'a.com'])
+        second = enqueue_enrichment('company', ['b.com', 'c.com'])
+        self.assertEqual((first.total, second.total), (2, 1))
+        self.assertEqual(enqueue_enrichment('company', ['a.com']).status, 'completed')
+
+    def test_claimed_tasks_are_not_handed_out_twice(self):
+        enqueue_enrichment('lead', ['a@x.com', 'b@x.com', 'c@x.com'])
+        first = claim_tasks('w1', 2)
+        second = claim_tasks('w2', 2)
+        self.assertEqual([task.subject for task in first], ['a@x.com', 'b@x.com'])
+        self.assertEqual([task.subject for task in second], ['c@x.com'])
+        self.assertEqual(claim_tasks('w3', 2), [])
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        job = enqueue_enrichment('lead', ['a@x.com'])
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            EnrichmentTask.objects.filter(job=job).update(available_at=timezone.now())
+            [task] = claim_tasks('w1')
+            self.assertEqual(task.attempts, attempt)
+            fail_task(task, 'No data found')
+        task = EnrichmentTask.objects.get(job=job)
+        self.assertEqual(task.status, 'failed')
+        self.assertEqual(job_status(job.pk)['tasks']['failed'], 1)
+
+    def test_expired_lease_is_resumed_by_another_worker(self):
+        enqueue_enrichment('lead', ['a@x.com'])
+        [lost] = claim_tasks('dead-worker')
+        EnrichmentTask.objects.filter(pk=lost.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        [task] = claim_tasks('w2')
+        self.assertEqual(task.worker, 'w2')
+        # The dead worker can no longer record a result for it
+        self.assertFalse(complete_task(lost))
+        self.assertTrue(complete_task(task))
+
+    def test_tasks_claimed_meanwhile_are_not_claimed_again(self):
+        enqueue_enrichment('lead', ['a@x.com', 'b@x.com'])
+        real_lease_duration = enrichment_jobs.lease_duration
+
+        def other_worker_claims_first():
+            # Runs between choosing the tasks and the claiming update
+            EnrichmentTask.objects.filter(subject='a@x.com').update(
+                status='running', worker='w2', lease_expires_at=timezone.now() + timedelta(minutes=5),
+            )
+            return real_lease_duration()
+
+        with mock.patch('leads.enrichment_jobs.lease_duration', other_worker_claims_first):
+            claimed = claim_tasks('w1', 2)
+        self.assertEqual([task.subject for task in claimed], ['b@x.com'])
+        self.assertEqual(EnrichmentTask.objects.get(subject='a@x.com').worker, 'w2')
+
+    def test_worker_survives_database_errors(self):
+        command = 'leads.management.commands.run_enrichment_workers'
+        with mock.patch(f'{command}.claim_tasks', side_effect=[OperationalError('database is locked'), []]) as claim, \
+                mock.patch(f'{command}.has_runnable_work', return_value=False), \
+                self.assertLogs(command, 'ERROR'):
+            call_command(
+                'run_enrichment_workers', workers=1, poll=0, exit_when_empty=True, metrics_flush=0, stdout=StringIO(),
+            )
+        self.assertEqual(claim.call_count, 2)
+
+    def test_expired_leases_record_when_they_failed(self):
+        enqueue_enrichment('lead', ['a@x.com'])
+        long_ago = timezone.now() - timedelta(days=1)
+        EnrichmentTask.objects.update(
+            status='running', attempts=MAX_ATTEMPTS, lease_expires_at=long_ago, updated_at=long_ago,
+        )
+        claim_tasks('w1')
+        task = EnrichmentTask.objects.get()
+        self.assertEqual(task.status, 'failed')
+        self.assertGreater(task.updated_at, long_ago)
+
+    def test_no_data_found_is_not_retried(self):
+        Company.objects.create(domain='x.com')
+        Lead.objects.create(email='a@x.com', company_id='x.com')
+        job = enqueue_enrichment('lead', ['a@x.com'])
+        with mock.patch('leads.enrichment_jobs.enrich_lead', return_value=None):
+            counts = process_tasks(claim_tasks('w1'))
+        self.assertEqual(counts['failed'], 1)
+        task = EnrichmentTask.objects.get(job=job)
+        self.assertEqual((task.status, task.attempts, task.error), ('failed', 1, 'No data found'))
+        self.assertEqual(job_status(job.pk)['status'], 'completed')
+
+
+@mock.patch.dict('os.environ', {'GENAI_API_KEY': 'test', 'OPENAI_API_KEY': 'test'})
+class EnrichmentViewTests(TestCase):
+
+    def test_progress_page_returns_without_waiting_for_the_job(self):
+        Company.objects.create(domain='acme.com')
+        response = self.client.get(reverse('crm:ai_enrichment_stream'))
+        self.assertEqual(response.status_code, 200)
+        job = EnrichmentJob.objects.get(source='ai_enrichment_stream')
+        self.assertEqual(job.status, 'queued')
+        self.assertContains(response, reverse('crm:enrichment_job_status', args=[job.pk]))
+
+    def test_csv_import_queues_enrichment(self):
+        upload = SimpleUploadedFile('leads.csv', b'email,first_name\njane@acme.com,Jane\njoe@gmail.com,Joe\n')
+        with mock.patch('leads.enrichment.enrich_company') as enrich_company, \
+                mock.patch('leads.enrichment.enrich_lead') as enrich_lead:
+            self.client.post(reverse('crm:import_csv'), {'csv_file': upload})
+        enrich_company.assert_not_called()
+        enrich_lead.assert_not_called()
+        jobs = {job.kind: job for job in EnrichmentJob.objects.filter(source='import_csv')}
+        self.assertEqual(list(jobs['company'].tasks.values_list('subject', flat=True)), ['acme.com'])
+        self.assertEqual(jobs['lead'].total, 2)
+
+
+@override_settings(
+    ENRICHMENT_PROVIDERS={'gpt': 'stub', 'gemini': 'stub', 'search': 'stub'},
+    ENRICHMENT_STUB={'latency': 0, 'jitter': 0},
+    ENRICHMENT_RATE_LIMITS={service: {'rate': 1000, 'burst': 100} for service in ('ddgs', 'openai', 'gemini')},
+)
+class AsyncLeadWorkerTests(TransactionTestCase):
+    """Lead tasks on the asyncio pipeline; its DB thread needs committed rows."""
+
+    def setUp(self):
+        for reset in (reset_providers, reset_limiters, reset_breakers):
+            reset()
+            self.addCleanup(reset)
+        Company.objects.create(domain='acme.com', company_name='Acme Inc')
+        Lead.objects.create(email='jane.doe@acme.com', company_id='acme.com')
+        Lead.objects.create(email='john.roe@acme.com', company_id='acme.com', pdl_first_name='Johnny')
+
+    @override_settings(ENRICHMENT_ASYNC_LEADS=True)
+    def test_claimed_batch_runs_on_the_async_pipeline(self):
+        job = enqueue_enrichment('lead', ['jane.doe@acme.com', 'john.roe@acme.com', 'gone@acme.com'])
+        with mock.patch('leads.enrichment_jobs.enrich_lead') as sync_enrich:
+            counts = process_tasks(claim_tasks('w1', 10))
+        sync_enrich.assert_not_called()
+
+        self.assertEqual((counts['done'], counts['skipped']), (2, 1))
+        jane = Lead.objects.get(email='jane.doe@acme.com')
+        self.assertEqual((jane.pdl_first_name, jane.pdl_linkedin_url), ('Jane', 'https://www.linkedin.com/in/jane-doe'))
+        # Filled fields are kept without overwrite
+        self.assertEqual(Lead.objects.get(email='john.roe@acme.com').pdl_first_name, 'Johnny')
+        self.assertEqual(job_status(job.pk)['status'], 'completed')
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def test_opens_after_consecutive_failures_and_half_opens(self):
+        breaker = CircuitBreaker('gemini', failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.is_available())
+        with self.assertLogs('leads.circuit_breaker', 'WARNING'):
+            breaker.record_failure()
+        self.assertFalse(breaker.is_available())
+        with self.assertRaises(ProviderUnavailable):
+            breaker.before_call()
+
+        # After the reset timeout one trial call goes through
+        breaker.opened_at -= 60
+        breaker.before_call()
+        with self.assertRaises(ProviderUnavailable):
+            breaker.before_call()
+        with self.assertLogs('leads.circuit_breaker', 'WARNING'):
+            breaker.record_failure()
+        self.assertEqual(breaker.state()['state'], 'open')
+
+        breaker.opened_at -= 60
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state()['state'], 'closed')
+
+
+class StubProviderTests(SimpleTestCase):
+
+    def test_fixture_answers_are_deterministic(self):
+        stub = StubProvider('gpt', 'openai', latency=0, jitter=0)
+        prompt = build_company_batch_prompt([('acme.com', None, None), ('globex.io', None, None)])
+        answer = parse_json_response(stub.complete(prompt))
+        self.assertEqual([item['domain'] for item in answer], ['acme.com', 'globex.io'])
+        self.assertEqual(answer, parse_json_response(stub.complete(prompt)))
+        self.assertIsNotNone(validate_company_info(answer[0]))
+
+        candidates = [{'title': 'Acme', 'url': 'https://acme.com'}, {'title': 'Acme', 'url': 'https://www.linkedin.com/company/acme'}]
+        self.assertEqual(
+            stub.complete(build_url_selection_prompt('acme.com', candidates, 'linkedin')),
+            'https://www.linkedin.com/company/acme',
+        )
+
+    def test_error_rate(self):
+        stub = StubProvider('gemini', 'gemini', latency=0, jitter=0, error_rate=1)
+        with self.assertRaises(StubProviderError):
+            stub.complete('{}')
+
+
+class StageTimingTests(SimpleTestCase):
+
+    def test_listeners_receive_stage_durations(self):
+        timings = []
+        stage_listeners.append(lambda stage, seconds: timings.append(stage))
+        try:
+            @timed_stage('extract')
+            def extract():
+                with timed_stage('search'):
+                    pass
+            extract()
+        finally:
+            stage_listeners.clear()
+        self.assertEqual(timings, ['search', 'extract'])
+
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (50, 95, 99)], [50, 95, 99])
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertEqual(percentile([], 50), 0.0)
+
+
+class EnrichmentPlanTests(SimpleTestCase):
+
+    def company(self, **fields):
+        filled = {
+            field: 'x' for field in ('work_website', 'linkedin', 'company_name', 'industry', 'hq_country', 'org_type',
+                                     'tech_stack', 'street', 'city', 'state', 'postal_code', 'country', 'work_phone', 'facebook')
+        }
+        return Company(domain='acme.com', company_size=10, **{**filled, **fields})
+
+    def test_only_needed_stages_run(self):
+        self.assertEqual(plan_company(self.company(facebook='')).stages(), ['extract'])
+        self.assertEqual(plan_company(self.company(linkedin=None)).stages(), ['linkedin'])
+        self.assertFalse(plan_company(self.company()))
+        self.assertEqual(plan_company(self.company(), overwrite=True).stages(), ['website', 'linkedin', 'extract'])
+
+    def test_stale_fields_are_refreshed(self):
+        company = self.company()
+        plan = plan_company(self.company(industry=''))
+        record_attempt(company, plan, {'industry': 'Software'}, now=timezone.now() - timedelta(days=365))
+        self.assertEqual(plan_company(company).fields, {'industry'})
+
+    def test_repeated_failures_cool_down(self):
+        company = self.company(facebook='')
+        for _ in range(3):
+            record_attempt(company, plan_company(company), {'facebook': None})
+        self.assertFalse(plan_company(company))
+        self.assertEqual(company.enrichment_state['facebook']['failures'], 3)
+        later = timezone.now() + timedelta(days=31)
+        self.assertEqual(plan_company(company, now=later).fields, {'facebook'})
+
+
+class ProviderMetricsTests(TestCase):
+
+    def setUp(self):
+        reset_metrics()
+        reset_limiters()
+        self.addCleanup(reset_metrics)
+        self.addCleanup(reset_limiters)
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram((10, 100, 1000))
+        for value in [5] * 90 + [50] * 9 + [5000]:
+            histogram.observe(value)
+        self.assertEqual((histogram.percentile(50), histogram.percentile(95), histogram.percentile(100)), (10, 100, 5000))
+
+    def test_calls_record_outcome_retries_and_tokens(self):
+        answers = iter([StubRateLimitError(), 'ok'])
+
+        def call():
+            answer = next(answers)
+            if isinstance(answer, Exception):
+                raise answer
+            record_usage('gpt-4o-mini', 1000, 500)
+            return answer
+
+        with override_settings(ENRICHMENT_RATE_LIMITS={'test': {'rate': 1000, 'burst': 10}}):
+            with self.assertLogs('leads.rate_limit', 'WARNING'):
+                self.assertEqual(call_with_rate_limit('test', call), 'ok')
+            with self.assertRaises(ValueError):
+                call_with_rate_limit('test', lambda: int('x'))
+
+        metrics = metrics_snapshot()['test']
+        self.assertEqual((metrics['calls'], metrics['errors'], metrics['retries']), (2, 1, 1))
+        self.assertEqual((metrics['input_tokens'], metrics['output_tokens']), (1000, 500))
+        self.assertAlmostEqual(metrics['cost_usd'], 0.00045)
+
+        self.assertEqual(flush_metrics(), 1)
+        self.assertEqual(metrics_snapshot(), {})
+        recorded = recorded_metrics(timezone.now() - timedelta(minutes=5))['test']
+        self.assertEqual((recorded['calls'], recorded['latency_ms']['count']), (2, 2))
+
+    @override_settings(ENRICHMENT_RATE_LIMITS={'test': {'rate': 1000, 'burst': 10}})
+    def test_failed_flush_keeps_the_counters(self):
+        call_with_rate_limit('test', lambda: 'ok')
+        with mock.patch.object(ProviderMetric.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                flush_metrics()
+        call_with_rate_limit('test', lambda: 'ok')
+        self.assertEqual(metrics_snapshot()['test']['calls'], 2)
+
+        self.assertEqual(flush_metrics(), 1)
+        self.assertEqual(recorded_metrics(timezone.now() - timedelta(minutes=5))['test']['calls'], 2)
+
+
+class LeadCompanyContextTests(TestCase):
+
+    def test_contexts_come_from_enriched_companies_only(self):
+        Company.objects.create(domain='acme.com', company_name='Acme Inc', linkedin='https://linkedin.com/company/acme')
+        Company.objects.create(domain='unknown.io')
+        Company.objects.create(domain='gmail.com', company_name='Gmail')
+        contexts = company_contexts(['acme.com', 'unknown.io', 'gmail.com', 'missing.org'])
+        self.assertEqual(contexts['acme.com']['company_name'], 'Acme Inc')
+        self.assertEqual((contexts['unknown.io'], contexts['gmail.com'], contexts['missing.org']), ({}, {}, {}))
+
+    def test_queries_and_prompt_use_the_company(self):
+        company = {'domain': 'acme.com', 'company_name': 'Acme Inc', 'website': None, 'linkedin': None}
+        self.assertEqual(
+            person_search_queries('jane.doe2@acme.com', company)[0], 'jane doe "Acme Inc" site:linkedin.com/in',
+        )
+        self.assertEqual(person_search_queries('jane@acme.com')[0], '"jane@acme.com"')
+        self.assertIn('Company: Acme Inc (domain: acme.com)', build_lead_prompt('jane@acme.com', [], company=company))
+
+    def test_claimed_batch_builds_each_company_context_once(self):
+        Company.objects.create(domain='acme.com', company_name='Acme Inc')
+        Company.objects.create(domain='globex.com', company_name='Globex')
+        emails = {'a@acme.com': 90, 'b@globex.com': 80, 'c@acme.com': 70, 'd@globex.com': 60}
+        for email in emails:
+            Lead.objects.create(email=email, company_id=email.split('@')[1])
+        enqueue_enrichment('lead', emails, priorities=emails)
+
+        with mock.patch('leads.enrichment.company_context', wraps=enrichment.company_context) as build, \
+                mock.patch('leads.enrichment_jobs.enrich_lead', return_value={'updated': True}) as enrich:
+            process_tasks(claim_tasks('w1', 4))
+        self.assertEqual(sorted(call.args[0].domain for call in build.call_args_list), ['acme.com', 'globex.com'])
+        self.assertEqual(
+            [(call.args[0].email, call.kwargs['company']['company_name']) for call in enrich.call_args_list],
+            [('a@acme.com', 'Acme Inc'), ('c@acme.com', 'Acme Inc'), ('b@globex.com', 'Globex'), ('d@globex.com', 'Globex')],
+        )
+
+
+class EnrichmentScheduleTests(TestCase):
+
+    def test_lead_priority(self):
+        now = timezone.now()
+        active_enterprise = lead_priority(85, 'enterprise', now - timedelta(days=2), False, now)
+        stale_low = lead_priority(10, 'low', now - timedelta(days=400), False, now)
+        free_high = lead_priority(65, 'high', None, True, now)
+        self.assertEqual((active_enterprise, stale_low, free_high), (155, 10, 60))
+
+    def test_free_email_leads_rank_lower_by_domain(self):
+        Company.objects.create(domain='gmail.com')
+        # is_free_email is only set by the CSV import; the domain decides
+        joe = Lead.objects.create(email='joe@gmail.com', company_id='gmail.com', is_free_email=False)
+        [(email, priority)] = prioritized_leads(Lead.objects.all())
+        self.assertEqual(priority, lead_priority(joe.lead_score, joe.lead_stage, joe.last_active, True))
+        self.assertLess(priority, lead_priority(joe.lead_score, joe.lead_stage, joe.last_active, False))
+
+    @override_settings(ENRICHMENT_JOB_BUDGET={'calls': 0, 'cost_usd': 0.5, 'seconds': 1800})
+    def test_budget_form_shows_the_default_budget(self):
+        response = self.client.get(reverse('crm:ai_enrichment'))
+        self.assertContains(response, 'name="max_minutes" min="0" step="1" value="30"')
+        self.assertContains(response, 'name="max_cost" min="0" step="0.01" value="0.5"')
+
+    def test_budget_from_request(self):
+        self.assertEqual(parse_budget({'max_calls': '200', 'max_cost': '1.5', 'max_minutes': ''}), {'calls': 200, 'cost_usd': 1.5})
+        self.assertEqual(parse_budget({'max_minutes': '2'}), {'seconds': 120})
+        for params in ({'max_calls': 'lots'}, {'max_minutes': 'inf'}, {'max_cost': 'inf'}, {'max_minutes': 'nan'}):
+            with self.assertRaises(ValueError):
+                parse_budget(params)
+
+    def test_tasks_claimed_by_priority_and_deferred_when_over_budget(self):
+        job = enqueue_enrichment(
+            'lead', ['low@x.com', 'high@y.com', 'mid@z.com'],
+            priorities={'low@x.com': 1, 'high@y.com': 90, 'mid@z.com': 40}, budget={'calls': 3},
+        )
+        [task] = claim_tasks('w1')
+        self.assertEqual(task.subject, 'high@y.com')
+
+        spend = Spend()
+        spend.add(3, 0.01)
+        with self.assertLogs('leads.enrichment_jobs', 'WARNING'):
+            charge_job(task.job, spend)
+        status = job_status(job.pk)
+        self.assertEqual(status['status'], 'over_budget')
+        self.assertEqual([item['subject'] for item in status['deferred']], ['mid@z.com', 'low@x.com'])
+        self.assertEqual(status['spent']['calls'], 3)
+        self.assertEqual(claim_tasks('w2'), [])
+
+    def test_newer_jobs_with_higher_priority_are_claimed_first(self):
+        enqueue_enrichment('lead', ['low@x.com', 'lower@x.com'], priorities={'low@x.com': 10, 'lower@x.com': 5})
+        enqueue_enrichment('lead', ['high@y.com'], priorities={'high@y.com': 90})
+        self.assertEqual([task.subject for task in claim_tasks('w1', 2)], ['high@y.com'])
+        self.assertEqual([task.subject for task in claim_tasks('w1', 2)], ['low@x.com', 'lower@x.com'])
+
+    def test_wall_time_budget_counts_from_the_first_claim(self):
+        job = enqueue_enrichment('lead', ['a@x.com', 'b@x.com'], budget={'seconds': 60})
+        # Queued long before a worker picked it up
+        EnrichmentJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        [task] = claim_tasks('w1')
+        self.assertIsNotNone(task.job.started_at)
+        self.assertIsNone(job_budget_exceeded(task.job))
+
+        EnrichmentJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(minutes=2))
+        [task] = claim_tasks('w2')
+        self.assertEqual(job_budget_exceeded(task.job), 'seconds')
@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .views_recalculate import recalculate_scores
+from .views_recalculate import recalculate_scores, recalculate_status
 
 app_name = 'leads'
 
@@ -10,6 +10,7 @@ urlpatterns = [
     path('create/', views.lead_create, name='lead_create'),
     path('clear/', views.clear_leads, name='clear_leads'),
     path('recalculate/', recalculate_scores, name='recalculate_scores'),
+    path('recalculate/status/<str:job_id>/', recalculate_status, name='recalculate_status'),
     path('<str:pk>/edit/', views.lead_update, name='lead_update'),
     path('<str:pk>/delete/', views.lead_delete, name='lead_delete'),
     path('<str:pk>/view/', views.lead_detail, name='lead_detail'),
@@ -3,7 +3,8 @@ from django.contrib import messages
 from django.db.models import Q, Avg
 from .models import Lead, Company
 from .forms import LeadForm, CompanyForm
-from .enrichment import enrich_lead
+from .enrichment_jobs import enqueue_enrichment
+from .enrichment_schedule import describe_budget, parse_budget, prioritized_leads
 import os
 
 
@@ -111,7 +112,10 @@ def clear_leads(request):
 
 
 def lead_enrich(request):
-    """Enrich leads using AI with optional re-enrichment."""
+    """
+    Queue AI enrichment of leads, with optional re-enrichment. Leads are
+    enriched by priority; ?max_calls=, ?max_cost= and ?max_minutes= limit the job.
+    """
     enable_enrichment = os.getenv("GENAI_API_KEY") and os.getenv("OPENAI_API_KEY")
     if not enable_enrichment:
         messages.error(request, 'AI enrichment is disabled. Add GENAI_API_KEY and OPENAI_API_KEY to keys.env to enable.')
@@ -134,28 +138,24 @@ def lead_enrich(request):
         messages.info(request, 'No leads need enrichment.')
         return redirect('leads:lead_list')
 
-    enriched = 0
-    skipped = 0
-    errors = 0
-
-    for lead in leads:
-        try:
-            result = enrich_lead(lead, verbose=False, overwrite=overwrite)
-            if result and result.get('skipped'):
-                skipped += 1
-            elif result:
-                enriched += 1
-            else:
-                errors += 1
-        except Exception:
-            errors += 1
-            continue
-
-    msg = f'Lead enrichment completed. Enriched {enriched} lead(s).'
-    if skipped:
-        msg += f' Skipped {skipped}.'
-    if errors:
-        msg += f' {errors} error(s) occurred.'
-    messages.success(request, msg)
+    try:
+        budget = parse_budget(request.GET)
+    except ValueError:
+        messages.error(request, 'The enrichment budget must be a number.')
+        return redirect('leads:lead_list')
+
+    # Enrichment runs in the run_enrichment_workers process, highest priority first
+    ranked = prioritized_leads(leads)
+    job = enqueue_enrichment(
+        'lead', [email for email, _ in ranked], overwrite, source='leads', priorities=dict(ranked), budget=budget,
+    )
+    if job.total:
+        messages.success(
+            request,
+            f'Queued {job.total} lead(s) for enrichment (job #{job.pk}, budget: {describe_budget(job.budget)}). '
+            'Results are saved as the enrichment workers process them.'
+        )
+    else:
+        messages.info(request, 'These leads are already queued for enrichment.')
 
     return redirect('leads:lead_list')
@@ -1,11 +1,45 @@
-from django.http import HttpResponse
-from django.views.decorators.http import require_POST
-from django.core.management import call_command
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET, require_POST
 from django.contrib import messages
 from django.shortcuts import redirect
+from django.urls import reverse
+from .rescoring_jobs import RescoreJobRunning, job_status, start_rescore_job
+
+
+def wants_json(request):
+    return 'application/json' in request.headers.get('Accept', '')
+
+
+def enqueue_recalculation(request, success_message):
+    """Start a background rescoring job and answer with its id (JSON) or a redirect."""
+    try:
+        job_id = start_rescore_job()
+    except RescoreJobRunning as e:
+        if wants_json(request):
+            return JsonResponse({
+                'error': str(e),
+                'job_id': e.run_id,
+                'status_url': reverse('leads:recalculate_status', args=[e.run_id]),
+            }, status=409)
+        messages.warning(request, f'A score recalculation is already running (job {e.run_id}).')
+        return redirect(request.POST.get('next', '/'))
+
+    status_url = reverse('leads:recalculate_status', args=[job_id])
+    if wants_json(request):
+        return JsonResponse({'job_id': job_id, 'status_url': status_url}, status=202)
+    messages.success(request, f'{success_message} (job {job_id}).')
+    return redirect(request.POST.get('next', '/'))
+
 
 @require_POST
 def recalculate_scores(request):
-    call_command('recalculate_scores')
-    messages.success(request, 'Lead scores recalculated successfully.')
-    return redirect(request.POST.get('next', '/'))
+    return enqueue_recalculation(request, 'Lead score recalculation started in the background')
+
+
+@require_GET
+def recalculate_status(request, job_id):
+    """API endpoint with the progress, ETA and final stats of a recalculation job"""
+    status = job_status(job_id)
+    if status is None:
+        return JsonResponse({'error': f'Unknown job {job_id}'}, status=404)
+    return JsonResponse(status)
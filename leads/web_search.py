@@ -0,0 +1,103 @@
+"""
+Search layer for enrichment (DuckDuckGo, or the search provider configured
+in settings.ENRICHMENT_PROVIDERS, see providers.py).
+
+- Results are cached per normalized query (lowercase, single spaces) and
+  max_results in the EnrichmentCache table for
+  settings.ENRICHMENT_SEARCH_CACHE_TTL seconds
+- Lookups run their queries in tiers (search_tiers()): broader fallback
+  queries only run when the first ones found nothing useful
+- Each worker thread reuses one DDGS session instead of opening one per lookup
+- Live requests are paced by the 'ddgs' rate limiter (see rate_limit.py)
+"""
+
+import hashlib
+import logging
+from django.conf import settings
+from .enrichment_cache import cached_call
+from .providers import get_provider
+from .rate_limit import call_with_rate_limit
+
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_CACHE_VERSION = 'v2'
+DEFAULT_SEARCH_TTL = 7 * 24 * 3600
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+def live_search(query: str, max_results: int):
+    provider = get_provider('search')
+    try:
+        return call_with_rate_limit(provider.service, lambda: provider.search(query, max_results))
+    except Exception:
+        logger.exception('Search error for %r', query)
+        # The next search of this thread opens a new session
+        provider.reset()
+        return None
+
+
+def search_ttl() -> int:
+    return getattr(settings, 'ENRICHMENT_SEARCH_CACHE_TTL', DEFAULT_SEARCH_TTL)
+
+
+def search_cache_key(query: str, max_results: int) -> tuple:
+    """
+    (kind, subject, provider, prompt_version) cache key of a normalized query.
+    The subject is a hash, as queries can be longer than the subject column.
+    """
+    digest = hashlib.sha256(f'{query}\n{max_results}'.encode('utf-8')).hexdigest()
+    return 'search', digest, get_provider('search').cache_name, f'{SEARCH_CACHE_VERSION}:{max_results}'
+
+
+def dedup_results(results) -> list:
+    """Drop results whose URL was already seen, keeping the first."""
+    seen = set()
+    dedup = []
+    for item in results:
+        if item["url"] not in seen:
+            seen.add(item["url"])
+            dedup.append(item)
+    return dedup
+
+
+def search_web(query: str, max_results: int = 10, use_cache: bool = True) -> list:
+    """
+    Search DuckDuckGo, reusing cached results for the same normalized query.
+
+    Returns:
+        list: [{'title': str, 'url': str, 'snippet': str, 'query': str}, ...]
+              (empty if the search failed; failures are not cached)
+    """
+    query = normalize_query(query)
+    results = cached_call(
+        *search_cache_key(query, max_results),
+        lambda: live_search(query, max_results),
+        use_cache,
+        ttl=search_ttl(),
+    )
+    return [dict(result, query=query) for result in results or []]
+
+
+def search_many(queries: list, max_results: int = 10, use_cache: bool = True) -> list:
+    """Run several searches and return their results without duplicate URLs, in order."""
+    return dedup_results(
+        item for query in queries for item in search_web(query, max_results, use_cache)
+    )
+
+
+def search_tiers(tiers: list, found, max_results: int = 10, use_cache: bool = True) -> list:
+    """
+    Run tiers of queries in order until found(results) holds for the results
+    so far, e.g. tiers of increasingly broad queries for one lookup.
+    """
+    results = []
+    for queries in tiers:
+        results = dedup_results(results + search_many(queries, max_results, use_cache))
+        if found(results):
+            break
+    return results